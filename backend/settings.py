@@ -65,6 +65,41 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 DATABASES = {
     'default': dj_database_url.config(conn_max_age=600, default='sqlite:///'+os.path.join(BASE_DIR, 'db.sqlite3'))
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Las pruebas de concurrencia abren una conexión por hilo: la base de
+    # pruebas debe estar en un archivo y no en memoria compartida
+    DATABASES['default']['TEST'] = {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')}
+
+# Caché compartida entre procesos (Redis si está configurado; si no, memoria
+# local). En producción debe ser compartida: las claves de idempotencia de
+# las reservas dependen de ella (`manage.py check --deploy` lo verifica)
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+
+# Días desde el fin de una reserva tras los cuales se mueve al archivo
+BOOKING_ARCHIVE_AFTER_DAYS = config('BOOKING_ARCHIVE_AFTER_DAYS', default=365, cast=int)
+
+# Correo saliente (recordatorios y avisos de reservas)
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='webmaster@localhost')
+
+# Horas de anticipación con que se envían los recordatorios de reserva
+BOOKING_REMINDER_HOURS = config('BOOKING_REMINDER_HOURS', default=24, cast=int)
+
+# Servicio de calendario externo al que se envían los cambios de las reservas
+CALENDAR_SYNC_URL = config('CALENDAR_SYNC_URL', default='')
+CALENDAR_SYNC_TIMEOUT = config('CALENDAR_SYNC_TIMEOUT', default=10, cast=int)
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from .models import (
     BookingSettings, ResourceType, Agent, Resource,
-    Schedule, Booking, BlockedTime
+    Schedule, Booking, BlockedTime, RecurringBlock, AvailableSlot, SlotHold,
+    UtilizationRollup, ArchivedBooking, BookingNotification, WaitlistEntry,
+    CalendarSyncEvent
 )
 
 @admin.register(BookingSettings)
@@ -60,7 +62,7 @@ class ScheduleInline(admin.TabularInline):
 
 @admin.register(Resource)
 class ResourceAdmin(admin.ModelAdmin):
-    list_display = ('name', 'type', 'company', 'price', 'duration', 'is_active')
+    list_display = ('name', 'type', 'company', 'price', 'duration', 'capacity', 'is_active')
     list_filter = ('is_active', 'type', 'company')
     search_fields = ('name', 'company__name')
     inlines = [ScheduleInline]
@@ -70,7 +72,7 @@ class ResourceAdmin(admin.ModelAdmin):
             'fields': ('name', 'type', 'company', 'description')
         }),
         ('Detalles del Servicio', {
-            'fields': ('price', 'duration', 'availability_type')
+            'fields': ('price', 'duration', 'capacity', 'availability_type')
         }),
         ('Configuración de Agentes', {
             'fields': ('agents', 'is_active'),
@@ -127,4 +129,69 @@ class BlockedTimeAdmin(admin.ModelAdmin):
         ('Período', {
             'fields': ('start_datetime', 'end_datetime', 'reason')
         }),
-    )
\ No newline at end of file
+    )
+
+@admin.register(RecurringBlock)
+class RecurringBlockAdmin(admin.ModelAdmin):
+    list_display = ('get_name', 'frequency', 'start_time', 'end_time', 'start_date', 'end_date', 'reason')
+    list_filter = ('frequency',)
+    search_fields = ('resource__name', 'agent__name', 'reason')
+    
+    def get_name(self, obj):
+        return obj.resource.name if obj.resource else obj.agent.name
+    get_name.short_description = 'Recurso/Agente'
+    
+    fieldsets = (
+        ('Asignación', {
+            'fields': ('resource', 'agent'),
+            'description': 'Seleccione un recurso O un agente, no ambos'
+        }),
+        ('Recurrencia', {
+            'fields': ('frequency', 'days_of_week', 'start_date', 'end_date', 'excluded_dates')
+        }),
+        ('Horario', {
+            'fields': ('start_time', 'end_time', 'reason'),
+            'description': 'Deje las horas vacías para bloquear el día completo'
+        }),
+    )
+
+@admin.register(AvailableSlot)
+class AvailableSlotAdmin(admin.ModelAdmin):
+    list_display = ('resource', 'date', 'start_datetime', 'end_datetime')
+    list_filter = ('date', 'resource__company')
+    search_fields = ('resource__name',)
+
+@admin.register(SlotHold)
+class SlotHoldAdmin(admin.ModelAdmin):
+    list_display = ('resource', 'agent', 'user', 'start_datetime', 'end_datetime', 'expires_at')
+    list_filter = ('resource__company',)
+    search_fields = ('resource__name', 'user__username')
+
+@admin.register(UtilizationRollup)
+class UtilizationRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'resource', 'agent', 'booked_minutes', 'scheduled_minutes')
+    list_filter = ('date', 'company')
+
+@admin.register(ArchivedBooking)
+class ArchivedBookingAdmin(admin.ModelAdmin):
+    list_display = ('original_id', 'resource', 'user', 'start_datetime', 'status', 'archived_at')
+    list_filter = ('status', 'company')
+    search_fields = ('resource__name', 'user__username', 'user__email')
+
+@admin.register(BookingNotification)
+class BookingNotificationAdmin(admin.ModelAdmin):
+    list_display = ('booking', 'kind', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('kind', 'status')
+    raw_id_fields = ('booking', 'waitlist_entry')
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('resource', 'agent', 'user', 'window_start', 'window_end', 'auto_book', 'status')
+    list_filter = ('status', 'auto_book', 'resource__company')
+    search_fields = ('resource__name', 'user__username', 'user__email')
+    raw_id_fields = ('booking',)
+
+@admin.register(CalendarSyncEvent)
+class CalendarSyncEventAdmin(admin.ModelAdmin):
+    list_display = ('booking_id', 'company', 'event', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('event', 'status', 'company')
@@ -0,0 +1,332 @@
+"""
+Admisión de reservas.
+
+La verificación de solapamientos y el guardado ocurren en la misma transacción,
+con las filas del recurso y del agente bloqueadas. Dos solicitudes concurrentes
+para el mismo recurso o agente se atienden una tras otra, mientras que las de
+recursos distintos no se esperan entre sí.
+
+Las retenciones temporales (`SlotHold`) vigentes de otros usuarios cuentan
+como ocupadas; las del propio usuario se consumen al reservar. En los
+recursos con capacidad mayor que uno, reservas y retenciones ocupan un cupo
+cada una y se rechaza solo si el pico de uso simultáneo, calculado con un
+barrido sobre los intervalos leídos, alcanza la capacidad.
+"""
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .availability import (
+    BUSY_STATUSES, ConcurrencyIndex, IntervalIndex, day_bounds, day_windows,
+    peak_concurrency, recurring_block_intervals, weekly_windows
+)
+from .cache import invalidate_dashboard
+from .calendar_sync import record_booking_events
+from .inventory import refresh_for_intervals
+from .utilization import record_new_bookings
+from .models import Agent, Resource, Booking, BlockedTime, SlotHold, WaitlistEntry
+
+# Minutos que dura una retención de horario
+HOLD_MINUTES = 10
+
+HELD_MESSAGE = "El horario está retenido temporalmente por otro usuario"
+FULL_MESSAGE = "El recurso no tiene cupo disponible en este horario"
+
+
+def lock_booking_targets(resource_id, agent_ids=()):
+    """
+    Bloquea el recurso y los agentes hasta el fin de la transacción en curso.
+    Siempre en el mismo orden (recurso y luego agentes por id) para evitar
+    interbloqueos. Debe ser la primera sentencia de la transacción.
+    """
+    agent_ids = sorted(set(agent_id for agent_id in agent_ids if agent_id))
+    if connection.vendor == 'sqlite':
+        # SQLite no soporta SELECT ... FOR UPDATE: una escritura inicial toma
+        # el bloqueo de escritura de la base y serializa las admisiones. Si la
+        # transacción ya leyó, dos solicitudes con el bloqueo compartido no
+        # pueden pasar a escritura y SQLite falla de inmediato sin esperar
+        Resource.objects.filter(pk=resource_id).update(is_active=F('is_active'))
+        return
+
+    list(Resource.objects.select_for_update().filter(
+        pk=resource_id
+    ).values_list('pk', flat=True))
+    if agent_ids:
+        list(Agent.objects.select_for_update().filter(
+            pk__in=agent_ids
+        ).order_by('pk').values_list('pk', flat=True))
+
+
+def _active_holds(user, **lookups):
+    """Retenciones vigentes que no pertenecen a `user`."""
+    holds = SlotHold.objects.filter(expires_at__gt=timezone.now(), **lookups)
+    if user:
+        holds = holds.exclude(user=user)
+    return holds
+
+
+def find_conflict(resource, agent, start_datetime, end_datetime, exclude=None, user=None):
+    """
+    Devuelve el motivo por el que el intervalo no puede reservarse, o None si
+    está libre. Las retenciones de `user` no cuentan. Debe llamarse con los
+    objetivos ya bloqueados.
+    """
+    overlap = {
+        'start_datetime__lt': end_datetime,
+        'end_datetime__gt': start_datetime,
+    }
+    bookings = Booking.objects.filter(status__in=BUSY_STATUSES, **overlap)
+    if exclude:
+        bookings = bookings.exclude(pk=exclude)
+
+    holds = _active_holds(user, **overlap)
+    if resource.capacity > 1:
+        # Cada reserva o retención ajena ocupa un cupo
+        usage = list(bookings.filter(resource=resource).values_list('start_datetime', 'end_datetime'))
+        usage += holds.filter(resource=resource).values_list('start_datetime', 'end_datetime')
+        if peak_concurrency(usage, start_datetime, end_datetime) >= resource.capacity:
+            return FULL_MESSAGE
+    elif bookings.filter(resource=resource).exists():
+        return "El recurso no está disponible en este horario"
+    if BlockedTime.objects.filter(resource=resource, **overlap).exists() or _recurring_overlap(
+            'resource', resource.pk, start_datetime, end_datetime):
+        return "El recurso está bloqueado en este horario"
+
+    if agent:
+        if bookings.filter(agent=agent).exists():
+            return "El agente no está disponible en este horario"
+        if BlockedTime.objects.filter(agent=agent, **overlap).exists() or _recurring_overlap(
+                'agent', agent.pk, start_datetime, end_datetime):
+            return "El agente está bloqueado en este horario"
+
+    if resource.capacity == 1 and holds.filter(resource=resource).exists():
+        return HELD_MESSAGE
+    if agent and holds.filter(agent=agent).exists():
+        return HELD_MESSAGE
+    return None
+
+
+def hold_slot(resource, agent, user, start_datetime, end_datetime, minutes=HOLD_MINUTES):
+    """
+    Retiene el intervalo para `user` durante `minutes`. Devuelve la
+    retención creada o el motivo por el que no puede retenerse. Debe llamarse
+    con los objetivos ya bloqueados.
+    """
+    now = timezone.now()
+    # Limpieza oportunista de retenciones vencidas: borrado por rango sobre
+    # el índice de vencimiento
+    SlotHold.objects.filter(expires_at__lte=now).delete()
+
+    conflict = find_conflict(resource, agent, start_datetime, end_datetime, user=user)
+    if conflict:
+        return None, conflict
+    # Una retención nueva del mismo usuario sobre el recurso reemplaza a las anteriores
+    SlotHold.objects.filter(user=user, resource=resource).delete()
+    hold = SlotHold.objects.create(
+        resource=resource, agent=agent, user=user,
+        start_datetime=start_datetime, end_datetime=end_datetime,
+        expires_at=now + timedelta(minutes=minutes)
+    )
+    return hold, None
+
+
+def release_holds(user, resource, bookings):
+    """
+    Elimina las retenciones de `user` que se solapan con alguna de las
+    reservas admitidas. Las que caen entre ocurrencias rechazadas de una
+    serie siguen vigentes. Si la retención era una oferta de la lista de
+    espera, la solicitud queda reservada con la reserva que la ocupó.
+    """
+    overlaps = Q()
+    for booking in bookings:
+        overlaps |= Q(start_datetime__lt=booking.end_datetime, end_datetime__gt=booking.start_datetime)
+    if not overlaps:
+        return
+    holds = SlotHold.objects.filter(overlaps, user=user, resource=resource)
+    consumed = list(holds.values_list('start_datetime', 'end_datetime', 'expires_at'))
+    if not consumed:
+        return
+    holds.delete()
+    for start_datetime, end_datetime, expires_at in consumed:
+        booking = next(
+            booking for booking in bookings
+            if booking.start_datetime < end_datetime and start_datetime < booking.end_datetime
+        )
+        WaitlistEntry.objects.filter(
+            user=user, resource=resource, status='offered', offer_expires_at=expires_at
+        ).update(status='booked', booking=booking)
+
+
+def candidate_agent_ids(resource):
+    """Agentes activos que pueden atender el recurso."""
+    return list(resource.agents.filter(is_active=True).values_list('pk', flat=True))
+
+
+def assign_agent(resource, start_datetime, end_datetime, exclude=None, user=None):
+    """
+    Elige el agente del recurso libre en [start_datetime, end_datetime) con
+    menos reservas activas ese día, o None si ninguno está libre. Conflictos,
+    bloqueos, retenciones de otros usuarios y carga de los candidatos salen
+    de una sola consulta con subconsultas acotadas al intervalo (un JOIN con
+    todo el historial de reservas multiplicaría las filas); los horarios y
+    bloqueos recurrentes se verifican con dos consultas más. Debe llamarse
+    con el recurso y los candidatos ya bloqueados para que dos solicitudes
+    no elijan al mismo agente.
+    """
+    window_start, window_end = day_bounds(timezone.localtime(start_datetime).date())
+    overlap = {
+        'start_datetime__lt': end_datetime,
+        'end_datetime__gt': start_datetime,
+    }
+    bookings = Booking.objects.filter(agent=OuterRef('pk'), status__in=BUSY_STATUSES)
+    if exclude:
+        bookings = bookings.exclude(pk=exclude)
+    load = bookings.filter(
+        start_datetime__lt=window_end, end_datetime__gt=window_start
+    ).order_by().values('agent').annotate(total=Count('pk')).values('total')
+
+    candidates = list(resource.agents.filter(is_active=True).filter(
+        ~Exists(bookings.filter(**overlap)),
+        ~Exists(BlockedTime.objects.filter(agent=OuterRef('pk'), **overlap)),
+        ~Exists(_active_holds(user, agent=OuterRef('pk'), **overlap)),
+    ).annotate(
+        load=Coalesce(Subquery(load), 0)
+    ).order_by('load', 'pk'))
+    if not candidates:
+        return None
+
+    candidate_ids = [agent.pk for agent in candidates]
+    weekly = weekly_windows('agent', candidate_ids)
+    recurring = recurring_block_intervals('agent', candidate_ids, start_datetime, end_datetime)
+    day = timezone.localtime(start_datetime).date()
+    for agent in candidates:
+        # El intervalo debe caber en una ventana del horario del agente
+        fits = any(
+            opens <= start_datetime and end_datetime <= closes
+            for opens, closes in day_windows(weekly.get(agent.pk, {}), day)
+        )
+        if fits and not IntervalIndex(recurring[agent.pk]).overlaps(start_datetime, end_datetime):
+            return agent
+    return None
+
+
+def _recurring_overlap(field, owner_id, start_datetime, end_datetime):
+    intervals = recurring_block_intervals(field, [owner_id], start_datetime, end_datetime)[owner_id]
+    return IntervalIndex(intervals).overlaps(start_datetime, end_datetime)
+
+
+def admit_occurrences(resource, agent, occurrences, **fields):
+    """
+    Admite varias reservas del mismo recurso/agente de una sola vez.
+
+    Las ocurrencias se comparan contra las reservas y bloqueos existentes
+    leídos en bloque para todo el rango, y las aceptadas se insertan con un
+    único bulk_create (que no emite señales: los resúmenes de ocupación, el
+    inventario, la sincronización de calendarios y el tablero se actualizan
+    aquí). Debe llamarse dentro de una transacción
+    con los objetivos ya bloqueados.
+
+    Devuelve una lista de resultados por ocurrencia, en el orden recibido.
+    """
+    if not occurrences:
+        return []
+
+    range_start = min(start for start, end in occurrences)
+    range_end = max(end for start, end in occurrences)
+    overlap = {
+        'start_datetime__lt': range_end,
+        'end_datetime__gt': range_start,
+    }
+    owners = Q(resource=resource)
+    if agent:
+        owners |= Q(agent=agent)
+
+    busy = {
+        'resource_booking': [], 'resource_blocked': [],
+        'agent_booking': [], 'agent_blocked': [],
+    }
+    bookings = Booking.objects.filter(
+        owners, status__in=BUSY_STATUSES, **overlap
+    ).order_by().values_list('resource_id', 'agent_id', 'start_datetime', 'end_datetime')
+    blocked = BlockedTime.objects.filter(
+        owners, **overlap
+    ).order_by().values_list('resource_id', 'agent_id', 'start_datetime', 'end_datetime')
+    for kind, rows in (('booking', bookings), ('blocked', blocked)):
+        for resource_id, agent_id, start, end in rows:
+            if resource_id == resource.pk:
+                busy[f'resource_{kind}'].append((start, end))
+            if agent and agent_id == agent.pk:
+                busy[f'agent_{kind}'].append((start, end))
+    held = {'resource': [], 'agent': []}
+    holds = _active_holds(fields.get('user'), **overlap).filter(owners).order_by().values_list(
+        'resource_id', 'agent_id', 'start_datetime', 'end_datetime'
+    )
+    for resource_id, agent_id, start, end in holds:
+        if resource_id == resource.pk:
+            held['resource'].append((start, end))
+        if agent and agent_id == agent.pk:
+            held['agent'].append((start, end))
+    busy['resource_blocked'] += recurring_block_intervals(
+        'resource', [resource.pk], range_start, range_end
+    )[resource.pk]
+    if agent:
+        busy['agent_blocked'] += recurring_block_intervals(
+            'agent', [agent.pk], range_start, range_end
+        )[agent.pk]
+
+    capacity = resource.capacity
+    checks = [
+        (IntervalIndex(busy['resource_blocked']), "El recurso está bloqueado en este horario"),
+        (IntervalIndex(busy['agent_booking']), "El agente no está disponible en este horario"),
+        (IntervalIndex(busy['agent_blocked']), "El agente está bloqueado en este horario"),
+    ]
+    if capacity > 1:
+        # Uso simultáneo del recurso; crece con cada ocurrencia aceptada
+        usage = ConcurrencyIndex(busy['resource_booking'] + held['resource'])
+        checks.append((IntervalIndex(held['agent']), HELD_MESSAGE))
+    else:
+        checks.insert(0, (IntervalIndex(busy['resource_booking']), "El recurso no está disponible en este horario"))
+        checks.append((IntervalIndex(held['resource'] + held['agent']), HELD_MESSAGE))
+
+    results = [None] * len(occurrences)
+    accepted = []
+    latest_end = None
+    # Recorridas por inicio, una ocurrencia choca con otra ya aceptada
+    # si empieza antes del mayor fin aceptado hasta el momento. Con capacidad
+    # mayor que uno y sin agente pueden solaparse mientras haya cupo
+    exclusive = capacity == 1 or agent is not None
+    for index in sorted(range(len(occurrences)), key=lambda i: occurrences[i]):
+        start, end = occurrences[index]
+        error = next((message for intervals, message in checks if intervals.overlaps(start, end)), None)
+        if error is None and capacity > 1 and usage.peak(start, end) >= capacity:
+            error = FULL_MESSAGE
+        if error is None and exclusive and latest_end is not None and start < latest_end:
+            error = "Se solapa con otra ocurrencia de la misma solicitud"
+        if error:
+            results[index] = {'start_datetime': start, 'end_datetime': end, 'status': 'rejected', 'error': error}
+            continue
+        latest_end = end if latest_end is None else max(latest_end, end)
+        if capacity > 1:
+            usage.add(start, end)
+        booking = Booking(resource=resource, agent=agent, start_datetime=start, end_datetime=end, **fields)
+        accepted.append(booking)
+        results[index] = {'start_datetime': start, 'end_datetime': end, 'status': 'accepted', 'booking': booking}
+
+    Booking.objects.bulk_create(accepted, batch_size=500)
+    record_new_bookings(accepted)
+    record_booking_events(accepted, 'created')
+    if accepted and fields.get('user'):
+        release_holds(fields['user'], resource, accepted)
+    if accepted:
+        interval = (
+            resource.pk, agent.pk if agent else None,
+            min(booking.start_datetime for booking in accepted),
+            max(booking.end_datetime for booking in accepted)
+        )
+        transaction.on_commit(lambda: refresh_for_intervals([interval]))
+        transaction.on_commit(lambda: invalidate_dashboard(resource.company_id))
+    for result in results:
+        if result['status'] == 'accepted':
+            result['booking'] = result['booking'].pk
+    return results
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BookingengineConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bookingEngine'
+
+    def ready(self):
+        from . import checks  # noqa: F401
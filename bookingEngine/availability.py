@@ -0,0 +1,467 @@
+"""
+Motor de disponibilidad del sistema de reservas.
+
+Calcula los slots libres de un recurso restando de su ventana horaria las
+reservas activas, los tiempos bloqueados y las retenciones vigentes. Todos los
+datos del día se obtienen con un número fijo de consultas y el cálculo se hace
+en memoria con intervalos ordenados. Los recursos con capacidad mayor que uno
+solo se consideran ocupados donde sus reservas simultáneas alcanzan esa
+capacidad, lo que se calcula con un barrido sobre los inicios y fines de las
+reservas.
+"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from itertools import chain
+from django.db.models import Q
+from django.utils import timezone
+from .models import Resource, Schedule, Booking, BlockedTime, RecurringBlock, SlotHold
+
+# Estados de reserva que ocupan el horario del recurso
+BUSY_STATUSES = ('pending', 'confirmed')
+
+
+def make_aware_datetime(day, moment):
+    """Combina una fecha y una hora en un datetime con la zona horaria actual."""
+    return timezone.make_aware(
+        datetime.combine(day, moment),
+        timezone.get_current_timezone()
+    )
+
+
+def day_bounds(day):
+    """Devuelve el inicio y el fin (exclusivo) de un día."""
+    start = make_aware_datetime(day, time.min)
+    return start, make_aware_datetime(day + timedelta(days=1), time.min)
+
+
+def merge_intervals(intervals):
+    """Ordena y fusiona los intervalos que se solapan o son contiguos."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract_intervals(windows, busy):
+    """
+    Resta los intervalos ocupados de las ventanas disponibles.
+    Recorre ambas listas ordenadas una sola vez.
+    """
+    busy = merge_intervals(busy)
+    free = []
+    first = 0
+    for window_start, window_end in merge_intervals(windows):
+        cursor = window_start
+        # Descartar los ocupados que terminan antes de la ventana
+        while first < len(busy) and busy[first][1] <= cursor:
+            first += 1
+        index = first
+        while index < len(busy) and busy[index][0] < window_end:
+            busy_start, busy_end = busy[index]
+            if busy_start > cursor:
+                free.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            index += 1
+        if cursor < window_end:
+            free.append((cursor, window_end))
+    return free
+
+
+def split_into_slots(free, anchor, duration):
+    """
+    Divide los intervalos libres en slots de `duration` minutos alineados
+    con `anchor` (normalmente el inicio del horario).
+    """
+    step = timedelta(minutes=duration)
+    slots = []
+    for start, end in free:
+        offset = (start - anchor) % step
+        slot_start = start + (step - offset) if offset else start
+        while slot_start + step <= end:
+            slots.append((slot_start, slot_start + step))
+            slot_start += step
+    return slots
+
+
+class IntervalIndex:
+    """
+    Conjunto de intervalos ocupados que responde en O(log n) si un intervalo
+    se solapa con alguno de ellos.
+    """
+
+    def __init__(self, intervals=()):
+        merged = merge_intervals(intervals)
+        self.starts = [start for start, end in merged]
+        self.ends = [end for start, end in merged]
+
+    def overlaps(self, start, end):
+        # Los intervalos fusionados son disjuntos y están ordenados, así que
+        # basta con mirar el último que empieza antes de `end`
+        index = bisect_left(self.starts, end)
+        return index > 0 and self.ends[index - 1] > start
+
+
+def concurrency_steps(intervals):
+    """
+    Barrido sobre los inicios y fines de los intervalos: devuelve la
+    ocupación como función escalonada [(instante, intervalos activos desde
+    ese instante), ...]. En un mismo instante los fines se cuentan antes que
+    los inicios, porque los intervalos son semiabiertos.
+    """
+    events = sorted(chain(
+        ((start, 1) for start, end in intervals),
+        ((end, -1) for start, end in intervals)
+    ))
+    steps = []
+    count = 0
+    for moment, delta in events:
+        count += delta
+        if steps and steps[-1][0] == moment:
+            steps[-1] = (moment, count)
+        else:
+            steps.append((moment, count))
+    return steps
+
+
+def peak_concurrency(intervals, start, end):
+    """Máximo de intervalos simultáneos dentro de [start, end)."""
+    clipped = [
+        (max(busy_start, start), min(busy_end, end))
+        for busy_start, busy_end in intervals
+        if busy_start < end and busy_end > start
+    ]
+    return max((count for moment, count in concurrency_steps(clipped)), default=0)
+
+
+def saturated_intervals(intervals, capacity):
+    """Intervalos donde la ocupación alcanza `capacity`."""
+    saturated = []
+    opened = None
+    for moment, count in concurrency_steps(intervals):
+        if count >= capacity and opened is None:
+            opened = moment
+        elif count < capacity and opened is not None:
+            saturated.append((opened, moment))
+            opened = None
+    return saturated
+
+
+class ConcurrencyIndex:
+    """
+    Ocupación de un recurso como función escalonada. Responde el pico dentro
+    de un intervalo por bisección y admite sumar intervalos nuevos, para
+    validar varias reservas de una misma solicitud contra la capacidad.
+    """
+
+    def __init__(self, intervals=()):
+        steps = concurrency_steps(intervals)
+        self.moments = [moment for moment, count in steps]
+        self.counts = [count for moment, count in steps]
+
+    def peak(self, start, end):
+        first = bisect_right(self.moments, start) - 1
+        last = bisect_left(self.moments, end)
+        # Antes del primer instante la ocupación es cero
+        counts = self.counts[max(first, 0):last]
+        return max(counts if first >= 0 else [0] + counts, default=0)
+
+    def add(self, start, end):
+        for moment in (start, end):
+            index = bisect_left(self.moments, moment)
+            if index == len(self.moments) or self.moments[index] != moment:
+                self.moments.insert(index, moment)
+                self.counts.insert(index, self.counts[index - 1] if index else 0)
+        for index in range(bisect_left(self.moments, start), bisect_left(self.moments, end)):
+            self.counts[index] += 1
+
+
+def intersect_intervals(first, second):
+    """Intersección de dos listas de intervalos."""
+    first, second = merge_intervals(first), merge_intervals(second)
+    result = []
+    i = j = 0
+    while i < len(first) and j < len(second):
+        start = max(first[i][0], second[j][0])
+        end = min(first[i][1], second[j][1])
+        if start < end:
+            result.append((start, end))
+        if first[i][1] < second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def weekly_windows(field, ids):
+    """
+    Horarios semanales agrupados por recurso o agente (`field` es 'resource'
+    o 'agent'): {owner_id: {día_semana: [(hora_inicio, hora_fin), ...]}}.
+    Una sola consulta.
+    """
+    weekly = defaultdict(lambda: defaultdict(list))
+    schedules = Schedule.objects.filter(**{
+        f'{field}__in': ids
+    }).values_list(field, 'day_of_week', 'start_time', 'end_time')
+    for owner_id, day_of_week, start_time, end_time in schedules:
+        weekly[owner_id][day_of_week].append((start_time, end_time))
+    return weekly
+
+
+def day_windows(weekly, day):
+    """Ventanas de un día concreto a partir de un horario semanal."""
+    return [
+        (make_aware_datetime(day, start_time), make_aware_datetime(day, end_time))
+        for start_time, end_time in weekly.get(day.weekday(), [])
+    ]
+
+
+def busy_intervals(field, ids, start, end, holds=True, capacities=None):
+    """
+    Reservas activas, bloqueos, bloqueos recurrentes y retenciones vigentes
+    (si `holds`) que se solapan con [start, end), agrupados por recurso o
+    agente. Cuatro consultas sin importar cuántos ids se pidan.
+
+    Para los dueños con capacidad mayor que uno (`capacities`, {id:
+    capacidad}) las reservas y retenciones solo ocupan donde alcanzan esa
+    capacidad; los bloqueos siempre ocupan.
+    """
+    lookups = {
+        f'{field}__in': ids,
+        'start_datetime__lt': end,
+        'end_datetime__gt': start,
+    }
+    bookings = Booking.objects.filter(
+        status__in=BUSY_STATUSES, **lookups
+    ).order_by().values_list(field, 'start_datetime', 'end_datetime')
+    blocked = BlockedTime.objects.filter(
+        **lookups
+    ).order_by().values_list(field, 'start_datetime', 'end_datetime')
+
+    held = SlotHold.objects.filter(
+        expires_at__gt=timezone.now(), **lookups
+    ).order_by().values_list(field, 'start_datetime', 'end_datetime') if holds else []
+
+    busy = recurring_block_intervals(field, ids, start, end)
+    for owner_id, busy_start, busy_end in blocked:
+        busy[owner_id].append((busy_start, busy_end))
+    usage = defaultdict(list)
+    for owner_id, busy_start, busy_end in chain(bookings, held):
+        usage[owner_id].append((busy_start, busy_end))
+    for owner_id, intervals in usage.items():
+        capacity = capacities.get(owner_id, 1) if capacities else 1
+        busy[owner_id].extend(
+            intervals if capacity <= 1 else saturated_intervals(intervals, capacity)
+        )
+    return {owner_id: merge_intervals(intervals) for owner_id, intervals in busy.items()}
+
+
+def recurring_block_intervals(field, ids, start, end):
+    """
+    Expande las reglas de bloqueo recurrente de los recursos o agentes solo
+    para los días de [start, end), sin materializar filas. Una consulta.
+    """
+    first_day = timezone.localtime(start).date()
+    last_day = timezone.localtime(end - timedelta(microseconds=1)).date()
+    rules = RecurringBlock.objects.filter(**{
+        f'{field}__in': ids,
+        'start_date__lte': last_day,
+    }).filter(Q(end_date__isnull=True) | Q(end_date__gte=first_day))
+
+    blocked = defaultdict(list)
+    for rule in rules:
+        owner_id = getattr(rule, f'{field}_id')
+        for day in date_range(first_day, last_day):
+            if not rule.occurs_on(day):
+                continue
+            if rule.start_time is None:
+                blocked[owner_id].append(day_bounds(day))
+            else:
+                blocked[owner_id].append((
+                    make_aware_datetime(day, rule.start_time),
+                    make_aware_datetime(day, rule.end_time)
+                ))
+    return blocked
+
+
+def date_range(date_from, date_to):
+    day = date_from
+    while day <= date_to:
+        yield day
+        day += timedelta(days=1)
+
+
+def format_slots(slots):
+    return [{'start': start, 'end': end} for start, end in slots]
+
+
+class AvailabilityData:
+    """
+    Datos precargados para calcular la disponibilidad de varios recursos en
+    un rango de fechas. Horarios, reservas y bloqueos se obtienen en bloque
+    al construir la instancia, por lo que el coste depende de las filas
+    leídas y no del número de recursos o días consultados.
+
+    `agents` permite fijar los agentes a evaluar por recurso
+    ({resource_id: [agent_id, ...]}); si se omite, se usan los agentes
+    activos de los recursos cuyo tipo requiere agente. Con `holds=False` se
+    ignoran las retenciones temporales.
+    """
+
+    def __init__(self, resources, date_from, date_to, agents=None, now=None, holds=True):
+        self.now = now or timezone.now()
+        self.range_start = day_bounds(date_from)[0]
+        self.range_end = day_bounds(date_to)[1]
+
+        resource_ids = [resource.pk for resource in resources]
+        self.resource_weekly = weekly_windows('resource', resource_ids)
+        self.resource_busy = busy_intervals(
+            'resource', resource_ids, self.range_start, self.range_end, holds,
+            capacities={resource.pk: resource.capacity for resource in resources}
+        )
+
+        if agents is None:
+            agent_resource_ids = [
+                resource.pk for resource in resources if resource.type.requires_agent
+            ]
+            agents = defaultdict(list)
+            if agent_resource_ids:
+                links = Resource.agents.through.objects.filter(
+                    resource_id__in=agent_resource_ids,
+                    agent__is_active=True
+                ).values_list('resource_id', 'agent_id')
+                for resource_id, agent_id in links:
+                    agents[resource_id].append(agent_id)
+        self.agents = agents
+
+        agent_ids = sorted({agent_id for ids in agents.values() for agent_id in ids})
+        self.agent_weekly = weekly_windows('agent', agent_ids) if agent_ids else {}
+        self.agent_busy = busy_intervals(
+            'agent', agent_ids, self.range_start, self.range_end, holds
+        ) if agent_ids else {}
+
+    def resource_windows(self, resource, day):
+        """Ventanas de atención de un recurso para un día."""
+        if resource.availability_type == 'always':
+            return [day_bounds(day)]
+        return day_windows(self.resource_weekly.get(resource.pk, {}), day)
+
+    def resource_free(self, resource, day):
+        """Intervalos libres del recurso en un día, sin contar agentes."""
+        windows = self.resource_windows(resource, day)
+        if not windows:
+            return [], None
+        busy = list(self.resource_busy.get(resource.pk, []))
+        # Los slots que ya comenzaron no se ofrecen
+        if self.now > windows[0][0]:
+            busy.append((windows[0][0], self.now))
+        return subtract_intervals(windows, busy), windows[0][0]
+
+    def resource_slots(self, resource, day):
+        """
+        Slots libres de un recurso en un día: horario menos reservas
+        pendientes/confirmadas, tiempos bloqueados y horas ya pasadas.
+        """
+        free, anchor = self.resource_free(resource, day)
+        if not free:
+            return []
+        return split_into_slots(free, anchor, resource.duration)
+
+    def agent_slots(self, resource, day):
+        """
+        Slots del recurso para cada uno de sus agentes: intersección del
+        horario del recurso y del agente, menos las reservas y bloqueos de
+        ambos. Devuelve {agent_id: [(inicio, fin), ...]}.
+        """
+        agent_ids = self.agents.get(resource.pk, [])
+        free, anchor = self.resource_free(resource, day)
+        slots = {}
+        for agent_id in agent_ids:
+            if not free:
+                slots[agent_id] = []
+                continue
+            windows = day_windows(self.agent_weekly.get(agent_id, {}), day)
+            shared = intersect_intervals(free, windows)
+            agent_free = subtract_intervals(shared, self.agent_busy.get(agent_id, []))
+            slots[agent_id] = split_into_slots(agent_free, anchor, resource.duration)
+        return slots
+
+    def any_agent_slots(self, resource, day):
+        """
+        Slots del recurso atendidos por cualquier agente calificado. Cada
+        slot indica los agentes que pueden atenderlo.
+        """
+        merged = defaultdict(list)
+        for agent_id, slots in self.agent_slots(resource, day).items():
+            for slot in slots:
+                merged[slot].append(agent_id)
+        return [
+            {'start': start, 'end': end, 'agents': sorted(merged[(start, end)])}
+            for start, end in sorted(merged)
+        ]
+
+    def available_slots(self, resource, day):
+        """Slots ya formateados, con agentes si el recurso los requiere."""
+        if resource.type.requires_agent:
+            return self.any_agent_slots(resource, day)
+        return format_slots(self.resource_slots(resource, day))
+
+
+def resource_available_slots(resource, day, now=None):
+    """Slots libres de un recurso en un día, sin considerar agentes."""
+    data = AvailabilityData([resource], day, day, agents={}, now=now)
+    return data.resource_slots(resource, day)
+
+
+def agent_free_intervals(agent, day, now=None):
+    """Intervalos libres de un agente en un día según su propio horario."""
+    windows = day_windows(weekly_windows('agent', [agent.pk])[agent.pk], day)
+    if not windows:
+        return []
+    busy = busy_intervals('agent', [agent.pk], windows[0][0], windows[-1][1]).get(agent.pk, [])
+    now = now or timezone.now()
+    if now > windows[0][0]:
+        busy = busy + [(windows[0][0], now)]
+    return subtract_intervals(windows, busy)
+
+
+def resource_agent_slots(resource, agents, day, now=None):
+    """
+    Slots de un recurso para cada uno de los agentes indicados, resueltos
+    todos en la misma pasada. Devuelve {agent_id: [(inicio, fin), ...]}.
+    """
+    agent_ids = [agent.pk for agent in agents]
+    data = AvailabilityData([resource], day, day, agents={resource.pk: agent_ids}, now=now)
+    return data.agent_slots(resource, day)
+
+
+def any_agent_slots(resource, day, now=None):
+    """Slots de un recurso atendidos por cualquier agente activo calificado."""
+    data = AvailabilityData([resource], day, day, now=now)
+    return data.any_agent_slots(resource, day)
+
+
+def availability_matrix(resources, date_from, date_to, limits=None, now=None):
+    """
+    Matriz de disponibilidad de varios recursos en un rango de fechas a
+    partir de una única carga en bloque. `limits` permite recortar el rango
+    por recurso ({resource_id: última_fecha_permitida}).
+    """
+    data = AvailabilityData(resources, date_from, date_to, now=now)
+    limits = limits or {}
+    matrix = []
+    for resource in resources:
+        last_day = min(date_to, limits.get(resource.pk, date_to))
+        matrix.append({
+            'resource': resource.pk,
+            'name': resource.name,
+            'days': [
+                {'date': day, 'available_slots': data.available_slots(resource, day)}
+                for day in date_range(date_from, last_day)
+            ]
+        })
+    return matrix
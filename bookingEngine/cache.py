@@ -0,0 +1,138 @@
+"""
+Cachés del sistema de reservas.
+
+Los datos que cambian poco y se leen en cada reserva se guardan en dos niveles:
+una copia en memoria del proceso, de vida corta, y la caché compartida de
+Django (`CACHES`). Las señales de los modelos invalidan ambos niveles al
+guardar o eliminar; los demás procesos ven el cambio al expirar su copia local.
+"""
+import hashlib
+import json
+import time
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from marketplace.models import Company
+from .models import BookingSettings
+
+# Segundos que vive cada nivel de la caché
+SETTINGS_CACHE_TIMEOUT = 60 * 60
+LOCAL_CACHE_TIMEOUT = 30
+OWNERSHIP_CACHE_TIMEOUT = 60 * 60
+IDEMPOTENCY_TIMEOUT = 24 * 60 * 60
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+DASHBOARD_CACHE_TIMEOUT = 60
+
+_MISSING = object()
+_local_settings = {}
+
+
+def _settings_key(company_id):
+    return f'bookingEngine:settings:{company_id}'
+
+
+def get_booking_settings(company_id):
+    """
+    Configuración de reservas de una empresa, o None si no la tiene.
+    Con la caché caliente no realiza consultas.
+    """
+    now = time.monotonic()
+    entry = _local_settings.get(company_id)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    settings = cache.get(_settings_key(company_id), _MISSING)
+    if settings is _MISSING:
+        settings = BookingSettings.objects.filter(company_id=company_id).order_by('pk').first()
+        cache.set(_settings_key(company_id), settings, SETTINGS_CACHE_TIMEOUT)
+
+    _local_settings[company_id] = (now + LOCAL_CACHE_TIMEOUT, settings)
+    return settings
+
+
+def invalidate_booking_settings(company_id):
+    _local_settings.pop(company_id, None)
+    cache.delete(_settings_key(company_id))
+
+
+def _owned_companies_key(user_id):
+    return f'bookingEngine:owned-companies:{user_id}'
+
+
+def get_owned_company_ids(user):
+    """
+    Ids de las empresas de las que el usuario es dueño. Se resuelven una vez
+    por petición (quedan guardados en el propio usuario) y se comparten entre
+    peticiones a través de la caché.
+    """
+    company_ids = getattr(user, '_owned_company_ids', None)
+    if company_ids is not None:
+        return company_ids
+
+    company_ids = cache.get(_owned_companies_key(user.pk))
+    if company_ids is None:
+        company_ids = frozenset(
+            Company.objects.filter(user_id=user.pk).values_list('id', flat=True)
+        )
+        cache.set(_owned_companies_key(user.pk), company_ids, OWNERSHIP_CACHE_TIMEOUT)
+
+    user._owned_company_ids = company_ids
+    return company_ids
+
+
+def invalidate_owned_companies(*user_ids):
+    cache.delete_many([_owned_companies_key(user_id) for user_id in user_ids if user_id])
+
+
+def _idempotency_key(user_id, key):
+    # v2: las entradas guardan también la ruta y la huella del cuerpo
+    return f'bookingEngine:idempotency:v2:{user_id}:{key}'
+
+
+def request_body_hash(data):
+    """Huella del cuerpo de la solicitud, independiente del orden de las claves."""
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def get_idempotent_response(user_id, key):
+    """
+    Respuesta guardada para la clave, como (ruta, huella_del_cuerpo, status,
+    data), o None.
+    """
+    return cache.get(_idempotency_key(user_id, key))
+
+
+def store_idempotent_response(user_id, key, path, body_hash, status, data):
+    cache.set(
+        _idempotency_key(user_id, key), (path, body_hash, status, data), IDEMPOTENCY_TIMEOUT
+    )
+
+
+def acquire_idempotency_lock(user_id, key):
+    """
+    Marca la clave como en curso. Devuelve False si otra solicitud con la
+    misma clave se está procesando.
+    """
+    return cache.add(_idempotency_key(user_id, key) + ':lock', True, IDEMPOTENCY_LOCK_TIMEOUT)
+
+
+def release_idempotency_lock(user_id, key):
+    cache.delete(_idempotency_key(user_id, key) + ':lock')
+
+
+def _dashboard_key(company_id):
+    return f'bookingEngine:dashboard:{company_id}'
+
+
+def get_cached_dashboard(company_id):
+    return cache.get(_dashboard_key(company_id))
+
+
+def store_dashboard(company_id, dashboard):
+    cache.set(_dashboard_key(company_id), dashboard, DASHBOARD_CACHE_TIMEOUT)
+
+
+def invalidate_dashboard(*company_ids):
+    cache.delete_many([_dashboard_key(company_id) for company_id in company_ids if company_id])
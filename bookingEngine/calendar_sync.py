@@ -0,0 +1,156 @@
+"""
+Sincronización de las reservas con el calendario externo de cada empresa.
+
+Los cambios de las reservas se registran como `CalendarSyncEvent` en la
+misma transacción que los produce, sin llamadas remotas en la petición.
+`push_pending` los toma por lotes y envía una sola solicitud por empresa y
+lote. Los cambios de una misma reserva se combinan en uno: se envía el
+estado actual de la reserva, sin importar cuántas veces cambió. Si el envío
+falla, los cambios se reintentan con espera exponencial (ver `outbox`).
+
+El servicio de calendario se configura con `CALENDAR_SYNC_URL`; las
+credenciales de cada empresa salen de
+`BookingSettings.google_calendar_credentials` (`access_token` y, opcional,
+`calendar_id`).
+"""
+import logging
+from collections import defaultdict
+import requests
+from django.conf import settings
+from django.utils import timezone
+from .cache import get_booking_settings
+from .models import Booking, CalendarSyncEvent
+from .outbox import claim_batch, mark_failed, mark_sent, retry_later, save_batch
+
+logger = logging.getLogger(__name__)
+
+# Cambios tomados por lote
+SYNC_BATCH_SIZE = 200
+# Intentos antes de dar un cambio por fallido
+MAX_ATTEMPTS = 6
+RETRY_BASE_MINUTES = 1
+
+DEFAULT_TIMEOUT = 10
+
+
+class CalendarSyncError(Exception):
+    pass
+
+
+class CalendarClient:
+    """
+    Cliente HTTP del servicio de calendario. Reutiliza la conexión entre
+    lotes. Cada lote se envía como
+    POST {base_url}/calendars/{calendar_id}/events/batch con
+    {"changes": [...]}; cualquier respuesta que no sea 2xx es un error.
+    """
+
+    def __init__(self, base_url=None, timeout=None, session=None):
+        self.base_url = (base_url or getattr(settings, 'CALENDAR_SYNC_URL', '')).rstrip('/')
+        self.timeout = timeout or getattr(settings, 'CALENDAR_SYNC_TIMEOUT', DEFAULT_TIMEOUT)
+        self.session = session or requests.Session()
+
+    def push(self, credentials, changes):
+        calendar_id = credentials.get('calendar_id') or 'primary'
+        try:
+            response = self.session.post(
+                f'{self.base_url}/calendars/{calendar_id}/events/batch',
+                json={'changes': changes},
+                headers={'Authorization': f"Bearer {credentials.get('access_token', '')}"},
+                timeout=self.timeout
+            )
+        except requests.RequestException as error:
+            raise CalendarSyncError(str(error)) from error
+        if not 200 <= response.status_code < 300:
+            raise CalendarSyncError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+
+def sync_enabled(company_settings):
+    return bool(
+        company_settings and company_settings.google_calendar_enabled
+        and company_settings.google_calendar_credentials
+    )
+
+
+def record_booking_events(bookings, event):
+    """
+    Registra el cambio de las reservas de empresas con calendario externo.
+    Debe llamarse dentro de la transacción que modifica las reservas.
+    """
+    events = []
+    for booking in bookings:
+        company_id = booking.resource.company_id
+        if sync_enabled(get_booking_settings(company_id)):
+            events.append(CalendarSyncEvent(company_id=company_id, booking_id=booking.pk, event=event))
+    if events:
+        CalendarSyncEvent.objects.bulk_create(events, batch_size=500)
+
+
+def booking_change(booking_id, booking):
+    """Estado actual de la reserva tal como se envía al calendario."""
+    event_id = f'booking-{booking_id}'
+    if booking is None or booking.status == 'cancelled':
+        return {'id': event_id, 'action': 'delete'}
+    customer = booking.user.get_full_name() or booking.user.username
+    return {
+        'id': event_id,
+        'action': 'upsert',
+        'start': booking.start_datetime.isoformat(),
+        'end': booking.end_datetime.isoformat(),
+        'summary': f'{booking.resource.name} - {customer}',
+        'description': booking.notes,
+        'agent': booking.agent.name if booking.agent else None,
+        'status': booking.status,
+    }
+
+
+def push_pending(batch_size=SYNC_BATCH_SIZE, max_batches=None, client=None):
+    """
+    Envía los cambios pendientes cuyo intento ya corresponde. Devuelve
+    (reservas_sincronizadas, cambios_con_error).
+    """
+    client = client or CalendarClient()
+    if not client.base_url:
+        logger.warning("CALENDAR_SYNC_URL no está configurada; no se sincronizan calendarios")
+        return 0, 0
+
+    synced = failed = batches = 0
+    while max_batches is None or batches < max_batches:
+        now = timezone.now()
+        batch = claim_batch(CalendarSyncEvent.objects.all(), batch_size, now)
+        if not batch:
+            break
+        batches += 1
+
+        # Cambios agrupados por empresa y reserva; cada reserva se envía una vez
+        grouped = defaultdict(lambda: defaultdict(list))
+        for event in batch:
+            grouped[event.company_id][event.booking_id].append(event)
+        bookings = Booking.objects.select_related('resource', 'agent', 'user').in_bulk(
+            [event.booking_id for event in batch]
+        )
+
+        for company_id, booking_events in grouped.items():
+            events = [event for group in booking_events.values() for event in group]
+            company_settings = get_booking_settings(company_id)
+            if not sync_enabled(company_settings):
+                mark_failed(events, "La empresa no tiene activada la sincronización de calendario")
+                failed += len(events)
+                continue
+            changes = [
+                booking_change(booking_id, bookings.get(booking_id))
+                for booking_id in booking_events
+            ]
+            try:
+                client.push(company_settings.google_calendar_credentials, changes)
+            except CalendarSyncError as error:
+                retry_later(events, str(error), now, MAX_ATTEMPTS, RETRY_BASE_MINUTES)
+                failed += len(events)
+                continue
+            mark_sent(events, now)
+            synced += len(changes)
+
+        save_batch(batch)
+        if len(batch) < batch_size:
+            break
+    return synced, failed
@@ -0,0 +1,31 @@
+"""
+Verificaciones de configuración del sistema de reservas.
+"""
+from django.conf import settings
+from django.core import checks
+
+# Backends de caché cuyo contenido no ven los demás procesos
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Las claves de idempotencia, su bloqueo y las invalidaciones de la caché
+    viven en la caché por defecto: con una caché por proceso, un reintento
+    atendido por otro proceso crearía la reserva de nuevo. Se verifica con
+    `manage.py check --deploy`.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [checks.Error(
+            "La caché por defecto no se comparte entre procesos: las claves de "
+            "idempotencia de las reservas no protegen contra reintentos.",
+            hint="Configure REDIS_URL o una caché compartida en CACHES['default'].",
+            obj=backend,
+            id='bookingEngine.E001',
+        )]
+    return []
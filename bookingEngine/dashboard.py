@@ -0,0 +1,107 @@
+"""
+Tablero del dueño de una empresa.
+
+Reúne en una respuesta lo que antes requería varios endpoints: las reservas
+de hoy, las próximas por recurso, las confirmaciones pendientes, las
+cancelaciones de la semana y los ingresos por pedidos. Se calcula con cuatro
+consultas agregadas y se guarda brevemente en caché (ver `cache`); las
+señales de `Booking` y `Order` lo invalidan al escribir.
+"""
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from marketplace.models import Order
+from .availability import BUSY_STATUSES, day_bounds
+from .cache import get_cached_dashboard, store_dashboard
+from .models import Booking
+
+
+def _money(value):
+    # Como los DecimalField de DRF: texto con dos decimales
+    return str((value or Decimal('0')).quantize(Decimal('0.01')))
+
+
+def company_dashboard(company_id, now=None):
+    """Tablero de la empresa, desde la caché si está vigente."""
+    dashboard = get_cached_dashboard(company_id)
+    if dashboard is None:
+        dashboard = build_dashboard(company_id, now)
+        store_dashboard(company_id, dashboard)
+    return dashboard
+
+
+def build_dashboard(company_id, now=None):
+    now = now or timezone.now()
+    today = timezone.localtime(now).date()
+    today_start, today_end = day_bounds(today)
+    week_start = day_bounds(today - timedelta(days=today.weekday()))[0]
+    month_start = day_bounds(today.replace(day=1))[0]
+    bookings = Booking.objects.filter(resource__company_id=company_id).order_by()
+
+    today_bookings = list(bookings.filter(
+        start_datetime__gte=today_start, start_datetime__lt=today_end
+    ).order_by('start_datetime', 'pk').values(
+        'id', 'start_datetime', 'end_datetime', 'status',
+        'resource_id', 'resource__name', 'agent__name', 'user__username'
+    ))
+
+    # Las cancelaciones se fechan por su última modificación
+    counts = bookings.filter(
+        Q(status='pending', start_datetime__gte=now) |
+        Q(status='cancelled', updated_at__gte=week_start)
+    ).aggregate(
+        pending=Count('pk', filter=Q(status='pending')),
+        cancelled=Count('pk', filter=Q(status='cancelled'))
+    )
+
+    upcoming = bookings.filter(
+        start_datetime__gte=now, status__in=BUSY_STATUSES
+    ).values('resource_id', 'resource__name').annotate(
+        upcoming=Count('pk')
+    ).order_by('resource__name')
+
+    revenue = Order.objects.filter(
+        company_id=company_id, created_at__gte=min(week_start, month_start)
+    ).aggregate(
+        today=Sum('total', filter=Q(created_at__gte=today_start)),
+        week=Sum('total', filter=Q(created_at__gte=week_start)),
+        month=Sum('total', filter=Q(created_at__gte=month_start)),
+        orders_today=Count('pk', filter=Q(created_at__gte=today_start))
+    )
+
+    return {
+        'company': company_id,
+        'generated_at': now,
+        'today': {
+            'date': today,
+            'total': len(today_bookings),
+            'by_status': dict(Counter(booking['status'] for booking in today_bookings)),
+            'bookings': [
+                {
+                    'id': booking['id'],
+                    'start_datetime': booking['start_datetime'],
+                    'end_datetime': booking['end_datetime'],
+                    'status': booking['status'],
+                    'resource': booking['resource_id'],
+                    'resource_name': booking['resource__name'],
+                    'agent_name': booking['agent__name'],
+                    'user': booking['user__username'],
+                }
+                for booking in today_bookings
+            ],
+        },
+        'pending_confirmations': counts['pending'],
+        'cancellations_this_week': counts['cancelled'],
+        'upcoming_by_resource': [
+            {'resource': row['resource_id'], 'resource_name': row['resource__name'], 'upcoming': row['upcoming']}
+            for row in upcoming
+        ],
+        'revenue': {
+            'today': _money(revenue['today']),
+            'week': _money(revenue['week']),
+            'month': _money(revenue['month']),
+            'orders_today': revenue['orders_today'],
+        },
+    }
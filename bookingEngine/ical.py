@@ -0,0 +1,136 @@
+"""
+Calendarios iCalendar (RFC 5545) de las reservas de una empresa o agente.
+
+Los calendarios se publican en una URL con un token firmado, porque las
+aplicaciones de calendario no envían credenciales. El contenido se genera
+mientras se envía, leyendo las reservas con `.iterator()`, y la versión del
+calendario (ETag y Last-Modified) sale de una sola consulta agregada sobre
+`Booking.updated_at`, de modo que los sondeos frecuentes responden 304 sin
+recorrer las reservas.
+"""
+import hashlib
+from datetime import timedelta, timezone as dt_timezone
+from django.core import signing
+from django.db.models import Count, Max
+from django.utils import timezone
+from .models import Booking
+
+# Días de reservas pasadas que se siguen publicando
+FEED_PAST_DAYS = 30
+FEED_CHUNK_SIZE = 500
+
+FEED_KINDS = ('company', 'agent')
+_signer = signing.Signer(salt='bookingEngine.calendar-feed')
+
+# Estado iCalendar de cada estado de reserva
+EVENT_STATUS = {
+    'pending': 'TENTATIVE',
+    'confirmed': 'CONFIRMED',
+    'completed': 'CONFIRMED',
+    'cancelled': 'CANCELLED',
+}
+
+
+def feed_token(kind, pk):
+    return _signer.sign(f'{kind}-{pk}')
+
+
+def read_feed_token(token):
+    """Devuelve (tipo, id) del token, o None si no es válido."""
+    try:
+        kind, pk = _signer.unsign(token).split('-')
+        pk = int(pk)
+    except (signing.BadSignature, ValueError):
+        return None
+    if kind not in FEED_KINDS:
+        return None
+    return kind, pk
+
+
+def feed_bookings(kind, pk, now=None):
+    """Reservas publicadas en el calendario de la empresa o del agente."""
+    since = (now or timezone.now()) - timedelta(days=FEED_PAST_DAYS)
+    owner = {'resource__company_id': pk} if kind == 'company' else {'agent_id': pk}
+    return Booking.objects.filter(end_datetime__gte=since, **owner)
+
+
+def feed_version(bookings):
+    """
+    (etag, last_modified) del calendario. El número de reservas entra en el
+    ETag para que una reserva eliminada también cambie la versión.
+    """
+    version = bookings.order_by().aggregate(last_modified=Max('updated_at'), total=Count('pk'))
+    last_modified = version['last_modified']
+    etag = hashlib.md5(
+        f"{version['total']}:{last_modified.isoformat() if last_modified else ''}".encode()
+    ).hexdigest()
+    return etag, last_modified
+
+
+def escape_text(value):
+    return (
+        value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def fold_line(line):
+    """Parte las líneas de más de 75 octetos como exige RFC 5545."""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts, current = [], b''
+    for char in line:
+        size = len(char.encode())
+        if len(current) + size > (75 if not parts else 74):
+            parts.append(current.decode())
+            current = b''
+        current += char.encode()
+    parts.append(current.decode())
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def format_datetime(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def render_event(row, domain):
+    (pk, start, end, status, notes, updated_at,
+     resource_name, agent_name, first_name, last_name, username) = row
+    customer = f'{first_name} {last_name}'.strip() or username
+    summary = f'{resource_name} - {customer}'
+    if agent_name:
+        summary += f' ({agent_name})'
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:booking-{pk}@{domain}',
+        f'DTSTAMP:{format_datetime(updated_at)}',
+        f'LAST-MODIFIED:{format_datetime(updated_at)}',
+        f'DTSTART:{format_datetime(start)}',
+        f'DTEND:{format_datetime(end)}',
+        f'SUMMARY:{escape_text(summary)}',
+        f'STATUS:{EVENT_STATUS.get(status, "CONFIRMED")}',
+    ]
+    if notes:
+        lines.append(f'DESCRIPTION:{escape_text(notes)}')
+    lines.append('END:VEVENT')
+    return ''.join(fold_line(line) for line in lines)
+
+
+def render_feed(bookings, name, domain):
+    """Genera el calendario por partes, sin cargar todas las reservas."""
+    yield ''.join(fold_line(line) for line in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:-//{domain}//bookingEngine//ES',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape_text(name)}',
+    ])
+    rows = bookings.order_by('start_datetime', 'pk').values_list(
+        'pk', 'start_datetime', 'end_datetime', 'status', 'notes', 'updated_at',
+        'resource__name', 'agent__name', 'user__first_name', 'user__last_name', 'user__username'
+    )
+    for row in rows.iterator(chunk_size=FEED_CHUNK_SIZE):
+        yield render_event(row, domain)
+    yield fold_line('END:VCALENDAR')
@@ -0,0 +1,118 @@
+"""
+Inventario materializado de slots libres (`AvailableSlot`).
+
+Cada recurso activo guarda sus slots desde hoy hasta el límite de anticipación
+de su empresa. Los cambios en reservas, bloqueos, horarios y recursos solo
+recalculan los días afectados; el comando `rebuild_slot_inventory` reconstruye
+todo y descarta los días ya pasados.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from .availability import AvailabilityData, date_range, day_bounds
+from .cache import get_booking_settings
+from .models import AvailableSlot, Resource
+
+# Recursos recalculados por lote al reconstruir el inventario completo
+REBUILD_BATCH_SIZE = 100
+
+
+def _horizons(resources, today):
+    """Última fecha reservable de cada recurso según su empresa."""
+    horizons = {}
+    for resource in resources:
+        settings = get_booking_settings(resource.company_id)
+        horizons[resource.pk] = today + timedelta(days=settings.advance_booking_limit if settings else 0)
+    return horizons
+
+
+def refresh_inventory(resource_ids, date_from=None, date_to=None):
+    """
+    Recalcula los slots de los recursos indicados entre `date_from` y
+    `date_to` (por defecto, todo su horizonte de reservas).
+    """
+    resource_ids = list(resource_ids)
+    if not resource_ids:
+        return
+
+    today = timezone.localdate()
+    first_day = max(date_from or today, today)
+    resources = list(
+        Resource.objects.filter(pk__in=resource_ids, is_active=True).select_related('type')
+    )
+    horizons = _horizons(resources, today)
+    last_day = date_to or max(horizons.values(), default=first_day)
+
+    rows = []
+    if resources and first_day <= last_day:
+        # Se guardan también los slots de hoy ya iniciados; las lecturas
+        # filtran por la hora actual. Las retenciones vencen sin ningún
+        # evento que recalcule el inventario, así que no se descuentan aquí
+        data = AvailabilityData(
+            resources, first_day, last_day, now=day_bounds(first_day)[0], holds=False
+        )
+        for resource in resources:
+            for day in date_range(first_day, min(last_day, horizons[resource.pk])):
+                for slot in data.available_slots(resource, day):
+                    rows.append(AvailableSlot(
+                        resource=resource,
+                        date=day,
+                        start_datetime=slot['start'],
+                        end_datetime=slot['end'],
+                        agents=slot.get('agents', [])
+                    ))
+
+    stale = AvailableSlot.objects.filter(resource_id__in=resource_ids, date__gte=first_day)
+    if date_to:
+        stale = stale.filter(date__lte=date_to)
+
+    with transaction.atomic():
+        stale.delete()
+        AvailableSlot.objects.bulk_create(rows, batch_size=500)
+
+
+def _linked_resources(agent_id):
+    return list(Resource.agents.through.objects.filter(
+        agent_id=agent_id
+    ).values_list('resource_id', flat=True))
+
+
+def refresh_for_owner(resource_id, agent_id):
+    """Recalcula el horizonte completo de un recurso o de los recursos de un agente."""
+    if resource_id:
+        refresh_inventory([resource_id])
+    elif agent_id:
+        refresh_inventory(_linked_resources(agent_id))
+
+
+def refresh_for_intervals(intervals):
+    """
+    Recalcula solo los días tocados por los intervalos
+    [(resource_id, agent_id, inicio, fin), ...].
+    """
+    for resource_id, agent_id, start, end in intervals:
+        first_day = timezone.localtime(start).date()
+        last_day = timezone.localtime(end - timedelta(microseconds=1)).date()
+        resource_ids = set()
+        if resource_id:
+            resource_ids.add(resource_id)
+        if agent_id:
+            resource_ids.update(_linked_resources(agent_id))
+        refresh_inventory(resource_ids, first_day, last_day)
+
+
+def rebuild_inventory(resource_ids=None):
+    """
+    Reconstruye el inventario de todos los recursos (o de los indicados) y
+    elimina los slots de días pasados. Devuelve el número de recursos
+    procesados.
+    """
+    AvailableSlot.objects.filter(date__lt=timezone.localdate()).delete()
+
+    resources = Resource.objects.order_by('pk')
+    if resource_ids:
+        resources = resources.filter(pk__in=resource_ids)
+    ids = list(resources.values_list('pk', flat=True))
+    for index in range(0, len(ids), REBUILD_BATCH_SIZE):
+        refresh_inventory(ids[index:index + REBUILD_BATCH_SIZE])
+    return len(ids)
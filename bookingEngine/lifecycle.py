@@ -0,0 +1,142 @@
+"""
+Ciclo de vida de las reservas una vez terminadas.
+
+Las reservas confirmadas cuyo fin ya pasó se marcan como completadas en lotes
+acotados: cada lote se elige por el índice (status, end_datetime) y se
+actualiza en su propia transacción, así que los bloqueos duran lo que tarda
+un lote y no toda la pasada.
+
+Las reservas que terminaron hace más de `BOOKING_ARCHIVE_AFTER_DAYS` días se
+mueven, también por lotes, a `ArchivedBooking`, de modo que la tabla de
+reservas solo conserva los datos vivos.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from .models import ArchivedBooking, Booking
+
+# Reservas actualizadas o archivadas por transacción
+COMPLETE_BATCH_SIZE = 500
+ARCHIVE_BATCH_SIZE = 500
+
+# Antigüedad por defecto, en días, a partir de la cual se archiva
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+
+_archiving = ContextVar('archiving', default=False)
+
+
+def _ended_confirmed(now):
+    return Booking.objects.filter(status='confirmed', end_datetime__lte=now)
+
+
+def complete_past_bookings(batch_size=COMPLETE_BATCH_SIZE, max_batches=None, pause=0, now=None):
+    """
+    Pasa a 'completed' las reservas confirmadas terminadas antes de `now`.
+    Devuelve el número de reservas actualizadas.
+
+    Es una actualización directa (sin señales): confirmada y completada
+    cuentan igual en los resúmenes de ocupación y ninguna de las dos deja
+    huecos en la disponibilidad pasada.
+    """
+    now = now or timezone.now()
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            ids = list(_ended_confirmed(now).order_by(
+                'end_datetime'
+            ).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            total += Booking.objects.filter(pk__in=ids, status='confirmed').update(
+                status='completed', updated_at=timezone.now()
+            )
+        batches += 1
+        if len(ids) < batch_size:
+            break
+        if pause:
+            # Deja pasar a otras escrituras entre lotes
+            time.sleep(pause)
+    return total
+
+
+def completion_lag(now=None):
+    """
+    Cuánto va atrasada la transición: reservas confirmadas ya terminadas y
+    el fin de la más antigua. Una consulta sobre el índice (status, end_datetime).
+    """
+    now = now or timezone.now()
+    lag = _ended_confirmed(now).aggregate(pending=Count('pk'), oldest=Min('end_datetime'))
+    lag['delay'] = now - lag['oldest'] if lag['oldest'] else None
+    return lag
+
+
+def is_archiving():
+    """Indica a las señales de `Booking` que el borrado es un archivo, no una baja."""
+    return _archiving.get()
+
+
+@contextmanager
+def _archive_context():
+    token = _archiving.set(True)
+    try:
+        yield
+    finally:
+        _archiving.reset(token)
+
+
+def archive_cutoff(days=None, now=None):
+    if days is None:
+        days = getattr(settings, 'BOOKING_ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def archive_bookings(days=None, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None):
+    """
+    Mueve a `ArchivedBooking` las reservas terminadas hace más de `days`
+    días. Cada lote se copia y se borra en la misma transacción; los lotes se
+    eligen por estado sobre el índice (status, end_datetime). Devuelve el
+    número de reservas archivadas.
+    """
+    cutoff = archive_cutoff(days)
+    total = 0
+    batches = 0
+    for status, label in Booking.STATUS_CHOICES:
+        while max_batches is None or batches < max_batches:
+            with transaction.atomic(), _archive_context():
+                rows = list(Booking.objects.filter(
+                    status=status, end_datetime__lt=cutoff
+                ).order_by('end_datetime').values(
+                    'id', 'resource__company_id', 'user_id', 'resource_id', 'agent_id',
+                    'start_datetime', 'end_datetime', 'status', 'notes',
+                    'created_at', 'updated_at'
+                )[:batch_size])
+                if not rows:
+                    break
+                ArchivedBooking.objects.bulk_create([
+                    ArchivedBooking(
+                        original_id=row['id'],
+                        company_id=row['resource__company_id'],
+                        user_id=row['user_id'],
+                        resource_id=row['resource_id'],
+                        agent_id=row['agent_id'],
+                        start_datetime=row['start_datetime'],
+                        end_datetime=row['end_datetime'],
+                        status=row['status'],
+                        notes=row['notes'],
+                        created_at=row['created_at'],
+                        updated_at=row['updated_at']
+                    )
+                    for row in rows
+                ], batch_size=batch_size)
+                Booking.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+            total += len(rows)
+            batches += 1
+            if len(rows) < batch_size:
+                break
+    return total
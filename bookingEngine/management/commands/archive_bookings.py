@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from bookingEngine.lifecycle import ARCHIVE_BATCH_SIZE, archive_bookings, archive_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Mueve a la tabla de archivo las reservas que terminaron hace más de "
+        "BOOKING_ARCHIVE_AFTER_DAYS días (o --days), en lotes acotados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            help='Antigüedad mínima en días (por defecto BOOKING_ARCHIVE_AFTER_DAYS)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=ARCHIVE_BATCH_SIZE,
+            help='Reservas archivadas por transacción'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            help='Detenerse tras este número de lotes'
+        )
+
+    def handle(self, *args, **options):
+        total = archive_bookings(
+            days=options['days'],
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} reservas terminadas antes de {archive_cutoff(options['days']):%Y-%m-%d} archivadas"
+        ))
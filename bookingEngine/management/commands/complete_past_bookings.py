@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from bookingEngine.lifecycle import (
+    COMPLETE_BATCH_SIZE, complete_past_bookings, completion_lag
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Marca como completadas las reservas confirmadas que ya terminaron, "
+        "en lotes acotados. Debe ejecutarse periódicamente (ej: cada hora)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=COMPLETE_BATCH_SIZE,
+            help='Reservas actualizadas por transacción'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            help='Detenerse tras este número de lotes'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Segundos de espera entre lotes'
+        )
+        parser.add_argument(
+            '--report',
+            action='store_true',
+            help='Solo informar el atraso, sin actualizar reservas'
+        )
+
+    def handle(self, *args, **options):
+        if not options['report']:
+            total = complete_past_bookings(
+                batch_size=options['batch_size'],
+                max_batches=options['max_batches'],
+                pause=options['pause']
+            )
+            self.stdout.write(self.style.SUCCESS(f"{total} reservas marcadas como completadas"))
+
+        lag = completion_lag()
+        if lag['pending']:
+            self.stdout.write(self.style.WARNING(
+                f"Pendientes: {lag['pending']} reservas; la más antigua terminó hace {lag['delay']}"
+            ))
+        else:
+            self.stdout.write("Sin reservas pendientes de completar")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from bookingEngine.inventory import rebuild_inventory
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye el inventario de slots disponibles hasta el límite de "
+        "anticipación de cada empresa. Debe ejecutarse a diario para "
+        "avanzar el horizonte y descartar los días pasados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--resource',
+            type=int,
+            action='append',
+            dest='resources',
+            help='Reconstruir solo este recurso (puede repetirse)'
+        )
+
+    def handle(self, *args, **options):
+        total = rebuild_inventory(options['resources'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Inventario reconstruido para {total} recursos"
+        ))
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from bookingEngine.utilization import rebuild_utilization
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula los resúmenes de ocupación de un rango de fechas (por "
+        "defecto ayer y hoy). Debe ejecutarse a diario para que los días sin "
+        "reservas también tengan su resumen."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', help='Primera fecha (AAAA-MM-DD)')
+        parser.add_argument('--date-to', help='Última fecha (AAAA-MM-DD)')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        try:
+            date_from = datetime.strptime(
+                options['date_from'], '%Y-%m-%d'
+            ).date() if options['date_from'] else today - timedelta(days=1)
+            date_to = datetime.strptime(
+                options['date_to'], '%Y-%m-%d'
+            ).date() if options['date_to'] else today
+        except ValueError:
+            raise CommandError("Las fechas deben tener el formato AAAA-MM-DD")
+        if date_to < date_from:
+            raise CommandError("--date-to debe ser posterior a --date-from")
+
+        total = rebuild_utilization(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} resúmenes de ocupación recalculados entre {date_from} y {date_to}"
+        ))
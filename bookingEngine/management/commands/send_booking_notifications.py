@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from bookingEngine.notifications import SEND_BATCH_SIZE, dispatch_pending, enqueue_reminders
+
+
+class Command(BaseCommand):
+    help = (
+        "Encola los recordatorios de las reservas que empiezan en las próximas "
+        "horas y envía por lotes todas las notificaciones pendientes. Debe "
+        "ejecutarse periódicamente (ej: cada 15 minutos)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            help='Ventana de recordatorios en horas (por defecto BOOKING_REMINDER_HOURS)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=SEND_BATCH_SIZE,
+            help='Mensajes enviados por conexión al servidor de correo'
+        )
+
+    def handle(self, *args, **options):
+        window = enqueue_reminders(hours=options['hours'])
+        sent, failed = dispatch_pending(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{window} reservas en la ventana de recordatorios; "
+            f"{sent} notificaciones enviadas, {failed} con error"
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from bookingEngine.calendar_sync import SYNC_BATCH_SIZE, push_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Envía por lotes a los calendarios externos los cambios pendientes de "
+        "las reservas, combinando los cambios de una misma reserva. Debe "
+        "ejecutarse periódicamente (ej: cada minuto)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=SYNC_BATCH_SIZE,
+            help='Cambios tomados por lote'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            help='Detenerse tras este número de lotes'
+        )
+
+    def handle(self, *args, **options):
+        synced, failed = push_pending(
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{synced} reservas sincronizadas, {failed} cambios con error"
+        ))
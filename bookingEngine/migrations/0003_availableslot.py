@@ -0,0 +1,31 @@
+# Generated by Django 5.1 on 2026-10-18 19:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0002_alter_agent_options_alter_blockedtime_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailableSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='Día al que pertenece el slot', verbose_name='Fecha')),
+                ('start_datetime', models.DateTimeField(verbose_name='Fecha y hora de inicio')),
+                ('end_datetime', models.DateTimeField(verbose_name='Fecha y hora de fin')),
+                ('agents', models.JSONField(blank=True, default=list, help_text='Agentes que pueden atender el slot (si el recurso los requiere)', verbose_name='Agentes')),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='available_slots', to='bookingEngine.resource', verbose_name='Recurso')),
+            ],
+            options={
+                'verbose_name': 'Slot Disponible',
+                'verbose_name_plural': 'Slots Disponibles',
+                'ordering': ['start_datetime'],
+                'indexes': [models.Index(fields=['start_datetime', 'resource'], name='slot_start_resource_idx'), models.Index(fields=['resource', 'date'], name='slot_resource_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-18 19:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0003_availableslot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blockedtime',
+            index=models.Index(fields=['resource', 'end_datetime', 'start_datetime'], name='blockedtime_resource_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blockedtime',
+            index=models.Index(fields=['agent', 'end_datetime', 'start_datetime'], name='blockedtime_agent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['resource', 'end_datetime', 'start_datetime'], name='booking_resource_overlap_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['agent', 'end_datetime', 'start_datetime'], name='booking_agent_overlap_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', '-start_datetime'], name='booking_user_start_idx'),
+        ),
+    ]
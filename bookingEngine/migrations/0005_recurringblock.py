@@ -0,0 +1,36 @@
+# Generated by Django 5.1 on 2026-10-18 19:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0004_booking_overlap_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frequency', models.CharField(choices=[('daily', 'Diaria'), ('weekly', 'Semanal'), ('yearly', 'Anual')], default='weekly', help_text='Diaria, semanal (según días de la semana) o anual (misma fecha cada año)', max_length=10, verbose_name='Frecuencia')),
+                ('days_of_week', models.JSONField(blank=True, default=list, help_text='Días en que aplica una regla semanal (0=Lunes ... 6=Domingo)', verbose_name='Días de la semana')),
+                ('start_time', models.TimeField(blank=True, help_text='Vacío para bloquear el día completo', null=True, verbose_name='Hora de inicio')),
+                ('end_time', models.TimeField(blank=True, help_text='Vacío para bloquear el día completo', null=True, verbose_name='Hora de fin')),
+                ('start_date', models.DateField(help_text='Primer día en que aplica la regla (en las anuales, la fecha que se repite)', verbose_name='Desde')),
+                ('end_date', models.DateField(blank=True, help_text='Último día en que aplica la regla (vacío = sin fin)', null=True, verbose_name='Hasta')),
+                ('excluded_dates', models.JSONField(blank=True, default=list, help_text='Fechas (AAAA-MM-DD) en las que la regla no aplica', verbose_name='Excepciones')),
+                ('reason', models.TextField(help_text='Motivo por el cual se bloquea este período', verbose_name='Motivo')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('agent', models.ForeignKey(blank=True, help_text='Agente que estará bloqueado', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='recurring_blocks', to='bookingEngine.agent', verbose_name='Agente')),
+                ('resource', models.ForeignKey(blank=True, help_text='Recurso que estará bloqueado', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='recurring_blocks', to='bookingEngine.resource', verbose_name='Recurso')),
+            ],
+            options={
+                'verbose_name': 'Bloqueo Recurrente',
+                'verbose_name_plural': 'Bloqueos Recurrentes',
+                'indexes': [models.Index(fields=['resource', 'start_date'], name='recurringblock_resource_idx'), models.Index(fields=['agent', 'start_date'], name='recurringblock_agent_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1 on 2026-10-18 19:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0005_recurringblock'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_datetime', models.DateTimeField(verbose_name='Fecha y hora de inicio')),
+                ('end_datetime', models.DateTimeField(verbose_name='Fecha y hora de fin')),
+                ('expires_at', models.DateTimeField(help_text='Momento en que la retención deja de tener efecto', verbose_name='Vence')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('agent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='bookingEngine.agent', verbose_name='Agente')),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='bookingEngine.resource', verbose_name='Recurso')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_holds', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Retención de Horario',
+                'verbose_name_plural': 'Retenciones de Horario',
+                'indexes': [models.Index(fields=['resource', 'end_datetime', 'start_datetime'], name='slothold_resource_idx'), models.Index(fields=['agent', 'end_datetime', 'start_datetime'], name='slothold_agent_idx'), models.Index(fields=['expires_at'], name='slothold_expires_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1 on 2026-10-18 19:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0006_slothold'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='booking',
+            options={'ordering': ['-start_datetime', '-id'], 'verbose_name': 'Reserva', 'verbose_name_plural': 'Reservas'},
+        ),
+        migrations.RemoveIndex(
+            model_name='booking',
+            name='booking_user_start_idx',
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', '-start_datetime', '-id'], name='booking_user_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['-start_datetime', '-id'], name='booking_start_id_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-18 19:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0007_booking_keyset_ordering'),
+        ('marketplace', '0018_company_address_company_country_company_cover_photo_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UtilizationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Fecha')),
+                ('booked_minutes', models.PositiveIntegerField(default=0, help_text='Minutos de reservas confirmadas o completadas en el día', verbose_name='Minutos reservados')),
+                ('scheduled_minutes', models.PositiveIntegerField(default=0, help_text='Minutos de atención según el horario semanal', verbose_name='Minutos de horario')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Última actualización')),
+                ('agent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='utilization_rollups', to='bookingEngine.agent', verbose_name='Agente')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='utilization_rollups', to='marketplace.company', verbose_name='Empresa')),
+                ('resource', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='utilization_rollups', to='bookingEngine.resource', verbose_name='Recurso')),
+            ],
+            options={
+                'verbose_name': 'Resumen de Ocupación',
+                'verbose_name_plural': 'Resúmenes de Ocupación',
+                'ordering': ['date'],
+                'indexes': [models.Index(fields=['company', 'date'], name='rollup_company_date_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('resource__isnull', False)), fields=('resource', 'date'), name='rollup_resource_date_unique'), models.UniqueConstraint(condition=models.Q(('agent__isnull', False)), fields=('agent', 'date'), name='rollup_agent_date_unique')],
+            },
+        ),
+    ]
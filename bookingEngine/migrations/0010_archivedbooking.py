@@ -0,0 +1,41 @@
+# Generated by Django 5.1 on 2026-10-18 19:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0009_booking_status_end_idx'),
+        ('marketplace', '0018_company_address_company_country_company_cover_photo_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBooking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.PositiveIntegerField(help_text='Id que tenía la reserva en la tabla de reservas', unique=True, verbose_name='Id original')),
+                ('start_datetime', models.DateTimeField(verbose_name='Fecha y hora de inicio')),
+                ('end_datetime', models.DateTimeField(verbose_name='Fecha y hora de fin')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('confirmed', 'Confirmada'), ('cancelled', 'Cancelada'), ('completed', 'Completada')], max_length=20, verbose_name='Estado')),
+                ('notes', models.TextField(blank=True, verbose_name='Notas')),
+                ('created_at', models.DateTimeField(verbose_name='Fecha de creación')),
+                ('updated_at', models.DateTimeField(verbose_name='Última actualización')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de archivo')),
+                ('agent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to='bookingEngine.agent', verbose_name='Agente')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to='marketplace.company', verbose_name='Empresa')),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to='bookingEngine.resource', verbose_name='Recurso')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Reserva Archivada',
+                'verbose_name_plural': 'Reservas Archivadas',
+                'ordering': ['-start_datetime', '-id'],
+                'indexes': [models.Index(fields=['company', '-start_datetime', '-id'], name='archived_company_start_idx'), models.Index(fields=['user', '-start_datetime', '-id'], name='archived_user_start_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-18 19:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0010_archivedbooking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('reminder', 'Recordatorio'), ('cancellation', 'Cancelación')], max_length=20, verbose_name='Tipo')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('sent', 'Enviada'), ('failed', 'Fallida')], default='pending', max_length=20, verbose_name='Estado')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Intentos')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, help_text='No se intenta enviar antes de este momento', verbose_name='Próximo intento')),
+                ('last_error', models.TextField(blank=True, verbose_name='Último error')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de envío')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='bookingEngine.booking', verbose_name='Reserva')),
+            ],
+            options={
+                'verbose_name': 'Notificación de Reserva',
+                'verbose_name_plural': 'Notificaciones de Reserva',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='notification_pending_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('kind', 'reminder')), fields=('booking', 'kind'), name='notification_one_reminder')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1 on 2026-10-18 19:46
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0011_bookingnotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='capacity',
+            field=models.PositiveIntegerField(default=1, help_text='Reservas simultáneas que admite el recurso (ej: mesas de un salón, cupos de una clase)', validators=[django.core.validators.MinValueValidator(1)], verbose_name='Capacidad'),
+        ),
+    ]
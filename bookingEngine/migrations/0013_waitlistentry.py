@@ -0,0 +1,51 @@
+# Generated by Django 5.1 on 2026-10-18 19:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0012_resource_capacity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookingnotification',
+            name='kind',
+            field=models.CharField(choices=[('reminder', 'Recordatorio'), ('cancellation', 'Cancelación'), ('waitlist_offer', 'Horario ofrecido de la lista de espera'), ('waitlist_booked', 'Reserva desde la lista de espera')], max_length=20, verbose_name='Tipo'),
+        ),
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateTimeField(help_text='Inicio de la ventana en la que el usuario acepta un horario', verbose_name='Desde')),
+                ('window_end', models.DateTimeField(help_text='Fin de la ventana en la que el usuario acepta un horario', verbose_name='Hasta')),
+                ('auto_book', models.BooleanField(default=False, help_text='Reserva el horario liberado sin esperar a que el usuario lo confirme', verbose_name='Reservar automáticamente')),
+                ('status', models.CharField(choices=[('waiting', 'En espera'), ('offered', 'Ofrecida'), ('booked', 'Reservada')], default='waiting', max_length=20, verbose_name='Estado')),
+                ('offer_expires_at', models.DateTimeField(blank=True, null=True, verbose_name='Vencimiento de la oferta')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('agent', models.ForeignKey(blank=True, help_text='Agente preferido; vacío acepta cualquiera', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='bookingEngine.agent', verbose_name='Agente')),
+                ('booking', models.ForeignKey(blank=True, help_text='Reserva creada a partir de la solicitud', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_entries', to='bookingEngine.booking', verbose_name='Reserva')),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='bookingEngine.resource', verbose_name='Recurso')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Lista de Espera',
+                'verbose_name_plural': 'Listas de Espera',
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='bookingnotification',
+            name='waitlist_entry',
+            field=models.ForeignKey(blank=True, help_text='Solicitud a la que se ofrece el horario de la reserva cancelada', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='bookingEngine.waitlistentry', verbose_name='Lista de espera'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['resource', 'status', 'window_start', 'window_end'], name='waitlist_match_idx'),
+        ),
+    ]
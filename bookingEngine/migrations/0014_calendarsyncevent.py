@@ -0,0 +1,36 @@
+# Generated by Django 5.1 on 2026-10-18 19:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingEngine', '0013_waitlistentry'),
+        ('marketplace', '0018_company_address_company_country_company_cover_photo_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarSyncEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('booking_id', models.PositiveIntegerField(verbose_name='Id de la reserva')),
+                ('event', models.CharField(choices=[('created', 'Creada'), ('updated', 'Modificada'), ('cancelled', 'Cancelada'), ('deleted', 'Eliminada')], max_length=20, verbose_name='Cambio')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('sent', 'Enviado'), ('failed', 'Fallido')], default='pending', max_length=20, verbose_name='Estado')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Intentos')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, help_text='No se intenta enviar antes de este momento', verbose_name='Próximo intento')),
+                ('last_error', models.TextField(blank=True, verbose_name='Último error')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de envío')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_sync_events', to='marketplace.company', verbose_name='Empresa')),
+            ],
+            options={
+                'verbose_name': 'Cambio para Calendario Externo',
+                'verbose_name_plural': 'Cambios para Calendario Externo',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='calendarsync_pending_idx')],
+            },
+        ),
+    ]
@@ -1,5 +1,7 @@
 # models.py
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -90,6 +92,13 @@ class ResourceType(models.Model):
     def __str__(self):
         return f"{self.name} - {self.company.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores cargados, para detectar cambios al guardar
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
 class Agent(models.Model):
     user = models.OneToOneField(
         User,
@@ -136,6 +145,13 @@ class Agent(models.Model):
     def __str__(self):
         return f"{self.name} - {self.company.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores cargados, para detectar cambios al guardar
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
 class Resource(models.Model):
     AVAILABILITY_CHOICES = [
         ('always', 'Siempre disponible'),
@@ -175,6 +191,12 @@ class Resource(models.Model):
         verbose_name='Duración',
         help_text="Duración en minutos de la reserva"
     )
+    capacity = models.PositiveIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        verbose_name='Capacidad',
+        help_text='Reservas simultáneas que admite el recurso (ej: mesas de un salón, cupos de una clase)'
+    )
     availability_type = models.CharField(
         max_length=20,
         choices=AVAILABILITY_CHOICES,
@@ -325,7 +347,45 @@ class Booking(models.Model):
     class Meta:
         verbose_name = "Reserva"
         verbose_name_plural = "Reservas"
-        ordering = ['-start_datetime']
+        # El id desempata reservas con el mismo inicio y permite paginar por
+        # (start_datetime, id)
+        ordering = ['-start_datetime', '-id']
+        # Las consultas de solapamiento filtran por recurso/agente, estado y
+        # `end_datetime > inicio`: al empezar por el fin, el índice descarta
+        # todo el historial pasado y cubre también la condición sobre el inicio.
+        # No son parciales por estado: todas las verificaciones filtran por
+        # la lista de estados activos, y SQLite no usa un índice parcial
+        # cuando esa lista llega como parámetros.
+        indexes = [
+            models.Index(
+                fields=['resource', 'end_datetime', 'start_datetime'],
+                name='booking_resource_overlap_idx'
+            ),
+            models.Index(
+                fields=['agent', 'end_datetime', 'start_datetime'],
+                name='booking_agent_overlap_idx'
+            ),
+            models.Index(
+                fields=['user', '-start_datetime', '-id'],
+                name='booking_user_start_idx'
+            ),
+            models.Index(
+                fields=['-start_datetime', '-id'],
+                name='booking_start_id_idx'
+            ),
+            # Reservas terminadas pendientes de pasar a completadas
+            models.Index(
+                fields=['status', 'end_datetime'],
+                name='booking_status_end_idx'
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores cargados, para detectar cambios al guardar
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
 class BlockedTime(models.Model):
     resource = models.ForeignKey(
@@ -363,4 +423,821 @@ class BlockedTime(models.Model):
 
     class Meta:
         verbose_name = "Tiempo Bloqueado"
-        verbose_name_plural = "Tiempos Bloqueados"
\ No newline at end of file
+        verbose_name_plural = "Tiempos Bloqueados"
+        indexes = [
+            models.Index(
+                fields=['resource', 'end_datetime', 'start_datetime'],
+                name='blockedtime_resource_idx'
+            ),
+            models.Index(
+                fields=['agent', 'end_datetime', 'start_datetime'],
+                name='blockedtime_agent_idx'
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores cargados, para detectar cambios al guardar
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+class RecurringBlock(models.Model):
+    """
+    Regla de bloqueo recurrente (ej: cerrado los domingos, almuerzo diario,
+    feriados anuales). Se guarda una sola fila por regla y se expande solo
+    para el rango consultado, sin materializar tiempos bloqueados.
+    """
+    FREQUENCY_CHOICES = [
+        ('daily', 'Diaria'),
+        ('weekly', 'Semanal'),
+        ('yearly', 'Anual'),
+    ]
+
+    resource = models.ForeignKey(
+        Resource,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='recurring_blocks',
+        verbose_name='Recurso',
+        help_text='Recurso que estará bloqueado'
+    )
+    agent = models.ForeignKey(
+        Agent,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='recurring_blocks',
+        verbose_name='Agente',
+        help_text='Agente que estará bloqueado'
+    )
+    frequency = models.CharField(
+        max_length=10,
+        choices=FREQUENCY_CHOICES,
+        default='weekly',
+        verbose_name='Frecuencia',
+        help_text='Diaria, semanal (según días de la semana) o anual (misma fecha cada año)'
+    )
+    days_of_week = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='Días de la semana',
+        help_text='Días en que aplica una regla semanal (0=Lunes ... 6=Domingo)'
+    )
+    start_time = models.TimeField(
+        null=True,
+        blank=True,
+        verbose_name='Hora de inicio',
+        help_text='Vacío para bloquear el día completo'
+    )
+    end_time = models.TimeField(
+        null=True,
+        blank=True,
+        verbose_name='Hora de fin',
+        help_text='Vacío para bloquear el día completo'
+    )
+    start_date = models.DateField(
+        verbose_name='Desde',
+        help_text='Primer día en que aplica la regla (en las anuales, la fecha que se repite)'
+    )
+    end_date = models.DateField(
+        null=True,
+        blank=True,
+        verbose_name='Hasta',
+        help_text='Último día en que aplica la regla (vacío = sin fin)'
+    )
+    excluded_dates = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='Excepciones',
+        help_text='Fechas (AAAA-MM-DD) en las que la regla no aplica'
+    )
+    reason = models.TextField(
+        verbose_name='Motivo',
+        help_text='Motivo por el cual se bloquea este período'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Fecha de creación'
+    )
+
+    class Meta:
+        verbose_name = "Bloqueo Recurrente"
+        verbose_name_plural = "Bloqueos Recurrentes"
+        indexes = [
+            models.Index(fields=['resource', 'start_date'], name='recurringblock_resource_idx'),
+            models.Index(fields=['agent', 'start_date'], name='recurringblock_agent_idx'),
+        ]
+
+    def clean(self):
+        if not self.resource and not self.agent:
+            raise ValidationError('Debe especificar un recurso o un agente')
+        if self.resource and self.agent:
+            raise ValidationError('No puede especificar ambos: recurso y agente')
+        if (self.start_time is None) != (self.end_time is None):
+            raise ValidationError('Debe indicar hora de inicio y de fin, o ninguna para el día completo')
+        if self.start_time and self.start_time >= self.end_time:
+            raise ValidationError('La hora de inicio debe ser anterior a la hora de fin')
+        if self.frequency == 'weekly' and not self.days_of_week:
+            raise ValidationError('Una regla semanal necesita al menos un día de la semana')
+        if self.end_date and self.end_date < self.start_date:
+            raise ValidationError('La fecha de fin debe ser posterior a la de inicio')
+
+    def occurs_on(self, day):
+        """Indica si la regla bloquea el día indicado."""
+        if day < self.start_date or (self.end_date and day > self.end_date):
+            return False
+        if day.isoformat() in self.excluded_dates:
+            return False
+        if self.frequency == 'weekly':
+            return day.weekday() in self.days_of_week
+        if self.frequency == 'yearly':
+            return (day.month, day.day) == (self.start_date.month, self.start_date.day)
+        return True
+
+    def __str__(self):
+        return f"{self.get_frequency_display()} - {self.reason}"
+
+class AvailableSlot(models.Model):
+    """
+    Inventario precalculado de slots libres por recurso dentro del horizonte
+    de reservas. Se mantiene de forma incremental con las señales de abajo y
+    se reconstruye con el comando `rebuild_slot_inventory`.
+    """
+    resource = models.ForeignKey(
+        Resource,
+        on_delete=models.CASCADE,
+        related_name='available_slots',
+        verbose_name='Recurso'
+    )
+    date = models.DateField(
+        verbose_name='Fecha',
+        help_text='Día al que pertenece el slot'
+    )
+    start_datetime = models.DateTimeField(
+        verbose_name='Fecha y hora de inicio'
+    )
+    end_datetime = models.DateTimeField(
+        verbose_name='Fecha y hora de fin'
+    )
+    agents = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='Agentes',
+        help_text='Agentes que pueden atender el slot (si el recurso los requiere)'
+    )
+
+    class Meta:
+        verbose_name = "Slot Disponible"
+        verbose_name_plural = "Slots Disponibles"
+        ordering = ['start_datetime']
+        indexes = [
+            models.Index(fields=['start_datetime', 'resource'], name='slot_start_resource_idx'),
+            models.Index(fields=['resource', 'date'], name='slot_resource_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.resource_id} {self.start_datetime} - {self.end_datetime}"
+
+class SlotHold(models.Model):
+    """
+    Retención temporal de un intervalo mientras el usuario completa la
+    reserva. Cuenta como ocupado para los demás usuarios hasta `expires_at`;
+    las retenciones vencidas se ignoran en las consultas y se eliminan al
+    crear nuevas, sin tareas programadas.
+    """
+    resource = models.ForeignKey(
+        Resource,
+        on_delete=models.CASCADE,
+        related_name='holds',
+        verbose_name='Recurso'
+    )
+    agent = models.ForeignKey(
+        Agent,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='holds',
+        verbose_name='Agente'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='slot_holds',
+        verbose_name='Usuario'
+    )
+    start_datetime = models.DateTimeField(
+        verbose_name='Fecha y hora de inicio'
+    )
+    end_datetime = models.DateTimeField(
+        verbose_name='Fecha y hora de fin'
+    )
+    expires_at = models.DateTimeField(
+        verbose_name='Vence',
+        help_text='Momento en que la retención deja de tener efecto'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Fecha de creación'
+    )
+
+    class Meta:
+        verbose_name = "Retención de Horario"
+        verbose_name_plural = "Retenciones de Horario"
+        indexes = [
+            models.Index(
+                fields=['resource', 'end_datetime', 'start_datetime'],
+                name='slothold_resource_idx'
+            ),
+            models.Index(
+                fields=['agent', 'end_datetime', 'start_datetime'],
+                name='slothold_agent_idx'
+            ),
+            models.Index(fields=['expires_at'], name='slothold_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.resource} - {self.start_datetime} (hasta {self.expires_at})"
+
+class UtilizationRollup(models.Model):
+    """
+    Minutos reservados frente a minutos de horario de un recurso o de un
+    agente en un día. Se actualiza de forma incremental con los cambios de
+    estado de las reservas; los reportes de ocupación leen solo esta tabla.
+    """
+    company = models.ForeignKey(
+        'marketplace.Company',
+        on_delete=models.CASCADE,
+        related_name='utilization_rollups',
+        verbose_name='Empresa'
+    )
+    resource = models.ForeignKey(
+        Resource,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='utilization_rollups',
+        verbose_name='Recurso'
+    )
+    agent = models.ForeignKey(
+        Agent,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='utilization_rollups',
+        verbose_name='Agente'
+    )
+    date = models.DateField(
+        verbose_name='Fecha'
+    )
+    booked_minutes = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Minutos reservados',
+        help_text='Minutos de reservas confirmadas o completadas en el día'
+    )
+    scheduled_minutes = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Minutos de horario',
+        help_text='Minutos de atención según el horario semanal'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Última actualización'
+    )
+
+    class Meta:
+        verbose_name = "Resumen de Ocupación"
+        verbose_name_plural = "Resúmenes de Ocupación"
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['resource', 'date'],
+                condition=models.Q(resource__isnull=False),
+                name='rollup_resource_date_unique'
+            ),
+            models.UniqueConstraint(
+                fields=['agent', 'date'],
+                condition=models.Q(agent__isnull=False),
+                name='rollup_agent_date_unique'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['company', 'date'], name='rollup_company_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.resource or self.agent} - {self.date}"
+
+class ArchivedBooking(models.Model):
+    """
+    Reserva histórica movida fuera de `Booking` por el comando
+    `archive_bookings`. Las verificaciones de solapamiento, la disponibilidad
+    y los listados trabajan solo con las reservas vivas; los reportes
+    históricos leen esta tabla.
+    """
+    original_id = models.PositiveIntegerField(
+        unique=True,
+        verbose_name='Id original',
+        help_text='Id que tenía la reserva en la tabla de reservas'
+    )
+    company = models.ForeignKey(
+        'marketplace.Company',
+        on_delete=models.CASCADE,
+        related_name='archived_bookings',
+        verbose_name='Empresa'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='archived_bookings',
+        verbose_name='Usuario'
+    )
+    resource = models.ForeignKey(
+        Resource,
+        on_delete=models.CASCADE,
+        related_name='archived_bookings',
+        verbose_name='Recurso'
+    )
+    agent = models.ForeignKey(
+        Agent,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='archived_bookings',
+        verbose_name='Agente'
+    )
+    start_datetime = models.DateTimeField(
+        verbose_name='Fecha y hora de inicio'
+    )
+    end_datetime = models.DateTimeField(
+        verbose_name='Fecha y hora de fin'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=Booking.STATUS_CHOICES,
+        verbose_name='Estado'
+    )
+    notes = models.TextField(
+        blank=True,
+        verbose_name='Notas'
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Fecha de creación'
+    )
+    updated_at = models.DateTimeField(
+        verbose_name='Última actualización'
+    )
+    archived_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Fecha de archivo'
+    )
+
+    class Meta:
+        verbose_name = "Reserva Archivada"
+        verbose_name_plural = "Reservas Archivadas"
+        ordering = ['-start_datetime', '-id']
+        indexes = [
+            models.Index(
+                fields=['company', '-start_datetime', '-id'],
+                name='archived_company_start_idx'
+            ),
+            models.Index(
+                fields=['user', '-start_datetime', '-id'],
+                name='archived_user_start_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.resource} - {self.start_datetime} ({self.get_status_display()})"
+
+class WaitlistEntry(models.Model):
+    """
+    Solicitud de un usuario para ocupar un horario del recurso si se libera.
+    Cuando se cancela una reserva que cabe en la ventana de la solicitud, el
+    horario se le retiene durante unos minutos (`offered`) o, si pidió
+    reserva automática, se le reserva directamente (`booked`). Las ofertas
+    no se repiten: si la retención vence sin reservar, el horario queda libre
+    para todos.
+    """
+    STATUS_CHOICES = [
+        ('waiting', 'En espera'),
+        ('offered', 'Ofrecida'),
+        ('booked', 'Reservada'),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='waitlist_entries',
+        verbose_name='Usuario'
+    )
+    resource = models.ForeignKey(
+        Resource,
+        on_delete=models.CASCADE,
+        related_name='waitlist',
+        verbose_name='Recurso'
+    )
+    agent = models.ForeignKey(
+        Agent,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='waitlist',
+        verbose_name='Agente',
+        help_text='Agente preferido; vacío acepta cualquiera'
+    )
+    window_start = models.DateTimeField(
+        verbose_name='Desde',
+        help_text='Inicio de la ventana en la que el usuario acepta un horario'
+    )
+    window_end = models.DateTimeField(
+        verbose_name='Hasta',
+        help_text='Fin de la ventana en la que el usuario acepta un horario'
+    )
+    auto_book = models.BooleanField(
+        default=False,
+        verbose_name='Reservar automáticamente',
+        help_text='Reserva el horario liberado sin esperar a que el usuario lo confirme'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='waiting',
+        verbose_name='Estado'
+    )
+    booking = models.ForeignKey(
+        Booking,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='waitlist_entries',
+        verbose_name='Reserva',
+        help_text='Reserva creada a partir de la solicitud'
+    )
+    offer_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Vencimiento de la oferta'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Fecha de creación'
+    )
+
+    class Meta:
+        verbose_name = "Lista de Espera"
+        verbose_name_plural = "Listas de Espera"
+        ordering = ['created_at', 'id']
+        indexes = [
+            # Búsqueda de solicitudes cuya ventana contiene un horario liberado
+            models.Index(
+                fields=['resource', 'status', 'window_start', 'window_end'],
+                name='waitlist_match_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.resource} ({self.get_status_display()})"
+
+class BookingNotification(models.Model):
+    """
+    Correo pendiente o enviado sobre una reserva (bandeja de salida). Las
+    peticiones solo crean la fila; el envío ocurre fuera del hilo de la
+    petición, por lotes y con reintentos.
+    """
+    KIND_CHOICES = [
+        ('reminder', 'Recordatorio'),
+        ('cancellation', 'Cancelación'),
+        ('waitlist_offer', 'Horario ofrecido de la lista de espera'),
+        ('waitlist_booked', 'Reserva desde la lista de espera'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('sent', 'Enviada'),
+        ('failed', 'Fallida'),
+    ]
+
+    booking = models.ForeignKey(
+        Booking,
+        on_delete=models.CASCADE,
+        related_name='notifications',
+        verbose_name='Reserva'
+    )
+    waitlist_entry = models.ForeignKey(
+        WaitlistEntry,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='notifications',
+        verbose_name='Lista de espera',
+        help_text='Solicitud a la que se ofrece el horario de la reserva cancelada'
+    )
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+        verbose_name='Tipo'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name='Estado'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Intentos'
+    )
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Próximo intento',
+        help_text='No se intenta enviar antes de este momento'
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name='Último error'
+    )
+    sent_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Fecha de envío'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Fecha de creación'
+    )
+
+    class Meta:
+        verbose_name = "Notificación de Reserva"
+        verbose_name_plural = "Notificaciones de Reserva"
+        constraints = [
+            # Un solo recordatorio por reserva
+            models.UniqueConstraint(
+                fields=['booking', 'kind'],
+                condition=models.Q(kind='reminder'),
+                name='notification_one_reminder'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='notification_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} - reserva {self.booking_id} ({self.get_status_display()})"
+
+class CalendarSyncEvent(models.Model):
+    """
+    Cambio de una reserva pendiente de enviarse al calendario externo de la
+    empresa (bandeja de salida). Se registra en la misma transacción que el
+    cambio; el comando `sync_calendars` lo envía después, por lotes. Guarda
+    solo el id de la reserva para sobrevivir a su eliminación.
+    """
+    EVENT_CHOICES = [
+        ('created', 'Creada'),
+        ('updated', 'Modificada'),
+        ('cancelled', 'Cancelada'),
+        ('deleted', 'Eliminada'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('sent', 'Enviado'),
+        ('failed', 'Fallido'),
+    ]
+
+    company = models.ForeignKey(
+        'marketplace.Company',
+        on_delete=models.CASCADE,
+        related_name='calendar_sync_events',
+        verbose_name='Empresa'
+    )
+    booking_id = models.PositiveIntegerField(
+        verbose_name='Id de la reserva'
+    )
+    event = models.CharField(
+        max_length=20,
+        choices=EVENT_CHOICES,
+        verbose_name='Cambio'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name='Estado'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Intentos'
+    )
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Próximo intento',
+        help_text='No se intenta enviar antes de este momento'
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name='Último error'
+    )
+    sent_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Fecha de envío'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Fecha de creación'
+    )
+
+    class Meta:
+        verbose_name = "Cambio para Calendario Externo"
+        verbose_name_plural = "Cambios para Calendario Externo"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='calendarsync_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_event_display()} - reserva {self.booking_id} ({self.get_status_display()})"
+
+# Mantenimiento incremental del inventario de slots
+
+def _changed_intervals(instance):
+    """Intervalo actual y, si cambió, el que tenía al cargarse."""
+    intervals = [(instance.resource_id, instance.agent_id, instance.start_datetime, instance.end_datetime)]
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded:
+        previous = (
+            loaded.get('resource_id'), loaded.get('agent_id'),
+            loaded.get('start_datetime'), loaded.get('end_datetime')
+        )
+        if previous != intervals[0] and None not in previous[2:]:
+            intervals.append(previous)
+    return intervals
+
+@receiver([post_save, post_delete], sender=Booking)
+@receiver([post_save, post_delete], sender=BlockedTime)
+def refresh_inventory_for_interval(sender, instance, **kwargs):
+    from .inventory import refresh_for_intervals
+    from .lifecycle import is_archiving
+    if is_archiving():
+        return
+    intervals = _changed_intervals(instance)
+    transaction.on_commit(lambda: refresh_for_intervals(intervals))
+
+@receiver([post_save, post_delete], sender=Schedule)
+@receiver([post_save, post_delete], sender=RecurringBlock)
+def refresh_inventory_for_schedule(sender, instance, **kwargs):
+    from .inventory import refresh_for_owner
+    resource_id, agent_id = instance.resource_id, instance.agent_id
+    transaction.on_commit(lambda: refresh_for_owner(resource_id, agent_id))
+
+@receiver(post_save, sender=Resource)
+def refresh_inventory_for_resource(sender, instance, **kwargs):
+    from .inventory import refresh_inventory
+    resource_id = instance.pk
+    transaction.on_commit(lambda: refresh_inventory([resource_id]))
+
+@receiver(m2m_changed, sender=Resource.agents.through)
+def refresh_inventory_for_agents(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    from .inventory import refresh_inventory
+    if not reverse:
+        resource_ids = [instance.pk]
+    elif action == 'pre_clear':
+        # Cambios desde el agente: se recalculan los recursos que pierde
+        resource_ids = list(instance.resources.values_list('id', flat=True))
+    else:
+        resource_ids = list(pk_set)
+    transaction.on_commit(lambda: refresh_inventory(resource_ids))
+
+def _saved_change(instance, field):
+    """
+    Si `field` cambió desde que se cargó o se guardó por última vez (o no hay
+    valor cargado). Recuerda el valor guardado.
+    """
+    value = getattr(instance, field)
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None:
+        instance._loaded_values = loaded = {}
+        changed = True
+    else:
+        changed = loaded.get(field) != value
+    loaded[field] = value
+    return changed
+
+@receiver(post_save, sender=Agent)
+def refresh_inventory_for_agent(sender, instance, created, **kwargs):
+    # Un agente activado o desactivado cambia los slots de sus recursos
+    if created or not _saved_change(instance, 'is_active'):
+        return
+    from .inventory import refresh_for_owner
+    agent_id = instance.pk
+    transaction.on_commit(lambda: refresh_for_owner(None, agent_id))
+
+@receiver(pre_delete, sender=Agent)
+def refresh_inventory_for_deleted_agent(sender, instance, **kwargs):
+    # El borrado en cascada de los vínculos no emite m2m_changed
+    from .inventory import refresh_inventory
+    resource_ids = list(instance.resources.values_list('id', flat=True))
+    if resource_ids:
+        transaction.on_commit(lambda: refresh_inventory(resource_ids))
+
+@receiver(post_save, sender=ResourceType)
+def refresh_inventory_for_resource_type(sender, instance, created, **kwargs):
+    # Requerir agente o dejar de hacerlo cambia cómo se calculan los slots
+    if created or not _saved_change(instance, 'requires_agent'):
+        return
+    from .inventory import refresh_inventory
+    type_id = instance.pk
+    transaction.on_commit(lambda: refresh_inventory(
+        Resource.objects.filter(type_id=type_id).values_list('id', flat=True)
+    ))
+
+@receiver([post_save, post_delete], sender=BookingSettings)
+def invalidate_settings_cache(sender, instance, **kwargs):
+    from .cache import invalidate_booking_settings
+    company_id = instance.company_id
+    invalidate_booking_settings(company_id)
+    transaction.on_commit(lambda: invalidate_booking_settings(company_id))
+
+@receiver(pre_save, sender='marketplace.Company')
+def remember_company_owner(sender, instance, **kwargs):
+    # Dueño anterior, por si la empresa cambia de usuario
+    instance._previous_user_id = sender.objects.filter(
+        pk=instance.pk
+    ).values_list('user_id', flat=True).first() if instance.pk else None
+
+@receiver([post_save, post_delete], sender='marketplace.Company')
+def invalidate_ownership_cache(sender, instance, **kwargs):
+    from .cache import invalidate_owned_companies
+    user_ids = (instance.user_id, getattr(instance, '_previous_user_id', None))
+    invalidate_owned_companies(*user_ids)
+    transaction.on_commit(lambda: invalidate_owned_companies(*user_ids))
+
+@receiver(post_save, sender=BookingSettings)
+def refresh_inventory_for_settings(sender, instance, **kwargs):
+    from .inventory import refresh_inventory
+    company_id = instance.company_id
+    transaction.on_commit(lambda: refresh_inventory(
+        Resource.objects.filter(company_id=company_id).values_list('id', flat=True)
+    ))
+# Resúmenes de ocupación
+
+@receiver(post_save, sender=Booking)
+def update_utilization_for_booking(sender, instance, **kwargs):
+    from .utilization import record_booking_change
+    record_booking_change(instance)
+
+@receiver(post_delete, sender=Booking)
+def update_utilization_for_deleted_booking(sender, instance, **kwargs):
+    from .utilization import record_booking_change
+    from .lifecycle import is_archiving
+    # Archivar no borra la ocupación histórica
+    if is_archiving():
+        return
+    record_booking_change(instance, deleted=True)
+
+@receiver([post_save, post_delete], sender=Schedule)
+def update_utilization_for_schedule(sender, instance, **kwargs):
+    from .utilization import refresh_scheduled_minutes
+    resource_id, agent_id = instance.resource_id, instance.agent_id
+    transaction.on_commit(lambda: refresh_scheduled_minutes(resource_id, agent_id))
+
+# Sincronización con calendarios externos
+
+@receiver(post_save, sender=Booking)
+def record_calendar_sync_for_booking(sender, instance, created, **kwargs):
+    from .calendar_sync import record_booking_events
+    if created:
+        event = 'created'
+    else:
+        event = 'cancelled' if instance.status == 'cancelled' else 'updated'
+    record_booking_events([instance], event)
+
+@receiver(post_delete, sender=Booking)
+def record_calendar_sync_for_deleted_booking(sender, instance, **kwargs):
+    from .calendar_sync import record_booking_events
+    from .lifecycle import is_archiving
+    # Las reservas archivadas siguen en el calendario externo
+    if is_archiving():
+        return
+    record_booking_events([instance], 'deleted')
+
+# Tablero de las empresas
+
+@receiver([post_save, post_delete], sender=Booking)
+def invalidate_dashboard_for_booking(sender, instance, **kwargs):
+    from .cache import invalidate_dashboard
+    from .lifecycle import is_archiving
+    # Las reservas archivadas son antiguas y no figuran en el tablero
+    if is_archiving():
+        return
+    company_id = instance.resource.company_id
+    invalidate_dashboard(company_id)
+    transaction.on_commit(lambda: invalidate_dashboard(company_id))
+
+@receiver([post_save, post_delete], sender='marketplace.Order')
+def invalidate_dashboard_for_order(sender, instance, **kwargs):
+    from .cache import invalidate_dashboard
+    company_id = instance.company_id
+    invalidate_dashboard(company_id)
+    transaction.on_commit(lambda: invalidate_dashboard(company_id))
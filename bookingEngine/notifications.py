@@ -0,0 +1,171 @@
+"""
+Notificaciones por correo de las reservas.
+
+Las peticiones y los comandos solo encolan filas de `BookingNotification`.
+`dispatch_pending` las toma por lotes de la cola de salida (ver `outbox`),
+arma todos los mensajes del lote a partir de una única consulta y los envía
+de a uno por una sola conexión del backend de correo. Solo se reintentan, con espera exponencial, los mensajes
+que no llegaron a enviarse: un error a mitad del lote no repite los ya
+entregados.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from .availability import BUSY_STATUSES
+from .cache import get_booking_settings
+from .models import Booking, BookingNotification
+from .outbox import claim_batch, mark_failed, mark_sent, retry_later, save_batch
+
+# Mensajes enviados por conexión al backend de correo
+SEND_BATCH_SIZE = 100
+# Intentos antes de dar una notificación por fallida
+MAX_ATTEMPTS = 5
+RETRY_BASE_MINUTES = 5
+
+DEFAULT_REMINDER_HOURS = 24
+
+
+def enqueue_reminders(hours=None, now=None):
+    """
+    Encola un recordatorio para cada reserva activa que empieza en las
+    próximas `hours` horas. Una consulta por rango sobre el inicio de la
+    reserva; las que ya tienen recordatorio se descartan por la restricción
+    única. Devuelve el número de reservas de la ventana.
+    """
+    if hours is None:
+        hours = getattr(settings, 'BOOKING_REMINDER_HOURS', DEFAULT_REMINDER_HOURS)
+    now = now or timezone.now()
+    booking_ids = list(Booking.objects.filter(
+        start_datetime__gte=now,
+        start_datetime__lt=now + timedelta(hours=hours),
+        status__in=BUSY_STATUSES
+    ).values_list('pk', flat=True))
+    BookingNotification.objects.bulk_create(
+        [BookingNotification(booking_id=pk, kind='reminder') for pk in booking_ids],
+        ignore_conflicts=True,
+        batch_size=500
+    )
+    return len(booking_ids)
+
+
+def enqueue_notification(booking, kind, waitlist_entry=None):
+    return BookingNotification.objects.create(booking=booking, kind=kind, waitlist_entry=waitlist_entry)
+
+
+def render_message(notification):
+    """Arma el correo de una notificación, o None si no tiene destinatario."""
+    booking = notification.booking
+    resource = booking.resource
+    start = timezone.localtime(booking.start_datetime)
+    when = f"{start:%d/%m/%Y} a las {start:%H:%M}"
+    with_agent = f" con {booking.agent.name}" if booking.agent else ""
+    recipients = [booking.user.email] if booking.user.email else []
+    cc = []
+
+    if notification.kind == 'waitlist_offer':
+        # La reserva es la cancelada; el destinatario es quien esperaba el horario
+        entry = notification.waitlist_entry
+        recipients = [entry.user.email] if entry.user.email else []
+        expires = timezone.localtime(entry.offer_expires_at)
+        subject = f"Se liberó un horario: {resource.name}"
+        body = (
+            f"Hola {entry.user.get_full_name() or entry.user.username},\n\n"
+            f"Se liberó el horario de {resource.name}{with_agent} en {resource.company.name} "
+            f"del {when} que esperabas. Lo retenemos para ti hasta las "
+            f"{expires:%H:%M}; completa la reserva antes de esa hora.\n"
+        )
+    elif notification.kind == 'waitlist_booked':
+        subject = f"Reserva desde la lista de espera: {resource.name}"
+        body = (
+            f"Hola {booking.user.get_full_name() or booking.user.username},\n\n"
+            f"Se liberó un horario de tu lista de espera y lo reservamos para ti: "
+            f"{resource.name}{with_agent} en {resource.company.name} el {when}.\n"
+        )
+    elif notification.kind == 'reminder':
+        subject = f"Recordatorio de tu reserva: {resource.name}"
+        body = (
+            f"Hola {booking.user.get_full_name() or booking.user.username},\n\n"
+            f"Te recordamos tu reserva de {resource.name}{with_agent} "
+            f"en {resource.company.name} el {when}.\n"
+        )
+    else:
+        subject = f"Reserva cancelada: {resource.name}"
+        body = (
+            f"La reserva de {resource.name}{with_agent} en {resource.company.name} "
+            f"del {when} fue cancelada.\n"
+        )
+        company_settings = get_booking_settings(resource.company_id)
+        cc = [company_settings.notification_email] if (
+            company_settings and company_settings.notification_email
+        ) else []
+
+    if not recipients and not cc:
+        return None
+    return EmailMessage(subject=subject, body=body, to=recipients, cc=cc)
+
+
+def _claim_batch(batch_size, now):
+    return claim_batch(BookingNotification.objects.select_related(
+        'booking__resource__company', 'booking__user', 'booking__agent',
+        'waitlist_entry__user'
+    ), batch_size, now)
+
+
+def _retry_later(notifications, error, now):
+    retry_later(notifications, error, now, MAX_ATTEMPTS, RETRY_BASE_MINUTES)
+
+
+def dispatch_pending(batch_size=SEND_BATCH_SIZE, max_batches=None):
+    """
+    Envía las notificaciones pendientes cuyo intento ya corresponde.
+    Devuelve (enviadas, con_error).
+    """
+    sent = failed = batches = 0
+    connection = get_connection()
+    while max_batches is None or batches < max_batches:
+        now = timezone.now()
+        batch = _claim_batch(batch_size, now)
+        if not batch:
+            break
+        batches += 1
+
+        messages, deliverable, undeliverable = [], [], []
+        for notification in batch:
+            message = render_message(notification)
+            if message is None:
+                undeliverable.append(notification)
+            else:
+                messages.append(message)
+                deliverable.append(notification)
+
+        mark_failed(undeliverable, "Sin destinatario")
+        try:
+            connection.open()
+        except Exception as error:
+            _retry_later(deliverable, str(error), now)
+            failed += len(deliverable)
+        else:
+            try:
+                # De a un mensaje: send_messages puede fallar después de haber
+                # entregado parte de la lista, sin decir cuáles
+                for message, notification in zip(messages, deliverable):
+                    try:
+                        delivered = connection.send_messages([message])
+                    except Exception as error:
+                        delivered, reason = 0, str(error)
+                    else:
+                        reason = "El backend de correo no envió el mensaje"
+                    if not delivered:
+                        _retry_later([notification], reason, now)
+                        failed += 1
+                        continue
+                    mark_sent([notification], now)
+                    sent += 1
+            finally:
+                connection.close()
+
+        save_batch(batch)
+        if len(batch) < batch_size:
+            break
+    return sent, failed
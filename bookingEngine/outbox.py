@@ -0,0 +1,68 @@
+"""
+Colas de salida guardadas en la base de datos.
+
+Las notificaciones por correo (`BookingNotification`) y los cambios para el
+calendario externo (`CalendarSyncEvent`) se encolan como filas con `status`,
+`attempts`, `next_attempt_at`, `last_error` y `sent_at`, y se procesan por
+lotes. Tomar un lote reserva sus filas por `CLAIM_MINUTES` para que dos
+trabajadores no procesen lo mismo; las filas que fallan se reintentan con
+espera exponencial hasta agotar sus intentos.
+"""
+from datetime import timedelta
+from django.db import transaction
+
+# Tiempo durante el que un lote tomado no puede tomarlo otro trabajador
+CLAIM_MINUTES = 10
+
+OUTBOX_FIELDS = ['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at']
+
+
+def claim_batch(queryset, batch_size, now):
+    """
+    Toma hasta `batch_size` filas pendientes de `queryset` cuyo intento ya
+    corresponde, saltando las que otro trabajador tiene bloqueadas, y las
+    reserva hasta `now + CLAIM_MINUTES`.
+    """
+    with transaction.atomic():
+        batch = list(queryset.select_for_update(skip_locked=True, of=('self',)).filter(
+            status='pending', next_attempt_at__lte=now
+        ).order_by('next_attempt_at', 'pk')[:batch_size])
+        queryset.model.objects.filter(pk__in=[row.pk for row in batch]).update(
+            next_attempt_at=now + timedelta(minutes=CLAIM_MINUTES)
+        )
+    return batch
+
+
+def retry_later(rows, error, now, max_attempts, base_minutes):
+    """
+    Cuenta un intento fallido: la fila se reintenta tras `base_minutes`
+    minutos, el doble en cada intento, o queda fallida al llegar a
+    `max_attempts`.
+    """
+    for row in rows:
+        row.attempts += 1
+        row.last_error = error
+        if row.attempts >= max_attempts:
+            row.status = 'failed'
+        else:
+            row.next_attempt_at = now + timedelta(minutes=base_minutes * 2 ** (row.attempts - 1))
+
+
+def mark_sent(rows, now):
+    for row in rows:
+        row.attempts += 1
+        row.status = 'sent'
+        row.sent_at = now
+
+
+def mark_failed(rows, error):
+    """Da las filas por fallidas sin más intentos."""
+    for row in rows:
+        row.status = 'failed'
+        row.last_error = error
+
+
+def save_batch(batch):
+    """Guarda el resultado del lote con una actualización en bloque."""
+    if batch:
+        type(batch[0]).objects.bulk_update(batch, OUTBOX_FIELDS, batch_size=500)
@@ -0,0 +1,91 @@
+"""
+Paginación por clave (keyset) para listados grandes.
+
+En lugar de OFFSET, cada página continúa después de la última fila de la
+anterior comparando la clave de ordenación (start_datetime, id). El coste de
+una página no depende de cuántas filas hay antes que ella y las filas nuevas
+no desplazan a las ya vistas.
+"""
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class StartKeysetPagination(BasePagination):
+    """
+    Pagina de más reciente a más antigua por (start_datetime, id), el mismo
+    orden que `Booking.Meta.ordering`. La respuesta incluye `next`, la URL de
+    la página siguiente, o None en la última.
+    """
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Cursor inválido'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            start_datetime, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(start_datetime__lt=start_datetime) |
+                Q(start_datetime=start_datetime, id__lt=pk)
+            )
+
+        # Se pide una fila de más para saber si hay página siguiente
+        rows = list(queryset.order_by('-start_datetime', '-id')[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, row):
+        position = f'{row.start_datetime.isoformat()}|{row.pk}'
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            start, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            start_datetime = parse_datetime(start)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if start_datetime is None:
+            raise NotFound(self.invalid_cursor_message)
+        return start_datetime, pk
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -1,10 +1,20 @@
 from rest_framework import serializers
 from .models import (
     BookingSettings, ResourceType, Agent, Resource, 
-    Schedule, Booking, BlockedTime
+    Schedule, Booking, BlockedTime, RecurringBlock, AvailableSlot, SlotHold,
+    ArchivedBooking, WaitlistEntry
 )
+from contextlib import contextmanager
+from copy import copy
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, timedelta
+from .admission import (
+    lock_booking_targets, find_conflict, assign_agent, candidate_agent_ids,
+    release_holds
+)
+from .cache import get_booking_settings
 
 
 
@@ -31,7 +41,7 @@ class ScheduleSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 class ResourceSerializer(serializers.ModelSerializer):
-    schedules = ScheduleSerializer(many=True, read_only=True)
+    schedules = ScheduleSerializer(source='schedule_set', many=True, read_only=True)
     agents = AgentSerializer(many=True, read_only=True)
     type_name = serializers.CharField(source='type.name', read_only=True)
     
@@ -39,6 +49,29 @@ class ResourceSerializer(serializers.ModelSerializer):
         model = Resource
         fields = '__all__'
 
+def validate_interval(resource, start_datetime, end_datetime):
+    """Reglas de una reserva que no dependen de otras reservas."""
+    # Verificar que el recurso está activo
+    if not resource.is_active:
+        raise serializers.ValidationError("Este recurso no está disponible actualmente")
+
+    if end_datetime <= start_datetime:
+        raise serializers.ValidationError("La hora de fin debe ser posterior a la hora de inicio")
+
+    # Verificar que la fecha no sea pasada
+    if start_datetime < timezone.now():
+        raise serializers.ValidationError("No se pueden hacer reservas en fechas pasadas")
+
+    # Verificar límite de anticipación
+    company_settings = get_booking_settings(resource.company_id)
+    if company_settings is None:
+        raise serializers.ValidationError("Esta empresa no tiene habilitado el sistema de reservas")
+    max_future_date = timezone.now() + timedelta(days=company_settings.advance_booking_limit)
+    if start_datetime > max_future_date:
+        raise serializers.ValidationError(
+            f"Solo se pueden hacer reservas con {company_settings.advance_booking_limit} días de anticipación"
+        )
+
 class BookingSerializer(serializers.ModelSerializer):
     resource_name = serializers.CharField(source='resource.name', read_only=True)
     agent_name = serializers.CharField(source='agent.name', read_only=True)
@@ -52,51 +85,206 @@ class BookingSerializer(serializers.ModelSerializer):
     
     def validate(self, data):
         # Validaciones adicionales para la reserva
-        resource = data.get('resource')
-        start_datetime = data.get('start_datetime')
-        end_datetime = data.get('end_datetime')
-        agent = data.get('agent')
+        resource = data.get('resource', getattr(self.instance, 'resource', None))
+        start_datetime = data.get('start_datetime', getattr(self.instance, 'start_datetime', None))
+        end_datetime = data.get('end_datetime', getattr(self.instance, 'end_datetime', None))
+        validate_interval(resource, start_datetime, end_datetime)
 
-        # Verificar que el recurso está activo
-        if not resource.is_active:
-            raise serializers.ValidationError("Este recurso no está disponible actualmente")
+        # La disponibilidad se verifica al guardar, con el recurso bloqueado
+        return data
 
-        # Verificar que la fecha no sea pasada
-        if start_datetime < timezone.now():
-            raise serializers.ValidationError("No se pueden hacer reservas en fechas pasadas")
+    @contextmanager
+    def _admission(self, validated_data):
+        """
+        Verifica la disponibilidad y guarda dentro de una misma transacción.
+        El bloque agrega la reserva guardada a la lista que recibe, para
+        consumir con ella las retenciones del usuario.
+        """
+        instance = self.instance
+        resource = validated_data.get('resource', getattr(instance, 'resource', None))
+        agent = validated_data.get('agent', getattr(instance, 'agent', None))
+        start_datetime = validated_data.get('start_datetime', getattr(instance, 'start_datetime', None))
+        end_datetime = validated_data.get('end_datetime', getattr(instance, 'end_datetime', None))
+        user = validated_data.get('user', getattr(instance, 'user', None))
+        # Lo que se lee antes del bloqueo se resuelve fuera de la transacción:
+        # en SQLite una lectura previa impide luego tomar el bloqueo de escritura
+        auto_assign = agent is None and resource.type.requires_agent
+        candidates = candidate_agent_ids(resource) if auto_assign else []
 
-        # Verificar límite de anticipación
-        company_settings = BookingSettings.objects.get(company=resource.company)
-        max_future_date = timezone.now() + timedelta(days=company_settings.advance_booking_limit)
-        if start_datetime > max_future_date:
-            raise serializers.ValidationError(
-                f"Solo se pueden hacer reservas con {company_settings.advance_booking_limit} días de anticipación"
+        with transaction.atomic():
+            if auto_assign:
+                # Asignación automática: se bloquean todos los candidatos para
+                # que dos solicitudes simultáneas no elijan al mismo agente
+                lock_booking_targets(resource.pk, candidates)
+                agent = assign_agent(
+                    resource, start_datetime, end_datetime,
+                    exclude=instance.pk if instance else None, user=user
+                )
+                if agent is None:
+                    raise serializers.ValidationError("No hay agentes disponibles en este horario")
+                validated_data['agent'] = agent
+            else:
+                lock_booking_targets(resource.pk, [agent.pk if agent else None])
+            conflict = find_conflict(
+                resource, agent, start_datetime, end_datetime,
+                exclude=instance.pk if instance else None, user=user
             )
+            if conflict:
+                raise serializers.ValidationError(conflict)
+            saved = []
+            yield saved
+            if user:
+                release_holds(user, resource, saved)
 
-        # Verificar disponibilidad
-        if Booking.objects.filter(
-            resource=resource,
-            start_datetime__lt=end_datetime,
-            end_datetime__gt=start_datetime,
-            status='confirmed'
-        ).exists():
-            raise serializers.ValidationError("El recurso no está disponible en este horario")
-
-        if agent and Booking.objects.filter(
-            agent=agent,
-            start_datetime__lt=end_datetime,
-            end_datetime__gt=start_datetime,
-            status='confirmed'
-        ).exists():
-            raise serializers.ValidationError("El agente no está disponible en este horario")
+    def create(self, validated_data):
+        with self._admission(validated_data) as saved:
+            saved.append(super().create(validated_data))
+        return saved[0]
 
+    def update(self, instance, validated_data):
+        with self._admission(validated_data) as saved:
+            saved.append(super().update(instance, validated_data))
+        return saved[0]
+
+class SlotHoldSerializer(serializers.ModelSerializer):
+    resource_name = serializers.CharField(source='resource.name', read_only=True)
+    
+    class Meta:
+        model = SlotHold
+        fields = '__all__'
+        read_only_fields = ('user', 'expires_at', 'created_at')
+    
+    def validate(self, data):
+        validate_interval(data['resource'], data['start_datetime'], data['end_datetime'])
         return data
 
+class RecurringBookingSerializer(serializers.Serializer):
+    """
+    Solicitud de reservas recurrentes o en bloque: una regla de recurrencia
+    a partir de la primera ocurrencia, o una lista explícita de ocurrencias.
+    """
+    MAX_OCCURRENCES = 100
+    FREQUENCY_CHOICES = [
+        ('daily', 'Diaria'),
+        ('weekly', 'Semanal'),
+    ]
+    
+    resource = serializers.PrimaryKeyRelatedField(queryset=Resource.objects.all())
+    agent = serializers.PrimaryKeyRelatedField(
+        queryset=Agent.objects.all(), required=False, allow_null=True
+    )
+    start_datetime = serializers.DateTimeField(required=False)
+    end_datetime = serializers.DateTimeField(required=False)
+    frequency = serializers.ChoiceField(choices=FREQUENCY_CHOICES, default='weekly')
+    interval = serializers.IntegerField(min_value=1, default=1)
+    count = serializers.IntegerField(min_value=1, max_value=MAX_OCCURRENCES, required=False)
+    until = serializers.DateField(required=False)
+    occurrences = serializers.ListField(
+        child=serializers.DictField(child=serializers.DateTimeField()),
+        required=False,
+        max_length=MAX_OCCURRENCES
+    )
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+    
+    def validate(self, data):
+        if not data['resource'].is_active:
+            raise serializers.ValidationError("Este recurso no está disponible actualmente")
+        
+        # La asignación automática elige agente por reserva; una serie
+        # necesita un agente fijo
+        if data.get('agent') is None and data['resource'].type.requires_agent:
+            raise serializers.ValidationError(
+                "Este recurso requiere agente: indique el agente de las reservas recurrentes"
+            )
+        
+        if data.get('occurrences'):
+            try:
+                occurrences = [
+                    (occurrence['start_datetime'], occurrence['end_datetime'])
+                    for occurrence in data['occurrences']
+                ]
+            except KeyError:
+                raise serializers.ValidationError(
+                    "Cada ocurrencia debe indicar start_datetime y end_datetime"
+                )
+        else:
+            occurrences = self._expand(data)
+        
+        if any(end <= start for start, end in occurrences):
+            raise serializers.ValidationError("La hora de fin debe ser posterior a la hora de inicio")
+        data['occurrences'] = occurrences
+        return data
+    
+    def _expand(self, data):
+        """Expande la regla de recurrencia a partir de la primera ocurrencia."""
+        if 'start_datetime' not in data or 'end_datetime' not in data:
+            raise serializers.ValidationError(
+                "Indique start_datetime y end_datetime, o una lista de ocurrencias"
+            )
+        if 'count' not in data and 'until' not in data:
+            raise serializers.ValidationError("Indique count o until para la recurrencia")
+        
+        days = data['interval'] * (7 if data['frequency'] == 'weekly' else 1)
+        step = timedelta(days=days)
+        start, end = data['start_datetime'], data['end_datetime']
+        count = data.get('count', self.MAX_OCCURRENCES)
+        until = data.get('until')
+        
+        occurrences = []
+        while len(occurrences) < count:
+            if until and timezone.localtime(start).date() > until:
+                break
+            occurrences.append((start, end))
+            start, end = start + step, end + step
+        
+        if until and len(occurrences) == self.MAX_OCCURRENCES and timezone.localtime(start).date() <= until:
+            raise serializers.ValidationError(
+                f"La recurrencia no puede superar {self.MAX_OCCURRENCES} ocurrencias"
+            )
+        return occurrences
+
 class BlockedTimeSerializer(serializers.ModelSerializer):
     class Meta:
         model = BlockedTime
         fields = '__all__'
 
+class RecurringBlockSerializer(serializers.ModelSerializer):
+    frequency_display = serializers.CharField(source='get_frequency_display', read_only=True)
+    
+    class Meta:
+        model = RecurringBlock
+        fields = '__all__'
+    
+    def validate_days_of_week(self, value):
+        if any(not isinstance(day, int) or not 0 <= day <= 6 for day in value):
+            raise serializers.ValidationError("Los días de la semana deben ser enteros entre 0 y 6")
+        return sorted(set(value))
+    
+    def validate_excluded_dates(self, value):
+        try:
+            return sorted({date.fromisoformat(day).isoformat() for day in value})
+        except (TypeError, ValueError):
+            raise serializers.ValidationError("Las excepciones deben ser fechas AAAA-MM-DD")
+    
+    def validate(self, data):
+        # La regla completa se valida con las reglas del modelo
+        block = copy(self.instance) if self.instance else RecurringBlock()
+        for field, value in data.items():
+            setattr(block, field, value)
+        try:
+            block.clean()
+        except DjangoValidationError as error:
+            raise serializers.ValidationError(error.messages)
+        return data
+
+class AvailableSlotSerializer(serializers.ModelSerializer):
+    resource_name = serializers.CharField(source='resource.name', read_only=True)
+    company = serializers.IntegerField(source='resource.company_id', read_only=True)
+    
+    class Meta:
+        model = AvailableSlot
+        fields = '__all__'
+
 # Serializers adicionales para vistas específicas
 class ResourceAvailabilitySerializer(serializers.Serializer):
     date = serializers.DateField()
@@ -108,4 +296,54 @@ class AgentAvailabilitySerializer(serializers.Serializer):
     date = serializers.DateField()
     available_slots = serializers.ListField(
         child=serializers.DictField()
-    )
\ No newline at end of file
+    )
+class ArchivedBookingSerializer(serializers.ModelSerializer):
+    resource_name = serializers.CharField(source='resource.name', read_only=True)
+    agent_name = serializers.CharField(source='agent.name', read_only=True)
+    user_email = serializers.CharField(source='user.email', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = ArchivedBooking
+        fields = '__all__'
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    resource_name = serializers.CharField(source='resource.name', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = WaitlistEntry
+        fields = '__all__'
+        read_only_fields = ('user', 'status', 'booking', 'offer_expires_at', 'created_at')
+    
+    def validate(self, data):
+        resource = data['resource']
+        agent = data.get('agent')
+        if data['window_end'] <= data['window_start']:
+            raise serializers.ValidationError("El fin de la ventana debe ser posterior a su inicio")
+        if data['window_end'] <= timezone.now():
+            raise serializers.ValidationError("La ventana de espera ya terminó")
+        if agent and not resource.agents.filter(pk=agent.pk).exists():
+            raise serializers.ValidationError("El agente no atiende este recurso")
+        if get_booking_settings(resource.company_id) is None:
+            raise serializers.ValidationError("Esta empresa no tiene habilitado el sistema de reservas")
+        return data
+
+class UtilizationSerializer(serializers.Serializer):
+    resource = serializers.IntegerField(allow_null=True)
+    agent = serializers.IntegerField(allow_null=True)
+    period = serializers.DateField()
+    booked_minutes = serializers.IntegerField(source='booked')
+    scheduled_minutes = serializers.IntegerField(source='scheduled')
+    occupancy = serializers.SerializerMethodField()
+    
+    def get_occupancy(self, obj):
+        # Porcentaje de los minutos de horario ocupados por reservas
+        if not obj['scheduled']:
+            return None
+        return round(100 * obj['booked'] / obj['scheduled'], 1)
+
+class ResourceAvailabilityMatrixSerializer(serializers.Serializer):
+    resource = serializers.IntegerField()
+    name = serializers.CharField()
+    days = ResourceAvailabilitySerializer(many=True)
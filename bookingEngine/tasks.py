@@ -0,0 +1,39 @@
+"""
+Ejecución en segundo plano de trabajos disparados por las peticiones.
+
+Los trabajos se encolan al confirmarse la transacción y corren en un pool de
+hilos del proceso, de modo que la respuesta no espera por ellos. Si el
+proceso se detiene antes de terminarlos, los comandos periódicos (ej:
+`send_booking_notifications`) retoman lo pendiente. Con
+`BOOKING_TASKS_EAGER = True` se ejecutan en el acto, lo que facilita las
+pruebas.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Hilos dedicados a los trabajos en segundo plano
+MAX_WORKERS = 2
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='booking-tasks')
+
+
+def _run(func, args, kwargs):
+    close_old_connections()
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Error en el trabajo en segundo plano %s", func.__name__)
+    finally:
+        close_old_connections()
+
+
+def run_in_background(func, *args, **kwargs):
+    """Ejecuta `func` fuera del hilo de la petición tras el commit."""
+    if getattr(settings, 'BOOKING_TASKS_EAGER', False):
+        transaction.on_commit(lambda: func(*args, **kwargs))
+        return
+    transaction.on_commit(lambda: _executor.submit(_run, func, args, kwargs))
@@ -1,3 +1,1910 @@
-from django.test import TestCase
+import random
+import smtplib
+import threading
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+import requests
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from marketplace.models import Company, Order
+from .admission import FULL_MESSAGE, HELD_MESSAGE, HOLD_MINUTES, assign_agent, find_conflict
+from .availability import (
+    BUSY_STATUSES, ConcurrencyIndex, agent_free_intervals, any_agent_slots, day_bounds,
+    make_aware_datetime, peak_concurrency, recurring_block_intervals, resource_agent_slots,
+    resource_available_slots, saturated_intervals
+)
+from .cache import (
+    acquire_idempotency_lock, get_booking_settings, get_idempotent_response, get_owned_company_ids,
+    invalidate_booking_settings, store_idempotent_response
+)
+from .calendar_sync import MAX_ATTEMPTS, RETRY_BASE_MINUTES, CalendarClient, push_pending
+from .checks import check_shared_cache
+from .dashboard import build_dashboard
+from .ical import feed_token
+from .lifecycle import archive_bookings, complete_past_bookings, completion_lag
+from .models import (
+    Agent, ArchivedBooking, AvailableSlot, BlockedTime, Booking, BookingNotification, BookingSettings,
+    CalendarSyncEvent, RecurringBlock, Resource, ResourceType, Schedule, SlotHold, UtilizationRollup, WaitlistEntry
+)
+from .notifications import dispatch_pending, enqueue_notification
+from .outbox import CLAIM_MINUTES, claim_batch, mark_failed, mark_sent, retry_later, save_batch
+from .views import IsCompanyOwnerOrAdmin
 
-# Create your tests here.
+
+class BookingFixtures:
+    """Empresa con un recurso siempre disponible y sus usuarios."""
+
+    def create_fixtures(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com')
+        self.customer = User.objects.create_user('customer', 'customer@example.com')
+        self.company = Company.objects.create(user=self.owner, name='Empresa', description='')
+        self.settings = BookingSettings.objects.get(company=self.company)
+        self.settings.automatic_confirmation = True
+        self.settings.cancellation_limit_hours = 1
+        self.settings.save()
+        self.resource_type = ResourceType.objects.create(
+            name='Servicio', description='', company=self.company, requires_agent=False
+        )
+        self.resource = self.create_resource('Sala')
+        self.start = (timezone.now() + timedelta(days=2)).replace(minute=0, second=0, microsecond=0)
+
+    def create_resource(self, name, resource_type=None, **fields):
+        fields.setdefault('duration', 60)
+        fields.setdefault('availability_type', 'always')
+        return Resource.objects.create(
+            type=resource_type or self.resource_type, company=self.company, name=name,
+            description='', **fields
+        )
+
+    def create_agent(self, name):
+        return Agent.objects.create(
+            company=self.company, name=name, email=f'{name}@example.com', phone='1'
+        )
+
+    def create_booking(self, start=None, minutes=60, **fields):
+        start = start or self.start
+        fields.setdefault('status', 'confirmed')
+        fields.setdefault('user', self.customer)
+        fields.setdefault('resource', self.resource)
+        return Booking.objects.create(
+            start_datetime=start, end_datetime=start + timedelta(minutes=minutes), **fields
+        )
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+
+class ConcurrentAdmissionTests(BookingFixtures, TransactionTestCase):
+    """Solicitudes simultáneas por el mismo horario, cada una en su conexión."""
+    REQUESTS = 12
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Requiere una base de pruebas en archivo")
+        self.create_fixtures()
+
+    def test_concurrent_requests_for_the_same_slot_admit_one_booking(self):
+        users = [
+            User.objects.create_user(f'user{index}', f'user{index}@example.com')
+            for index in range(self.REQUESTS)
+        ]
+        barrier = threading.Barrier(self.REQUESTS)
+        statuses = []
+
+        def book(user):
+            client = self.client_for(user)
+            barrier.wait()
+            try:
+                response = client.post('/api/bookings/', {
+                    'resource': self.resource.pk,
+                    'user': user.pk,
+                    'start_datetime': self.start,
+                    'end_datetime': self.start + timedelta(hours=1),
+                }, format='json')
+                statuses.append(response.status_code)
+            except Exception:
+                statuses.append(500)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [201] + [400] * (self.REQUESTS - 1))
+        self.assertEqual(Booking.objects.filter(resource=self.resource).count(), 1)
+
+
+class RecurringBookingTests(BookingFixtures, TestCase):
+    def setUp(self):
+        self.create_fixtures()
+        self.agent_type = ResourceType.objects.create(
+            name='Corte', description='', company=self.company, requires_agent=True
+        )
+        self.agent_resource = self.create_resource('Corte', self.agent_type)
+        self.agent = self.create_agent('ana')
+        self.agent_resource.agents.add(self.agent)
+        self.client = self.client_for(self.customer)
+
+    def recurring(self, **data):
+        return self.client.post('/api/bookings/recurring/', {
+            'resource': self.agent_resource.pk,
+            'start_datetime': self.start,
+            'end_datetime': self.start + timedelta(hours=1),
+            'frequency': 'daily',
+            'count': 3,
+            **data
+        }, format='json')
+
+    def test_agent_required_resource_without_agent_is_rejected(self):
+        response = self.recurring()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Booking.objects.filter(resource=self.agent_resource).exists())
+
+    def test_agent_required_resource_with_agent_books_the_series(self):
+        response = self.recurring(agent=self.agent.pk)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['accepted'], 3)
+        self.assertEqual(
+            list(Booking.objects.filter(resource=self.agent_resource).values_list('agent', flat=True)),
+            [self.agent.pk] * 3
+        )
+
+
+class QueryParamValidationTests(BookingFixtures, TestCase):
+    def setUp(self):
+        self.create_fixtures()
+        self.client = self.client_for(self.owner)
+
+    def assertBadRequest(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 400, url)
+
+    def test_slot_filters(self):
+        self.assertBadRequest('/api/slots/?at=notadate')
+        self.assertBadRequest('/api/slots/?start_from=2024-13-45T00:00')
+        self.assertBadRequest('/api/slots/?resource=abc')
+        self.assertBadRequest('/api/slots/search/?country=abc')
+        self.assertEqual(self.client.get('/api/slots/?at=2030-01-01T10:00:00Z').status_code, 200)
+
+    def test_booking_filters(self):
+        for name in ('resource', 'agent', 'customer'):
+            self.assertBadRequest(f'/api/bookings/?{name}=abc')
+            self.assertBadRequest(f'/api/archived-bookings/?{name}=abc')
+        self.assertEqual(self.client.get(f'/api/bookings/?resource={self.resource.pk}').status_code, 200)
+
+    def test_utilization_filters(self):
+        for name in ('company', 'resource', 'agent'):
+            self.assertBadRequest(f'/api/utilization/?{name}=x')
+        self.assertEqual(self.client.get(f'/api/utilization/?resource={self.resource.pk}').status_code, 200)
+
+
+class CascadeDeleteTests(BookingFixtures, TestCase):
+    """Borrados en cascada que arrastran reservas confirmadas."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.booking = self.create_booking()
+        self.rollups = UtilizationRollup.objects.filter(resource=self.resource)
+
+    def test_deleting_resource_does_not_recreate_its_rollups(self):
+        self.assertEqual(self.rollups.get().booked_minutes, 60)
+        self.resource.delete()
+        connection.check_constraints()
+        self.assertFalse(UtilizationRollup.objects.exists())
+
+    def test_deleting_customer_subtracts_booking_from_rollups(self):
+        self.customer.delete()
+        connection.check_constraints()
+        self.assertEqual(self.rollups.get().booked_minutes, 0)
+
+    def test_deleting_company_with_calendar_sync(self):
+        self.settings.google_calendar_enabled = True
+        self.settings.google_calendar_credentials = {'access_token': 'token'}
+        self.settings.save()
+        self.owner.delete()
+        connection.check_constraints()
+        self.assertFalse(Booking.objects.exists())
+
+
+class OverlapIndexPlanTests(BookingFixtures, TestCase):
+    """
+    Plan de las consultas de solapamiento con un millón de reservas: todas
+    deben recorrer los índices (recurso|agente, fin, inicio).
+    """
+    BOOKINGS = 1_000_000
+    RESOURCES = 100
+    AGENTS = 50
+    # Inicio de la reserva n de cada recurso, en SQL de cada motor
+    START_SQL = {
+        'sqlite': "datetime('2030-01-01 00:00:00', '+' || ((n / {resources}) * 30) || ' minutes')",
+        'postgresql': "TIMESTAMPTZ '2030-01-01 00:00:00+00' + (n / {resources}) * INTERVAL '30 minutes'",
+    }
+    END_SQL = {
+        'sqlite': "datetime('2030-01-01 00:00:00', '+' || ((n / {resources}) * 30 + 30) || ' minutes')",
+        'postgresql': "TIMESTAMPTZ '2030-01-01 00:00:00+00' + ((n / {resources}) * 30 + 30) * INTERVAL '1 minute'",
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        if connection.vendor not in cls.START_SQL:
+            return
+        fixtures = cls()
+        fixtures.create_fixtures()
+        cls.fixtures = fixtures
+        cls.resources = Resource.objects.bulk_create([
+            Resource(type=fixtures.resource_type, company=fixtures.company, name=f'r{index}',
+                     description='', duration=30, availability_type='always')
+            for index in range(cls.RESOURCES)
+        ])
+        cls.agents = Agent.objects.bulk_create([
+            Agent(company=fixtures.company, name=f'a{index}', email=f'a{index}@example.com', phone='1')
+            for index in range(cls.AGENTS)
+        ])
+        first_resource = min(resource.pk for resource in cls.resources)
+        first_agent = min(agent.pk for agent in cls.agents)
+        assert max(resource.pk for resource in cls.resources) - first_resource == cls.RESOURCES - 1
+        assert max(agent.pk for agent in cls.agents) - first_agent == cls.AGENTS - 1
+
+        start = cls.START_SQL[connection.vendor].format(resources=cls.RESOURCES)
+        end = cls.END_SQL[connection.vendor].format(resources=cls.RESOURCES)
+        table = Booking._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH RECURSIVE seq(n) AS (
+                    SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < %s
+                )
+                INSERT INTO "{table}" (
+                    user_id, resource_id, agent_id, start_datetime, end_datetime,
+                    status, notes, created_at, updated_at
+                )
+                SELECT %s, %s + n % {cls.RESOURCES}, %s + n % {cls.AGENTS}, {start}, {end},
+                       CASE WHEN n % 4 = 0 THEN 'cancelled' ELSE 'confirmed' END, '', %s, %s
+                FROM seq
+            """, [cls.BOOKINGS - 1, fixtures.customer.pk, first_resource, first_agent,
+                  timezone.now(), timezone.now()])
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor not in self.START_SQL:
+            self.skipTest("Datos generados solo para SQLite y PostgreSQL")
+        middle = datetime(2030, 3, 15, 10, 0, tzinfo=dt_timezone.utc)
+        self.overlap = {
+            'start_datetime__lt': middle + timedelta(hours=1),
+            'end_datetime__gt': middle,
+        }
+
+    def assertUsesIndex(self, queryset, index_name):
+        # Como en find_conflict y busy_intervals, sin el orden por defecto
+        self.assertIn(index_name, queryset.order_by().explain())
+
+    def test_data_volume(self):
+        self.assertEqual(Booking.objects.count(), self.BOOKINGS)
+
+    def test_resource_overlap_uses_index(self):
+        bookings = Booking.objects.filter(
+            resource=self.resources[3], status__in=BUSY_STATUSES, **self.overlap
+        )
+        self.assertUsesIndex(bookings, 'booking_resource_overlap_idx')
+        self.assertEqual(bookings.count(), 2)
+
+    def test_agent_overlap_uses_index(self):
+        self.assertUsesIndex(
+            Booking.objects.filter(agent=self.agents[7], status__in=BUSY_STATUSES, **self.overlap),
+            'booking_agent_overlap_idx'
+        )
+
+    def test_resource_set_overlap_uses_index(self):
+        # Lectura en bloque de la disponibilidad de varios recursos
+        self.assertUsesIndex(
+            Booking.objects.filter(
+                resource__in=self.resources[:10], status__in=BUSY_STATUSES, **self.overlap
+            ).order_by().values_list('resource', 'start_datetime', 'end_datetime'),
+            'booking_resource_overlap_idx'
+        )
+
+    def test_blocked_time_overlap_uses_index(self):
+        self.assertUsesIndex(
+            BlockedTime.objects.filter(resource=self.resources[3], **self.overlap),
+            'blockedtime_resource_idx'
+        )
+
+
+class EndpointQueryCountTests(BookingFixtures, TestCase):
+    """
+    Las consultas de los listados no dependen de cuántas filas devuelven:
+    cada endpoint se mide con dos tamaños de página (o de listado, en los
+    que no paginan) y debe hacer el mismo número de consultas.
+    """
+    SIZES = (3, 25)
+
+    def setUp(self):
+        self.create_fixtures()
+        self.client = self.client_for(self.owner)
+
+    def get(self, url, queries):
+        # La primera petición llena la caché de empresas y configuración
+        self.client.get(url)
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response.data
+
+    def assertListQueries(self, url, queries, create_row):
+        created = 0
+        for size in self.SIZES:
+            for index in range(created, size):
+                create_row(index)
+            created = size
+            data = self.get(url, queries)
+            self.assertEqual(len(data), size)
+
+    def assertPageQueries(self, url, queries, create_row, page_param, results='results'):
+        for index in range(max(self.SIZES) + 5):
+            create_row(index)
+        for size in self.SIZES:
+            data = self.get(f'{url}?{page_param}={size}', queries)
+            self.assertEqual(len(data[results]), size)
+
+    def assertActionQueries(self, url, queries, create_row):
+        # Acciones que no listan filas: las consultas no dependen de cuántas
+        # reservas o bloqueos haya en el día
+        created = 0
+        for size in self.SIZES:
+            for index in range(created, size):
+                create_row(index)
+            created = size
+            self.get(url, queries)
+
+    def create_agent_resource(self, index):
+        resource = self.create_resource(f'r{index}')
+        resource.agents.add(self.create_agent(f'a{index}'))
+        Schedule.objects.create(
+            resource=resource, day_of_week=index % 7,
+            start_time=time(9), end_time=time(18)
+        )
+        return resource
+
+    def test_resources(self):
+        self.resource.delete()
+        self.assertListQueries('/api/resources/', 3, self.create_agent_resource)
+        resource = Resource.objects.first()
+        self.get(f'/api/resources/{resource.pk}/', 3)
+
+    def test_agents(self):
+        self.assertListQueries('/api/agents/', 1, lambda index: self.create_agent(f'a{index}'))
+        self.get(f'/api/agents/{Agent.objects.first().pk}/', 1)
+
+    def test_blocked_times(self):
+        agent = self.create_agent('ana')
+
+        def create_block(index):
+            start = self.start + timedelta(days=index)
+            BlockedTime.objects.create(
+                resource=self.resource, agent=agent, start_datetime=start,
+                end_datetime=start + timedelta(hours=1), reason='Mantenimiento'
+            )
+        self.assertListQueries('/api/blocked-times/', 1, create_block)
+        self.get(f'/api/blocked-times/{BlockedTime.objects.first().pk}/', 1)
+
+    def test_bookings(self):
+        agent = self.create_agent('ana')
+        self.assertPageQueries('/api/bookings/', 1, lambda index: self.create_booking(
+            self.start + timedelta(hours=index), agent=agent
+        ), 'page_size')
+        self.get(f'/api/bookings/{Booking.objects.first().pk}/', 1)
+
+    def test_slots(self):
+        def create_slot(index):
+            start = self.start + timedelta(hours=index)
+            AvailableSlot.objects.create(
+                resource=self.resource, date=start.date(), start_datetime=start,
+                end_datetime=start + timedelta(hours=1), agents=[]
+            )
+        self.assertPageQueries('/api/slots/', 2, create_slot, 'limit')
+        self.get(f'/api/slots/{AvailableSlot.objects.first().pk}/', 1)
+
+    def test_waitlist(self):
+        users = []
+
+        def create_entry(index):
+            users.append(User.objects.create_user(f'w{index}', f'w{index}@example.com'))
+            WaitlistEntry.objects.create(
+                user=users[-1], resource=self.resource,
+                window_start=self.start, window_end=self.start + timedelta(hours=4)
+            )
+        self.assertListQueries('/api/waitlist/', 1, create_entry)
+        self.get(f'/api/waitlist/{WaitlistEntry.objects.first().pk}/', 1)
+
+    def test_settings(self):
+        def create_company(index):
+            # La empresa del fixture es la primera
+            if index:
+                Company.objects.create(user=self.owner, name=f'Empresa {index}', description='')
+                # El usuario autenticado guarda sus empresas durante la petición:
+                # cada petición real carga uno nuevo
+                self.client = self.client_for(User.objects.get(pk=self.owner.pk))
+        self.assertListQueries('/api/settings/', 1, create_company)
+        self.get(f'/api/settings/{self.settings.pk}/', 1)
+
+    def test_resource_types(self):
+        def create_type(index):
+            if index:
+                ResourceType.objects.create(name=f't{index}', description='', company=self.company)
+        self.assertListQueries('/api/resource-types/', 1, create_type)
+        self.get(f'/api/resource-types/{self.resource_type.pk}/', 1)
+
+    def test_recurring_blocks(self):
+        agent = self.create_agent('ana')
+
+        def create_block(index):
+            RecurringBlock.objects.create(
+                resource=self.resource if index % 2 else None, agent=None if index % 2 else agent,
+                days_of_week=[index % 7], start_time=time(13), end_time=time(14),
+                start_date=self.start.date(), reason='Almuerzo'
+            )
+        self.assertListQueries('/api/recurring-blocks/', 1, create_block)
+        self.get(f'/api/recurring-blocks/{RecurringBlock.objects.first().pk}/', 1)
+
+    def test_archived_bookings(self):
+        agent = self.create_agent('ana')
+
+        def create_archived(index):
+            start = self.start - timedelta(days=400, hours=index)
+            ArchivedBooking.objects.create(
+                original_id=index + 1, company=self.company, user=self.customer,
+                resource=self.resource, agent=agent, start_datetime=start,
+                end_datetime=start + timedelta(hours=1), status='completed',
+                created_at=start, updated_at=start
+            )
+        self.assertPageQueries('/api/archived-bookings/', 1, create_archived, 'page_size')
+        self.get(f'/api/archived-bookings/{ArchivedBooking.objects.first().pk}/', 1)
+
+    def test_availability_actions(self):
+        agent_type = ResourceType.objects.create(
+            name='Corte', description='', company=self.company, requires_agent=True
+        )
+        chair = self.create_resource('Silla', agent_type)
+        agents = [self.create_agent(f'a{index}') for index in range(3)]
+        chair.agents.add(*agents)
+        for agent in agents:
+            Schedule.objects.create(
+                agent=agent, day_of_week=self.start.weekday(), start_time=time(0), end_time=time(23)
+            )
+        day = timezone.localtime(self.start).date()
+
+        # Horarios, bloqueos recurrentes, bloqueos, reservas y retenciones de
+        # los recursos y, en los que requieren agente, también de sus agentes
+        def create_bookings(index):
+            start = self.start + timedelta(minutes=15 * index)
+            end = start + timedelta(minutes=15)
+            Booking.objects.create(
+                resource=self.resource, user=self.customer, status='confirmed',
+                start_datetime=start, end_datetime=end
+            )
+            Booking.objects.create(
+                resource=chair, agent=agents[index % 3], user=self.customer,
+                status='confirmed', start_datetime=start, end_datetime=end
+            )
+        self.assertActionQueries(f'/api/resources/{self.resource.pk}/availability/?date={day}', 6, create_bookings)
+        Booking.objects.all().delete()
+        self.assertActionQueries(f'/api/resources/{chair.pk}/availability/?date={day}', 12, create_bookings)
+        Booking.objects.all().delete()
+        self.assertActionQueries(
+            f'/api/resources/{chair.pk}/availability/?date={day}&agent={agents[0].pk}', 12, create_bookings
+        )
+        Booking.objects.all().delete()
+        self.assertActionQueries(f'/api/agents/{agents[0].pk}/availability/?date={day}', 6, create_bookings)
+        Booking.objects.all().delete()
+        self.assertActionQueries(
+            f'/api/resources/matrix/?date_from={day}&date_to={day + timedelta(days=3)}', 12, create_bookings
+        )
+
+
+def brute_force_count(intervals, moment):
+    return sum(1 for start, end in intervals if start <= moment < end)
+
+
+def brute_force_peak(intervals, start, end):
+    # La ocupación solo cambia en los inicios
+    moments = [start] + [busy_start for busy_start, busy_end in intervals if start < busy_start < end]
+    return max(brute_force_count(intervals, moment) for moment in moments)
+
+
+class ConcurrencyTests(SimpleTestCase):
+    """Barrido de ocupación frente al recuento directo, con minutos enteros."""
+    SEED = 20241018
+    ROUNDS = 200
+
+    def random_intervals(self, rng, count, horizon=300):
+        intervals = []
+        for _ in range(count):
+            start = rng.randrange(horizon)
+            intervals.append((start, start + rng.randint(1, 60)))
+        return intervals
+
+    def test_peak_concurrency(self):
+        rng = random.Random(self.SEED)
+        for _ in range(self.ROUNDS):
+            intervals = self.random_intervals(rng, rng.randint(0, 40))
+            start = rng.randrange(350)
+            end = start + rng.randint(1, 90)
+            self.assertEqual(
+                peak_concurrency(intervals, start, end), brute_force_peak(intervals, start, end)
+            )
+
+    def test_saturated_intervals(self):
+        rng = random.Random(self.SEED)
+        for _ in range(self.ROUNDS):
+            intervals = self.random_intervals(rng, rng.randint(0, 40))
+            capacity = rng.randint(1, 6)
+            saturated = saturated_intervals(intervals, capacity)
+            # Intervalos ordenados, disjuntos y no contiguos
+            for (first_start, first_end), (second_start, second_end) in zip(saturated, saturated[1:]):
+                self.assertLess(first_end, second_start)
+            covered = {minute for start, end in saturated for minute in range(start, end)}
+            expected = {
+                minute for minute in range(400)
+                if brute_force_count(intervals, minute) >= capacity
+            }
+            self.assertEqual(covered, expected)
+
+    def test_concurrency_index_with_added_intervals(self):
+        rng = random.Random(self.SEED)
+        for _ in range(self.ROUNDS):
+            intervals = self.random_intervals(rng, rng.randint(0, 30))
+            added = self.random_intervals(rng, rng.randint(0, 10))
+            index = ConcurrencyIndex(intervals)
+            for start, end in added:
+                index.add(start, end)
+            everything = intervals + added
+            for _ in range(10):
+                start = rng.randrange(-20, 380)
+                end = start + rng.randint(1, 90)
+                self.assertEqual(index.peak(start, end), brute_force_peak(everything, start, end))
+
+
+class CapacityConflictTests(BookingFixtures, TestCase):
+    """find_conflict sobre un recurso con cupos y miles de reservas solapadas."""
+    CAPACITY = 5
+    LANES = 4
+    BOOKINGS = 4000
+
+    def setUp(self):
+        self.create_fixtures()
+        self.shared = self.create_resource('Aula', capacity=self.CAPACITY)
+        # Cuatro carriles de reservas de diez minutos: ocupación constante de 4
+        self.intervals = [
+            (self.start + timedelta(minutes=10 * (index // self.LANES)),
+             self.start + timedelta(minutes=10 * (index // self.LANES + 1)))
+            for index in range(self.BOOKINGS)
+        ]
+        Booking.objects.bulk_create([
+            Booking(user=self.customer, resource=self.shared, status='confirmed',
+                    start_datetime=start, end_datetime=end)
+            for start, end in self.intervals
+        ])
+        self.end = self.intervals[-1][1]
+
+    def test_free_seat_across_all_bookings(self):
+        self.assertIsNone(find_conflict(self.shared, None, self.start, self.end))
+
+    def test_full_where_an_extra_booking_saturates(self):
+        middle = self.start + (self.end - self.start) / 2
+        self.create_booking(middle, minutes=15, resource=self.shared)
+        self.intervals.append((middle, middle + timedelta(minutes=15)))
+
+        self.assertEqual(find_conflict(self.shared, None, self.start, self.end), FULL_MESSAGE)
+        self.assertIsNone(find_conflict(self.shared, None, self.start, middle))
+        rng = random.Random(7)
+        for _ in range(20):
+            start = self.start + timedelta(minutes=rng.randrange(0, 10000, 5))
+            end = start + timedelta(minutes=rng.randint(5, 120))
+            full = brute_force_peak(self.intervals, start, end) >= self.CAPACITY
+            self.assertEqual(
+                find_conflict(self.shared, None, start, end), FULL_MESSAGE if full else None,
+                (start, end)
+            )
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    """Backend en memoria que falla al enviar a las direcciones de `failing`."""
+    failing = set()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if self.failing & set(message.to):
+                raise smtplib.SMTPRecipientsRefused({address: (550, b'') for address in message.to})
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='bookingEngine.tests.FlakyEmailBackend')
+class NotificationDispatchTests(BookingFixtures, TestCase):
+    def setUp(self):
+        self.create_fixtures()
+        self.notifications = []
+        for index in range(3):
+            user = User.objects.create_user(f'cliente{index}', f'cliente{index}@example.com')
+            booking = self.create_booking(self.start + timedelta(hours=index), user=user)
+            self.notifications.append(enqueue_notification(booking, 'reminder'))
+        self.addCleanup(FlakyEmailBackend.failing.clear)
+
+    def test_failed_message_is_retried_alone(self):
+        FlakyEmailBackend.failing.add('cliente1@example.com')
+        self.assertEqual(dispatch_pending(), (2, 1))
+        self.assertEqual(
+            sorted(address for message in mail.outbox for address in message.to),
+            ['cliente0@example.com', 'cliente2@example.com']
+        )
+        retried = BookingNotification.objects.get(status='pending')
+        self.assertEqual(retried.pk, self.notifications[1].pk)
+        self.assertEqual(retried.attempts, 1)
+        self.assertEqual(BookingNotification.objects.filter(status='sent').count(), 2)
+
+        # El reintento envía solo el mensaje que faltaba
+        FlakyEmailBackend.failing.clear()
+        BookingNotification.objects.filter(pk=retried.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(dispatch_pending(), (1, 0))
+        self.assertEqual(
+            sorted(address for message in mail.outbox for address in message.to),
+            ['cliente0@example.com', 'cliente1@example.com', 'cliente2@example.com']
+        )
+        self.assertFalse(BookingNotification.objects.exclude(status='sent').exists())
+
+
+@override_settings(BOOKING_TASKS_EAGER=True)
+class WaitlistMatchTests(BookingFixtures, TestCase):
+    """Al cancelar una reserva, su horario pasa a la lista de espera."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.booking = self.create_booking()
+        self.waiting = User.objects.create_user('espera', 'espera@example.com')
+
+    def add_entry(self, user=None, hours=(0, 3), **fields):
+        return WaitlistEntry.objects.create(
+            user=user or self.waiting, resource=self.resource,
+            window_start=self.start + timedelta(hours=hours[0]),
+            window_end=self.start + timedelta(hours=hours[1]), **fields
+        )
+
+    def cancel(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.owner).post(f'/api/bookings/{self.booking.pk}/cancel/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_auto_book_entry_gets_the_booking(self):
+        entry = self.add_entry(auto_book=True)
+        self.cancel()
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'booked')
+        self.assertEqual(entry.booking.user, self.waiting)
+        self.assertEqual(entry.booking.status, 'confirmed')
+        self.assertEqual(entry.booking.start_datetime, self.booking.start_datetime)
+        self.assertIn(['espera@example.com'], [message.to for message in mail.outbox])
+
+    def test_entry_without_auto_book_gets_a_hold(self):
+        entry = self.add_entry()
+        self.cancel()
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'offered')
+        hold = SlotHold.objects.get(user=self.waiting)
+        self.assertEqual(hold.start_datetime, self.booking.start_datetime)
+        self.assertEqual(entry.offer_expires_at, hold.expires_at)
+        self.assertFalse(Booking.objects.filter(user=self.waiting).exists())
+
+    def test_oldest_compatible_entry_wins(self):
+        # Ventana que no contiene el horario liberado
+        self.add_entry(hours=(1, 3), auto_book=True)
+        first = self.add_entry(auto_book=True)
+        second = self.add_entry(User.objects.create_user('otro', 'otro@example.com'), auto_book=True)
+        self.cancel()
+        self.assertEqual(
+            list(WaitlistEntry.objects.filter(status='booked').values_list('pk', flat=True)),
+            [first.pk]
+        )
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'waiting')
+
+    def test_booking_the_offer_marks_the_entry_booked(self):
+        entry = self.add_entry()
+        self.cancel()
+        response = self.client_for(self.waiting).post('/api/bookings/', {
+            'resource': self.resource.pk, 'user': self.waiting.pk,
+            'start_datetime': self.booking.start_datetime.isoformat(),
+            'end_datetime': self.booking.end_datetime.isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.booking_id), ('booked', response.data['id']))
+        self.assertFalse(SlotHold.objects.exists())
+
+    def test_other_bookings_leave_the_offer_open(self):
+        entry = self.add_entry()
+        self.cancel()
+        # Otra reserva del mismo usuario que no ocupa el horario ofrecido
+        later = self.booking.end_datetime + timedelta(hours=1)
+        response = self.client_for(self.waiting).post('/api/bookings/', {
+            'resource': self.resource.pk, 'user': self.waiting.pk,
+            'start_datetime': later.isoformat(), 'end_datetime': (later + timedelta(hours=1)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'offered')
+        self.assertTrue(SlotHold.objects.filter(user=self.waiting).exists())
+
+
+class FakeCalendarSession:
+    """Sesión HTTP que registra los envíos y responde con `status_code`."""
+
+    def __init__(self, status_code=200, error=None):
+        self.status_code = status_code
+        self.error = error
+        self.posts = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.posts.append({'url': url, 'json': json, 'headers': headers})
+        if self.error:
+            raise self.error
+        return SimpleNamespace(status_code=self.status_code, text='error')
+
+
+class CalendarSyncTests(BookingFixtures, TestCase):
+    def setUp(self):
+        self.create_fixtures()
+        self.settings.google_calendar_enabled = True
+        self.settings.google_calendar_credentials = {'access_token': 'token', 'calendar_id': 'agenda'}
+        self.settings.save()
+        self.session = FakeCalendarSession()
+        self.client = CalendarClient('https://calendar.example.com/', session=self.session)
+
+    def push(self):
+        return push_pending(client=self.client)
+
+    def test_changes_of_a_booking_are_sent_once(self):
+        booking = self.create_booking()
+        booking.notes = 'Primera nota'
+        booking.save()
+        booking.end_datetime += timedelta(minutes=30)
+        booking.save()
+        other = self.create_booking(self.start + timedelta(hours=3))
+        other.status = 'cancelled'
+        other.save()
+        self.assertEqual(CalendarSyncEvent.objects.count(), 5)
+
+        self.assertEqual(self.push(), (2, 0))
+        self.assertEqual(len(self.session.posts), 1)
+        post = self.session.posts[0]
+        self.assertEqual(post['url'], 'https://calendar.example.com/calendars/agenda/events/batch')
+        self.assertEqual(post['headers'], {'Authorization': 'Bearer token'})
+        changes = {change['id']: change for change in post['json']['changes']}
+        self.assertEqual(changes[f'booking-{booking.pk}']['action'], 'upsert')
+        self.assertEqual(changes[f'booking-{booking.pk}']['end'], booking.end_datetime.isoformat())
+        self.assertEqual(changes[f'booking-{booking.pk}']['description'], 'Primera nota')
+        self.assertEqual(changes[f'booking-{other.pk}'], {'id': f'booking-{other.pk}', 'action': 'delete'})
+        self.assertFalse(CalendarSyncEvent.objects.exclude(status='sent').exists())
+
+        # Sin cambios nuevos no hay envíos
+        self.assertEqual(self.push(), (0, 0))
+        self.assertEqual(len(self.session.posts), 1)
+
+    def assertRetryAfter(self, event, attempts, minutes, before):
+        event.refresh_from_db()
+        self.assertEqual(event.status, 'pending')
+        self.assertEqual(event.attempts, attempts)
+        self.assertGreaterEqual(event.next_attempt_at, before + timedelta(minutes=minutes))
+        self.assertLessEqual(event.next_attempt_at, timezone.now() + timedelta(minutes=minutes))
+
+    def test_failed_push_backs_off_exponentially(self):
+        self.create_booking()
+        event = CalendarSyncEvent.objects.get()
+        self.session.status_code = 503
+
+        before = timezone.now()
+        self.assertEqual(self.push(), (0, 1))
+        self.assertRetryAfter(event, 1, RETRY_BASE_MINUTES, before)
+        self.assertIn('HTTP 503', event.last_error)
+        # Antes de la espera no se reintenta
+        self.assertEqual(self.push(), (0, 0))
+        self.assertEqual(len(self.session.posts), 1)
+
+        self.session.error = requests.ConnectionError('sin conexión')
+        for attempts in range(2, MAX_ATTEMPTS):
+            CalendarSyncEvent.objects.filter(pk=event.pk).update(next_attempt_at=timezone.now())
+            before = timezone.now()
+            self.assertEqual(self.push(), (0, 1))
+            self.assertRetryAfter(event, attempts, RETRY_BASE_MINUTES * 2 ** (attempts - 1), before)
+
+        CalendarSyncEvent.objects.filter(pk=event.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(self.push(), (0, 1))
+        event.refresh_from_db()
+        self.assertEqual(event.status, 'failed')
+        self.assertEqual(event.attempts, MAX_ATTEMPTS)
+        self.assertEqual(event.last_error, 'sin conexión')
+
+
+class IdempotencyKeyTests(BookingFixtures, TestCase):
+    def setUp(self):
+        self.create_fixtures()
+        self.client = self.client_for(self.customer)
+        self.payload = {
+            'resource': self.resource.pk,
+            'user': self.customer.pk,
+            'start_datetime': self.start.isoformat(),
+            'end_datetime': (self.start + timedelta(hours=1)).isoformat(),
+        }
+
+    def post(self, url, payload, key='clave-1'):
+        return self.client.post(url, payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.post('/api/bookings/', self.payload)
+        self.assertEqual(first.status_code, 201)
+        # El orden de las claves del cuerpo no cambia la huella
+        retry = self.post('/api/bookings/', dict(reversed(list(self.payload.items()))))
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_key_reused_with_another_payload_is_rejected(self):
+        self.assertEqual(self.post('/api/bookings/', self.payload).status_code, 201)
+        other = dict(self.payload, notes='Otra reserva')
+        self.assertEqual(self.post('/api/bookings/', other).status_code, 422)
+        self.assertEqual(self.post('/api/bookings/recurring/', self.payload).status_code, 422)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_keys_are_per_user(self):
+        self.assertEqual(self.post('/api/bookings/', self.payload).status_code, 201)
+        self.client = self.client_for(self.owner)
+        later = self.start + timedelta(hours=2)
+        payload = dict(
+            self.payload, user=self.owner.pk, start_datetime=later.isoformat(),
+            end_datetime=(later + timedelta(hours=1)).isoformat()
+        )
+        self.assertEqual(self.post('/api/bookings/', payload).status_code, 201)
+        self.assertEqual(Booking.objects.count(), 2)
+
+
+    def test_response_stored_while_taking_the_lock_is_replayed(self):
+        first = self.post('/api/bookings/', self.payload)
+        stored = get_idempotent_response(self.customer.pk, 'clave-1')
+        cache.clear()
+        Booking.objects.all().delete()
+
+        def finish_concurrent_request(user_id, key):
+            # La otra solicitud guarda su respuesta justo antes del bloqueo
+            store_idempotent_response(user_id, key, *stored)
+            return acquire_idempotency_lock(user_id, key)
+
+        with mock.patch('bookingEngine.views.acquire_idempotency_lock', finish_concurrent_request):
+            retry = self.post('/api/bookings/', self.payload)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, first.data)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        shared = {'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://localhost:6379',
+        }}
+        with override_settings(CACHES=local):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['bookingEngine.E001'])
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class ResourceAvailabilityTests(BookingFixtures, TestCase):
+    """Slots de un recurso con horario de 9 a 12 y servicios de una hora."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.day = timezone.localdate() + timedelta(days=3)
+        self.scheduled = self.create_resource('Consultorio', availability_type='schedule')
+        Schedule.objects.create(
+            resource=self.scheduled, day_of_week=self.day.weekday(),
+            start_time=time(9), end_time=time(12)
+        )
+
+    def at(self, hour, minute=0):
+        return make_aware_datetime(self.day, time(hour, minute))
+
+    def slots(self, resource=None, now=None):
+        return resource_available_slots(resource or self.scheduled, self.day, now=now)
+
+    def hours(self, slots):
+        return [timezone.localtime(start).hour for start, end in slots]
+
+    def test_schedule_is_split_into_service_slots(self):
+        self.assertEqual(self.slots(), [
+            (self.at(9), self.at(10)), (self.at(10), self.at(11)), (self.at(11), self.at(12))
+        ])
+
+    def test_blocked_time_and_bookings_are_subtracted(self):
+        BlockedTime.objects.create(
+            resource=self.scheduled, start_datetime=self.at(10), end_datetime=self.at(11), reason=''
+        )
+        self.assertEqual(self.hours(self.slots()), [9, 11])
+        # Una reserva de media hora invalida el slot completo que la contiene
+        self.create_booking(self.at(11, 30), minutes=30, resource=self.scheduled)
+        self.assertEqual(self.hours(self.slots()), [9])
+        # Las reservas canceladas no ocupan
+        self.create_booking(self.at(9), resource=self.scheduled, status='cancelled')
+        self.assertEqual(self.hours(self.slots()), [9])
+
+    def test_capacity_keeps_slot_until_full(self):
+        self.scheduled.capacity = 2
+        self.scheduled.save()
+        self.create_booking(self.at(9), resource=self.scheduled)
+        self.assertEqual(self.hours(self.slots()), [9, 10, 11])
+        self.create_booking(self.at(9), resource=self.scheduled)
+        self.assertEqual(self.hours(self.slots()), [10, 11])
+
+    def test_started_slots_are_not_offered(self):
+        self.assertEqual(self.hours(self.slots(now=self.at(10, 30))), [11])
+        self.assertEqual(self.slots(now=self.at(12)), [])
+
+    def test_endpoint_respects_advance_booking_limit(self):
+        client = self.client_for(self.owner)
+        url = f'/api/resources/{self.scheduled.pk}/availability/'
+        response = client.get(f'{url}?date={self.day}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['available_slots']), 3)
+
+        self.settings.advance_booking_limit = 2
+        self.settings.save()
+        self.assertEqual(client.get(f'{url}?date={self.day}').status_code, 400)
+
+    def test_endpoint_rejects_malformed_date(self):
+        client = self.client_for(self.owner)
+        url = f'/api/resources/{self.scheduled.pk}/availability/'
+        self.assertEqual(client.get(f'{url}?date=bad').status_code, 400)
+        self.assertEqual(client.get(f'{url}?date=2030-02-30').status_code, 400)
+
+
+class AgentAvailabilityTests(BookingFixtures, TestCase):
+    """Slots de un recurso con agente: horario del recurso cruzado con el de cada agente."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.day = timezone.localdate() + timedelta(days=3)
+        self.agent_type = ResourceType.objects.create(
+            name='Corte', description='', company=self.company, requires_agent=True
+        )
+        self.chair = self.create_resource('Silla', self.agent_type, availability_type='schedule')
+        self.schedule(resource=self.chair, start=9, end=13)
+        self.ana = self.create_agent('ana')
+        self.luis = self.create_agent('luis')
+        self.chair.agents.add(self.ana, self.luis)
+        self.schedule(agent=self.ana, start=8, end=11)
+        self.schedule(agent=self.luis, start=10, end=14)
+
+    def schedule(self, start, end, **owner):
+        Schedule.objects.create(
+            day_of_week=self.day.weekday(), start_time=time(start), end_time=time(end), **owner
+        )
+
+    def at(self, hour):
+        return make_aware_datetime(self.day, time(hour))
+
+    def hours(self, slots):
+        return [timezone.localtime(start).hour for start, end in slots]
+
+    def test_resource_agent_slots_intersect_both_schedules(self):
+        slots = resource_agent_slots(self.chair, [self.ana, self.luis], self.day)
+        self.assertEqual(self.hours(slots[self.ana.pk]), [9, 10])
+        self.assertEqual(self.hours(slots[self.luis.pk]), [10, 11, 12])
+
+    def test_bookings_remove_the_agent_and_the_resource(self):
+        # Ana atiende en otro recurso a las 10: solo ella deja de estar libre
+        other = self.create_resource('Otra silla', self.agent_type)
+        self.create_booking(self.at(10), resource=other, agent=self.ana)
+        slots = resource_agent_slots(self.chair, [self.ana, self.luis], self.day)
+        self.assertEqual(self.hours(slots[self.ana.pk]), [9])
+        self.assertEqual(self.hours(slots[self.luis.pk]), [10, 11, 12])
+        # Una reserva del propio recurso lo ocupa para todos sus agentes
+        self.create_booking(self.at(11), resource=self.chair, agent=self.luis)
+        slots = resource_agent_slots(self.chair, [self.ana, self.luis], self.day)
+        self.assertEqual(self.hours(slots[self.luis.pk]), [10, 12])
+
+    def test_any_agent_slots_are_the_union_with_their_agents(self):
+        self.assertEqual(
+            [(timezone.localtime(slot['start']).hour, slot['agents'])
+             for slot in any_agent_slots(self.chair, self.day)],
+            [(9, [self.ana.pk]), (10, sorted([self.ana.pk, self.luis.pk])),
+             (11, [self.luis.pk]), (12, [self.luis.pk])]
+        )
+        # Los agentes inactivos no atienden
+        self.luis.is_active = False
+        self.luis.save()
+        self.assertEqual(
+            [timezone.localtime(slot['start']).hour for slot in any_agent_slots(self.chair, self.day)],
+            [9, 10]
+        )
+
+    def test_agent_free_intervals_use_only_the_agent_schedule(self):
+        BlockedTime.objects.create(
+            agent=self.ana, start_datetime=self.at(9), end_datetime=self.at(10), reason=''
+        )
+        self.assertEqual(agent_free_intervals(self.ana, self.day), [
+            (self.at(8), self.at(9)), (self.at(10), self.at(11))
+        ])
+
+    def test_endpoint(self):
+        client = self.client_for(self.owner)
+        url = f'/api/agents/{self.ana.pk}/availability/'
+        response = client.get(f'{url}?date={self.day}&resource={self.chair.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['available_slots']), 2)
+        self.assertEqual(len(client.get(f'{url}?date={self.day}').data['available_slots']), 1)
+        self.assertEqual(client.get(f'{url}?date=bad').status_code, 400)
+        self.assertEqual(client.get(f'{url}?date={self.day}&resource=abc').status_code, 400)
+
+
+class AvailabilityMatrixTests(BookingFixtures, TestCase):
+    """Matriz recurso × día calculada con una carga en bloque."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.client = self.client_for(self.owner)
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.rooms = [
+            self.create_resource(f'Aula {index}', availability_type='schedule')
+            for index in range(3)
+        ]
+        for room in self.rooms:
+            for weekday in range(7):
+                Schedule.objects.create(
+                    resource=room, day_of_week=weekday, start_time=time(9), end_time=time(12)
+                )
+        self.create_booking(make_aware_datetime(self.day, time(9)), resource=self.rooms[0])
+
+    def matrix(self, **params):
+        params.setdefault('resources', ','.join(str(room.pk) for room in self.rooms))
+        params.setdefault('date_from', self.day.isoformat())
+        params.setdefault('date_to', (self.day + timedelta(days=2)).isoformat())
+        return self.client.get('/api/resources/matrix/', params)
+
+    def test_matrix_of_resources_by_day(self):
+        response = self.matrix()
+        self.assertEqual(response.status_code, 200)
+        rows = {row['resource']: row for row in response.data['resources']}
+        self.assertEqual(set(rows), {room.pk for room in self.rooms})
+        for room in self.rooms:
+            days = rows[room.pk]['days']
+            self.assertEqual(len(days), 3)
+            expected = 2 if room == self.rooms[0] else 3
+            self.assertEqual(len(days[0]['available_slots']), expected)
+            self.assertEqual([len(day['available_slots']) for day in days[1:]], [3, 3])
+
+    def test_query_count_does_not_grow_with_resources_or_days(self):
+        # Caché de empresas y configuración
+        self.matrix()
+        # Recursos, horarios, bloqueos recurrentes, bloqueos, reservas y retenciones
+        with self.assertNumQueries(6):
+            self.matrix(resources=str(self.rooms[0].pk), date_to=self.day.isoformat())
+        with self.assertNumQueries(6):
+            self.matrix(date_to=(self.day + timedelta(days=6)).isoformat())
+
+    def test_malformed_filters(self):
+        for params in ({'company': 'abc'}, {'type': 'abc'}, {'resources': '1,x'}, {'date_from': 'bad'}):
+            self.assertEqual(self.matrix(**params).status_code, 400, params)
+        self.assertEqual(self.matrix(company=str(self.company.pk)).status_code, 200)
+
+
+class InventoryMaintenanceTests(BookingFixtures, TestCase):
+    """El inventario de slots sigue a los agentes y tipos de recurso."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.settings.advance_booking_limit = 2
+        self.settings.save()
+        self.agent_type = ResourceType.objects.create(
+            name='Corte', description='', company=self.company, requires_agent=True
+        )
+        self.agent = self.create_agent('ana')
+        for weekday in range(7):
+            Schedule.objects.create(agent=self.agent, day_of_week=weekday, start_time=time(9), end_time=time(12))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chair = self.create_resource('Silla', self.agent_type)
+            self.chair.agents.add(self.agent)
+        self.slots = AvailableSlot.objects.filter(resource=self.chair)
+
+    def change(self, func):
+        with self.captureOnCommitCallbacks(execute=True):
+            func()
+        return self.slots.count()
+
+    def test_agent_deactivation_and_reactivation(self):
+        self.assertGreater(self.slots.count(), 0)
+        agent = Agent.objects.get(pk=self.agent.pk)
+        agent.is_active = False
+        self.assertEqual(self.change(agent.save), 0)
+        agent.is_active = True
+        self.assertGreater(self.change(agent.save), 0)
+        self.assertEqual(self.slots.first().agents, [self.agent.pk])
+
+    def test_other_agent_fields_do_not_refresh(self):
+        agent = Agent.objects.get(pk=self.agent.pk)
+        agent.phone = '2'
+        with self.captureOnCommitCallbacks() as callbacks:
+            agent.save()
+        self.assertEqual(callbacks, [])
+
+    def test_agent_assignment_and_deletion(self):
+        self.assertEqual(self.change(lambda: self.chair.agents.remove(self.agent)), 0)
+        self.assertGreater(self.change(lambda: self.agent.resources.add(self.chair)), 0)
+        self.assertEqual(self.change(self.agent.delete), 0)
+
+    def test_resource_type_requires_agent(self):
+        resource_type = ResourceType.objects.get(pk=self.agent_type.pk)
+        resource_type.requires_agent = False
+        self.change(resource_type.save)
+        self.assertEqual(self.slots.first().agents, [])
+        resource_type.requires_agent = True
+        self.change(resource_type.save)
+        self.assertEqual(self.slots.first().agents, [self.agent.pk])
+
+
+class RecurringAdmissionTests(BookingFixtures, TestCase):
+    """Series de reservas validadas en conjunto e insertadas en bloque."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.settings.advance_booking_limit = 365
+        self.settings.save()
+        self.client = self.client_for(self.customer)
+
+    def recurring(self, **data):
+        data.setdefault('resource', self.resource.pk)
+        return self.client.post('/api/bookings/recurring/', data, format='json')
+
+    def series(self, count, **data):
+        return self.recurring(
+            start_datetime=self.start, end_datetime=self.start + timedelta(hours=1),
+            frequency='daily', count=count, **data
+        )
+
+    def test_conflicting_occurrence_is_rejected_alone(self):
+        self.create_booking(self.start + timedelta(days=1, minutes=30))
+        response = self.series(3)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['accepted'], response.data['rejected']), (2, 1))
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['accepted', 'rejected', 'accepted']
+        )
+        self.assertEqual(response.data['results'][1]['error'], "El recurso no está disponible en este horario")
+        self.assertEqual(Booking.objects.filter(user=self.customer).count(), 3)
+
+    def test_all_rejected_returns_400(self):
+        self.create_booking()
+        response = self.series(1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['accepted'], 0)
+
+    def test_occurrence_cap(self):
+        self.assertEqual(self.series(101).status_code, 400)
+        # Una regla con `until` que pasaría del límite también se rechaza
+        until = timezone.localtime(self.start).date() + timedelta(days=150)
+        response = self.recurring(
+            start_datetime=self.start, end_datetime=self.start + timedelta(hours=1),
+            frequency='daily', until=until.isoformat()
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Booking.objects.filter(user=self.customer).exists())
+        self.assertEqual(self.series(100).data['accepted'], 100)
+
+    def test_explicit_occurrences(self):
+        occurrences = [
+            {'start_datetime': self.start + timedelta(hours=hours),
+             'end_datetime': self.start + timedelta(hours=hours + 1)}
+            for hours in (0, 5, 24)
+        ]
+        # La segunda se solapa con la primera de la misma solicitud
+        occurrences.append({
+            'start_datetime': self.start + timedelta(minutes=30),
+            'end_datetime': self.start + timedelta(minutes=90)
+        })
+        response = self.recurring(occurrences=occurrences)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['accepted', 'accepted', 'accepted', 'rejected']
+        )
+        self.assertEqual(
+            response.data['results'][3]['error'], "Se solapa con otra ocurrencia de la misma solicitud"
+        )
+        self.assertEqual(self.recurring(occurrences=[{'start_datetime': self.start}]).status_code, 400)
+
+    def test_series_is_inserted_with_one_bulk_insert(self):
+        self.series(1)
+        Booking.objects.all().delete()
+        for count in (5, 50):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.series(count, notes=f'serie {count}')
+            self.assertEqual(response.data['accepted'], count)
+            inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT INTO "bookingEngine_booking"')]
+            self.assertEqual(len(inserts), 1)
+            if count == 5:
+                baseline = len(queries)
+            else:
+                self.assertEqual(len(queries), baseline)
+            Booking.objects.all().delete()
+
+
+class AgentAssignmentTests(BookingFixtures, TestCase):
+    """Elección del agente libre con menos carga para una reserva sin agente."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.day = timezone.localdate() + timedelta(days=3)
+        agent_type = ResourceType.objects.create(
+            name='Corte', description='', company=self.company, requires_agent=True
+        )
+        self.chair = self.create_resource('Silla', agent_type)
+        self.other = self.create_resource('Otra silla', agent_type)
+        self.ana = self.create_agent('ana')
+        self.luis = self.create_agent('luis')
+        self.chair.agents.add(self.ana, self.luis)
+        for agent in (self.ana, self.luis):
+            Schedule.objects.create(
+                agent=agent, day_of_week=self.day.weekday(), start_time=time(8), end_time=time(18)
+            )
+
+    def at(self, hour):
+        return make_aware_datetime(self.day, time(hour))
+
+    def assign(self, hour, user=None):
+        return assign_agent(self.chair, self.at(hour), self.at(hour + 1), user=user)
+
+    def test_picks_the_free_agent_with_least_load(self):
+        self.assertEqual(self.assign(10), self.ana)
+        # Ana atiende otra reserva ese día: Luis tiene menos carga
+        self.create_booking(self.at(14), resource=self.other, agent=self.ana)
+        self.assertEqual(self.assign(10), self.luis)
+        # Luis ocupado a las 10 por dos reservas: Ana es la única libre
+        self.create_booking(self.at(10), resource=self.other, agent=self.luis)
+        self.create_booking(self.at(12), resource=self.other, agent=self.luis)
+        self.assertEqual(self.assign(10), self.ana)
+        # Ana bloqueada y Luis ocupado: nadie está libre
+        BlockedTime.objects.create(
+            agent=self.ana, start_datetime=self.at(10), end_datetime=self.at(11), reason=''
+        )
+        self.assertIsNone(self.assign(10))
+
+    def test_holds_of_other_users_exclude_the_agent(self):
+        SlotHold.objects.create(
+            resource=self.other, agent=self.ana, user=self.owner,
+            start_datetime=self.at(10), end_datetime=self.at(11),
+            expires_at=timezone.now() + timedelta(minutes=10)
+        )
+        self.assertEqual(self.assign(10), self.luis)
+        self.assertEqual(self.assign(10, user=self.owner), self.ana)
+
+    def test_query_count_does_not_grow_with_history(self):
+        for days in range(1, 40):
+            start = self.at(9) - timedelta(days=days)
+            self.create_booking(start, resource=self.other, agent=self.ana)
+            self.create_booking(start, resource=self.other, agent=self.luis)
+            BlockedTime.objects.create(
+                agent=self.luis, start_datetime=start, end_datetime=start + timedelta(hours=1), reason=''
+            )
+        self.create_booking(self.at(9), resource=self.other, agent=self.ana)
+        with self.assertNumQueries(3):
+            self.assertEqual(self.assign(14), self.luis)
+
+
+class SlotHoldTests(BookingFixtures, TestCase):
+    """Retenciones temporales: vencimiento, efecto sobre otros usuarios y consumo al reservar."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.client = self.client_for(self.customer)
+        self.end = self.start + timedelta(hours=1)
+
+    def hold(self, client=None, start=None):
+        start = start or self.start
+        return (client or self.client).post('/api/bookings/hold/', {
+            'resource': self.resource.pk,
+            'start_datetime': start.isoformat(),
+            'end_datetime': (start + timedelta(hours=1)).isoformat(),
+        }, format='json')
+
+    def book(self, client, user):
+        return client.post('/api/bookings/', {
+            'resource': self.resource.pk, 'user': user.pk,
+            'start_datetime': self.start.isoformat(), 'end_datetime': self.end.isoformat(),
+        }, format='json')
+
+    def slot_starts(self):
+        day = timezone.localtime(self.start).date()
+        return [start for start, end in resource_available_slots(self.resource, day)]
+
+    def test_hold_expires_after_its_ttl(self):
+        before = timezone.now()
+        response = self.hold()
+        self.assertEqual(response.status_code, 201)
+        hold = SlotHold.objects.get(user=self.customer)
+        self.assertGreaterEqual(hold.expires_at, before + timedelta(minutes=HOLD_MINUTES))
+        self.assertLessEqual(hold.expires_at, timezone.now() + timedelta(minutes=HOLD_MINUTES))
+        owner_client = self.client_for(self.owner)
+        self.assertEqual(self.hold(owner_client).status_code, 409)
+        # Vencida, deja de contar y se limpia al crear otra
+        hold.expires_at = timezone.now() - timedelta(seconds=1)
+        hold.save()
+        self.assertIn(self.start, self.slot_starts())
+        self.assertEqual(self.hold(owner_client).status_code, 201)
+        self.assertEqual(list(SlotHold.objects.values_list('user', flat=True)), [self.owner.pk])
+
+    def test_hold_blocks_other_users(self):
+        self.assertIn(self.start, self.slot_starts())
+        self.assertEqual(self.hold().status_code, 201)
+        self.assertNotIn(self.start, self.slot_starts())
+        response = self.book(self.client_for(self.owner), self.owner)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(HELD_MESSAGE, str(response.data))
+        self.assertFalse(Booking.objects.exists())
+
+    def test_booking_consumes_the_users_hold(self):
+        self.assertEqual(self.hold().status_code, 201)
+        self.assertEqual(self.book(self.client, self.customer).status_code, 201)
+        self.assertFalse(SlotHold.objects.exists())
+
+    def test_series_releases_only_admitted_intervals(self):
+        # La segunda ocurrencia choca con otra reserva y no se admite
+        second = self.start + timedelta(days=1)
+        self.create_booking(second, user=self.owner)
+        for start in (self.start, second):
+            SlotHold.objects.create(
+                resource=self.resource, user=self.customer, start_datetime=start,
+                end_datetime=start + timedelta(hours=1),
+                expires_at=timezone.now() + timedelta(minutes=HOLD_MINUTES)
+            )
+        self.settings.advance_booking_limit = 365
+        self.settings.save()
+        response = self.client.post('/api/bookings/recurring/', {
+            'resource': self.resource.pk, 'start_datetime': self.start,
+            'end_datetime': self.end, 'frequency': 'daily', 'count': 3,
+        }, format='json')
+        self.assertEqual((response.data['accepted'], response.data['rejected']), (2, 1))
+        self.assertEqual(
+            list(SlotHold.objects.values_list('start_datetime', flat=True)), [second]
+        )
+
+
+class RecurringBlockTests(BookingFixtures, TestCase):
+    """Reglas de bloqueo recurrente expandidas solo para la ventana consultada."""
+
+    def setUp(self):
+        self.create_fixtures()
+        # Un lunes lejano para que ningún día de la ventana quede en el pasado
+        today = timezone.localdate()
+        self.monday = today + timedelta(days=7 - today.weekday())
+
+    def rule(self, **fields):
+        fields.setdefault('resource', self.resource)
+        fields.setdefault('start_date', self.monday)
+        fields.setdefault('reason', 'Cerrado')
+        return RecurringBlock.objects.create(**fields)
+
+    def at(self, day, hour):
+        return make_aware_datetime(day, time(hour))
+
+    def expand(self, days, field='resource', owner=None):
+        owner = owner or self.resource
+        start = make_aware_datetime(self.monday, time(0))
+        intervals = recurring_block_intervals(field, [owner.pk], start, start + timedelta(days=days))
+        return sorted(intervals[owner.pk])
+
+    def test_weekly_rule_with_exceptions_and_end(self):
+        wednesday = self.monday + timedelta(days=2)
+        self.rule(
+            frequency='weekly', days_of_week=[0, 2], start_time=time(13), end_time=time(14),
+            excluded_dates=[wednesday.isoformat()], end_date=self.monday + timedelta(days=13)
+        )
+        days = [self.monday, self.monday + timedelta(days=7), self.monday + timedelta(days=9)]
+        self.assertEqual(self.expand(21), [(self.at(day, 13), self.at(day, 14)) for day in days])
+
+    def test_daily_full_day_and_yearly_rules(self):
+        self.rule(
+            frequency='daily', start_date=self.monday + timedelta(days=1),
+            end_date=self.monday + timedelta(days=2)
+        )
+        holiday = self.monday + timedelta(days=5)
+        self.rule(frequency='yearly', start_date=holiday.replace(year=holiday.year - 1))
+        self.assertEqual(self.expand(7), [
+            day_bounds(self.monday + timedelta(days=1)),
+            day_bounds(self.monday + timedelta(days=2)),
+            day_bounds(holiday),
+        ])
+
+    def test_rules_of_agents_are_expanded_per_agent(self):
+        ana = self.create_agent('ana')
+        self.rule(resource=None, agent=ana, frequency='daily', start_time=time(9), end_time=time(10))
+        self.assertEqual(self.expand(2), [])
+        self.assertEqual(self.expand(2, 'agent', ana), [
+            (self.at(self.monday, 9), self.at(self.monday, 10)),
+            (self.at(self.monday + timedelta(days=1), 9), self.at(self.monday + timedelta(days=1), 10)),
+        ])
+
+    def test_expansion_takes_one_query_and_stores_no_rows(self):
+        self.rule(frequency='weekly', days_of_week=[6])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.expand(7)), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.expand(365)), 52)
+        self.assertFalse(BlockedTime.objects.exists())
+
+    def test_rules_block_admission_and_availability(self):
+        self.rule(frequency='daily', start_time=time(13), end_time=time(14))
+        day = self.monday + timedelta(days=1)
+        self.assertEqual(
+            find_conflict(self.resource, None, self.at(day, 13), self.at(day, 14)),
+            "El recurso está bloqueado en este horario"
+        )
+        self.assertIsNone(find_conflict(self.resource, None, self.at(day, 14), self.at(day, 15)))
+        starts = [start for start, end in resource_available_slots(self.resource, day)]
+        self.assertNotIn(self.at(day, 13), starts)
+        self.assertIn(self.at(day, 14), starts)
+
+
+class SettingsCacheTests(BookingFixtures, TestCase):
+    """Configuración por empresa servida desde la caché e invalidada por señales."""
+
+    def setUp(self):
+        self.create_fixtures()
+        invalidate_booking_settings(self.company.pk)
+
+    def test_warm_cache_does_no_queries(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_booking_settings(self.company.pk), self.settings)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_booking_settings(self.company.pk), self.settings)
+        # Sin la copia local se recupera de la caché compartida
+        invalidate_booking_settings(self.company.pk)
+        get_booking_settings(self.company.pk)
+        cache.clear()
+        with self.assertNumQueries(0):
+            get_booking_settings(self.company.pk)
+
+    def test_save_and_delete_invalidate(self):
+        get_booking_settings(self.company.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.settings.advance_booking_limit = 7
+            self.settings.save()
+        self.assertEqual(get_booking_settings(self.company.pk).advance_booking_limit, 7)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.settings.delete()
+        self.assertIsNone(get_booking_settings(self.company.pk))
+        # La ausencia también queda en la caché
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_booking_settings(self.company.pk))
+
+    def test_booking_hot_path_skips_settings_queries(self):
+        client = self.client_for(self.customer)
+        payload = {
+            'resource': self.resource.pk, 'user': self.customer.pk,
+            'start_datetime': self.start.isoformat(),
+            'end_datetime': (self.start + timedelta(hours=1)).isoformat(),
+        }
+        self.assertEqual(client.post('/api/bookings/', payload, format='json').status_code, 201)
+        later = self.start + timedelta(hours=2)
+        payload.update(start_datetime=later.isoformat(), end_datetime=(later + timedelta(hours=1)).isoformat())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.post('/api/bookings/', payload, format='json').status_code, 201)
+            self.assertEqual(self.client_for(self.owner).get(
+                f'/api/resources/{self.resource.pk}/availability/?date={later.date()}'
+            ).status_code, 200)
+        self.assertFalse([
+            query['sql'] for query in queries if 'bookingEngine_bookingsettings' in query['sql']
+        ])
+
+
+class OwnershipPermissionTests(BookingFixtures, TestCase):
+    """Permisos de dueño resueltos con los ids de empresa en caché."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.rival = User.objects.create_user('rival', 'rival@example.com')
+        self.rival_company = Company.objects.create(user=self.rival, name='Otra', description='')
+        self.rival_resource = Resource.objects.create(
+            type=ResourceType.objects.create(name='Otro', description='', company=self.rival_company),
+            company=self.rival_company, name='Ajeno', description='', duration=60
+        )
+
+    def fresh_client(self, user):
+        # Cada petición real carga un usuario nuevo, sin ids de empresa guardados
+        return self.client_for(User.objects.get(pk=user.pk))
+
+    def test_owners_only_see_their_companies(self):
+        client = self.fresh_client(self.owner)
+        self.assertEqual(client.get(f'/api/resources/{self.resource.pk}/').status_code, 200)
+        self.assertEqual(client.get(f'/api/resources/{self.rival_resource.pk}/').status_code, 404)
+        self.assertEqual(
+            [resource['id'] for resource in client.get('/api/resources/').data], [self.resource.pk]
+        )
+        self.assertEqual(self.fresh_client(self.customer).get('/api/resources/').status_code, 403)
+        staff = User.objects.create_user('staff', 'staff@example.com', is_staff=True)
+        self.assertEqual(len(self.fresh_client(staff).get('/api/resources/').data), 2)
+
+    def test_object_checks_are_set_lookups(self):
+        permission = IsCompanyOwnerOrAdmin()
+        request = SimpleNamespace(user=self.owner)
+        agent = self.create_agent('ana')
+        block = BlockedTime.objects.create(
+            agent=agent, start_datetime=self.start, end_datetime=self.start + timedelta(hours=1), reason=''
+        )
+        block = BlockedTime.objects.select_related('resource', 'agent').get(pk=block.pk)
+        rival_booking = Booking.objects.select_related('resource', 'agent').get(
+            pk=self.create_booking(resource=self.rival_resource).pk
+        )
+        self.assertTrue(permission.has_permission(request, None))
+        with self.assertNumQueries(0):
+            self.assertTrue(permission.has_object_permission(request, None, self.resource))
+            self.assertTrue(permission.has_object_permission(request, None, block))
+            self.assertFalse(permission.has_object_permission(request, None, self.rival_resource))
+            self.assertFalse(permission.has_object_permission(request, None, rival_booking))
+
+    def test_company_changes_invalidate_ownership(self):
+        client = self.fresh_client(self.customer)
+        self.assertEqual(client.get('/api/resources/').status_code, 403)
+        with self.captureOnCommitCallbacks(execute=True):
+            company = Company.objects.create(user=self.customer, name='Nueva', description='')
+        self.assertEqual(self.fresh_client(self.customer).get('/api/resources/').status_code, 200)
+        # La empresa pasa a otro dueño: el anterior pierde el acceso
+        with self.captureOnCommitCallbacks(execute=True):
+            company.user = self.rival
+            company.save()
+        self.assertEqual(self.fresh_client(self.customer).get('/api/resources/').status_code, 403)
+        self.assertEqual(
+            get_owned_company_ids(User.objects.get(pk=self.rival.pk)), {self.rival_company.pk, company.pk}
+        )
+
+
+class CompletePastBookingsTests(BookingFixtures, TestCase):
+    """Transición por lotes de las reservas confirmadas ya terminadas."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.past = (timezone.now() - timedelta(days=3)).replace(minute=0, second=0, microsecond=0)
+        self.ended = [self.create_booking(self.past + timedelta(hours=index)) for index in range(7)]
+        self.pending = self.create_booking(self.past - timedelta(hours=2), status='pending')
+        self.upcoming = self.create_booking()
+
+    def statuses(self):
+        return dict(Booking.objects.values_list('pk', 'status'))
+
+    def test_ended_confirmed_bookings_are_completed(self):
+        self.assertEqual(complete_past_bookings(batch_size=3), 7)
+        statuses = self.statuses()
+        self.assertEqual({statuses[booking.pk] for booking in self.ended}, {'completed'})
+        self.assertEqual(statuses[self.pending.pk], 'pending')
+        self.assertEqual(statuses[self.upcoming.pk], 'confirmed')
+        self.assertEqual(complete_past_bookings(), 0)
+
+    def test_batches_go_oldest_first_and_report_the_lag(self):
+        self.assertEqual(complete_past_bookings(batch_size=2, max_batches=2), 4)
+        statuses = self.statuses()
+        self.assertEqual(
+            [statuses[booking.pk] for booking in self.ended], ['completed'] * 4 + ['confirmed'] * 3
+        )
+        now = timezone.now()
+        lag = completion_lag(now=now)
+        self.assertEqual(lag['pending'], 3)
+        self.assertEqual(lag['oldest'], self.ended[4].end_datetime)
+        self.assertEqual(lag['delay'], now - self.ended[4].end_datetime)
+
+    def test_batches_use_a_fixed_number_of_queries(self):
+        # Por lote: elegir los ids y actualizarlos
+        with CaptureQueriesContext(connection) as queries:
+            complete_past_bookings(batch_size=2, max_batches=3)
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 6)
+
+    def test_command_reports_the_lag(self):
+        out = StringIO()
+        call_command('complete_past_bookings', '--report', stdout=out)
+        self.assertIn('Pendientes: 7 reservas', out.getvalue())
+        self.assertEqual(self.statuses()[self.ended[0].pk], 'confirmed')
+        out = StringIO()
+        call_command('complete_past_bookings', '--batch-size', '5', stdout=out)
+        self.assertIn('7 reservas marcadas como completadas', out.getvalue())
+        self.assertIn('Sin reservas pendientes', out.getvalue())
+
+
+class ArchiveBookingsTests(BookingFixtures, TestCase):
+    """Archivo por lotes de las reservas antiguas y su API de consulta."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.settings.google_calendar_enabled = True
+        self.settings.google_calendar_credentials = {'access_token': 'token', 'calendar_id': 'agenda'}
+        self.settings.save()
+        self.old = (timezone.now() - timedelta(days=60)).replace(minute=0, second=0, microsecond=0)
+        self.rival = User.objects.create_user('rival', 'rival@example.com')
+        self.archived = [
+            self.create_booking(self.old + timedelta(hours=index), status=status, user=user)
+            for index, (status, user) in enumerate([
+                ('confirmed', self.customer), ('completed', self.customer),
+                ('cancelled', self.rival), ('completed', self.rival), ('pending', self.customer),
+            ])
+        ]
+        self.recent = self.create_booking(timezone.now() - timedelta(days=5))
+        CalendarSyncEvent.objects.all().delete()
+
+    def archive(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return archive_bookings(days=30, **kwargs)
+
+    def test_old_bookings_move_to_the_archive(self):
+        self.assertEqual(self.archive(batch_size=2), 5)
+        self.assertEqual(list(Booking.objects.values_list('pk', flat=True)), [self.recent.pk])
+        archived = ArchivedBooking.objects.get(original_id=self.archived[1].pk)
+        self.assertEqual(
+            (archived.company_id, archived.user_id, archived.resource_id, archived.status,
+             archived.start_datetime, archived.created_at),
+            (self.company.pk, self.customer.pk, self.resource.pk, 'completed',
+             self.archived[1].start_datetime, self.archived[1].created_at)
+        )
+        self.assertEqual(self.archive(), 0)
+
+    def test_max_batches_bounds_each_run(self):
+        # Los lotes se eligen por estado: uno por cada estado con una sola reserva
+        self.assertEqual(self.archive(batch_size=2, max_batches=3), 3)
+        self.assertEqual(
+            set(Booking.objects.values_list('status', flat=True)), {'completed', 'confirmed'}
+        )
+        self.assertEqual(self.archive(batch_size=2), 2)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_archiving_mutes_the_deletion_signals(self):
+        rollups = dict(UtilizationRollup.objects.values_list('resource_id', 'booked_minutes'))
+        self.archive()
+        # La ocupación histórica se conserva y el calendario externo no borra nada
+        self.assertEqual(
+            dict(UtilizationRollup.objects.values_list('resource_id', 'booked_minutes')), rollups
+        )
+        self.assertFalse(CalendarSyncEvent.objects.exists())
+        # Un borrado normal sí avisa al calendario
+        self.recent.delete()
+        self.assertEqual(CalendarSyncEvent.objects.get().event, 'deleted')
+
+    def test_archived_bookings_api(self):
+        self.archive()
+        owner = self.client_for(self.owner)
+        response = owner.get('/api/archived-bookings/?page_size=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        pages = response.data['results']
+        while response.data['next']:
+            response = owner.get(response.data['next'])
+            pages += response.data['results']
+        self.assertEqual(
+            [row['original_id'] for row in pages], [booking.pk for booking in reversed(self.archived)]
+        )
+        completed = owner.get('/api/archived-bookings/?status=completed').data['results']
+        self.assertEqual(len(completed), 2)
+        self.assertEqual(
+            len(owner.get(f'/api/archived-bookings/?customer={self.rival.pk}').data['results']), 2
+        )
+        # Los clientes solo ven sus reservas archivadas
+        own = self.client_for(self.customer).get('/api/archived-bookings/').data['results']
+        self.assertEqual({row['user'] for row in own}, {self.customer.pk})
+        self.assertEqual(len(own), 3)
+        rival_row = ArchivedBooking.objects.filter(user=self.rival).first()
+        self.assertEqual(
+            self.client_for(self.customer).get(f'/api/archived-bookings/{rival_row.pk}/').status_code, 404
+        )
+        self.assertEqual(owner.post('/api/archived-bookings/', {}).status_code, 405)
+
+
+class OutboxTests(BookingFixtures, TestCase):
+    """Toma de lotes y reintentos compartidos por las colas de salida."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.booking = self.create_booking()
+        self.events = [
+            CalendarSyncEvent.objects.create(
+                company=self.company, booking_id=self.booking.pk, event='updated'
+            )
+            for index in range(3)
+        ]
+
+    def test_claimed_rows_are_not_taken_again_until_the_claim_expires(self):
+        now = timezone.now()
+        first = claim_batch(CalendarSyncEvent.objects.all(), 2, now)
+        self.assertEqual([event.pk for event in first], [event.pk for event in self.events[:2]])
+        second = claim_batch(CalendarSyncEvent.objects.all(), 2, now)
+        self.assertEqual([event.pk for event in second], [self.events[2].pk])
+        self.assertEqual(claim_batch(CalendarSyncEvent.objects.all(), 2, now), [])
+        later = now + timedelta(minutes=CLAIM_MINUTES, seconds=1)
+        self.assertEqual(len(claim_batch(CalendarSyncEvent.objects.all(), 5, later)), 3)
+
+    def test_retries_back_off_until_the_rows_fail(self):
+        now = timezone.now()
+        delays = []
+        for attempt in range(3):
+            retry_later(self.events[:1], 'HTTP 500', now, max_attempts=3, base_minutes=2)
+            delays.append(self.events[0].next_attempt_at - now)
+        self.assertEqual(delays[:2], [timedelta(minutes=2), timedelta(minutes=4)])
+        self.assertEqual((self.events[0].status, self.events[0].attempts), ('failed', 3))
+        mark_sent(self.events[1:2], now)
+        mark_failed(self.events[2:], 'Sin destinatario')
+        save_batch(self.events)
+        self.assertEqual(
+            list(CalendarSyncEvent.objects.order_by('pk').values_list('status', 'attempts', 'last_error')),
+            [('failed', 3, 'HTTP 500'), ('sent', 1, ''), ('failed', 0, 'Sin destinatario')]
+        )
+
+
+class CalendarFeedTests(BookingFixtures, TestCase):
+    """Calendarios iCalendar con token firmado y GET condicional."""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.settings.google_calendar_enabled = True
+        self.settings.save()
+        self.ana = self.create_agent('ana')
+        self.booking = self.create_booking(agent=self.ana, notes='Traer documentos, por favor; gracias')
+        self.other = self.create_booking(self.start + timedelta(hours=2))
+
+    def url(self, kind='company', pk=None):
+        return reverse('booking-calendar-feed', args=[feed_token(kind, pk or self.company.pk)])
+
+    def body(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_feed_lists_the_owner_bookings(self):
+        response = self.client.get(self.url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        body = self.body(response)
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertTrue(body.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+        self.assertIn('DESCRIPTION:Traer documentos\\, por favor\\; gracias', body)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in body.split('\r\n')))
+        agent_body = self.body(self.client.get(self.url('agent', self.ana.pk)))
+        self.assertEqual(agent_body.count('BEGIN:VEVENT'), 1)
+        self.assertIn(f'UID:booking-{self.booking.pk}@', agent_body)
+
+    def test_unchanged_feed_answers_304(self):
+        first = self.client.get(self.url())
+        etag, last_modified = first['ETag'], first['Last-Modified']
+        # Empresa, configuración en caché y versión: sin recorrer las reservas
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(self.url(), HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        # Modificar o borrar una reserva cambia la versión
+        self.other.notes = 'Cambio'
+        self.other.save()
+        changed = self.client.get(self.url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+        etag = changed['ETag']
+        self.other.delete()
+        self.assertEqual(self.client.get(self.url(), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_bad_tokens_and_disabled_feeds_are_404(self):
+        token = feed_token('company', self.company.pk)
+        for bad in (token[:-1] + ('x' if token[-1] != 'x' else 'y'), 'company-1', feed_token('user', 1)):
+            url = reverse('booking-calendar-feed', args=[bad])
+            self.assertEqual(self.client.get(url).status_code, 404, bad)
+        self.assertEqual(self.client.get(self.url(pk=self.company.pk + 100)).status_code, 404)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.settings.google_calendar_enabled = False
+            self.settings.save()
+        self.assertEqual(self.client.get(self.url()).status_code, 404)
+
+    def test_owner_gets_the_feed_urls(self):
+        owner = self.client_for(self.owner)
+        response = owner.get(f'/api/settings/{self.settings.pk}/calendar_feeds/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['company'].endswith(self.url()))
+        self.assertEqual(
+            [agent['url'].endswith(self.url('agent', self.ana.pk)) for agent in response.data['agents']], [True]
+        )
+
+
+class DashboardTests(BookingFixtures, TestCase):
+    """Tablero del dueño: agregados, caché e invalidación."""
+
+    def setUp(self):
+        self.create_fixtures()
+        # Un miércoles a partir del día 10: la semana y el mes no se cruzan
+        day = timezone.localdate() + timedelta(days=7)
+        while day.weekday() != 2 or day.day < 10:
+            day += timedelta(days=1)
+        self.day = day
+        self.now = make_aware_datetime(day, time(12))
+        self.hall = self.create_resource('Sala 2')
+
+    def at(self, days, hour):
+        return make_aware_datetime(self.day + timedelta(days=days), time(hour))
+
+    def order(self, created_at, total):
+        order = Order.objects.create(user=self.customer, company=self.company, total=Decimal(total))
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+
+    def test_aggregates(self):
+        self.create_booking(self.at(0, 9))
+        self.create_booking(self.at(0, 14), status='pending')
+        cancelled = self.create_booking(self.at(0, 15), status='cancelled')
+        Booking.objects.filter(pk=cancelled.pk).update(updated_at=self.now - timedelta(hours=1))
+        old = self.create_booking(self.at(-1, 15), status='cancelled')
+        Booking.objects.filter(pk=old.pk).update(updated_at=self.at(-3, 9))
+        self.create_booking(self.at(-1, 9), status='pending')
+        self.create_booking(self.at(1, 9), resource=self.hall)
+        self.create_booking(self.at(2, 9), status='pending')
+        self.order(self.at(0, 10), '10.00')
+        self.order(self.at(-2, 10), '5.50')
+        self.order(make_aware_datetime(self.day.replace(day=2), time(10)), '2.25')
+        self.order(make_aware_datetime(self.day.replace(day=1) - timedelta(days=1), time(10)), '100')
+
+        with self.assertNumQueries(4):
+            dashboard = build_dashboard(self.company.pk, now=self.now)
+        self.assertEqual(dashboard['today']['total'], 3)
+        self.assertEqual(dashboard['today']['by_status'], {'confirmed': 1, 'pending': 1, 'cancelled': 1})
+        self.assertEqual(
+            [booking['start_datetime'] for booking in dashboard['today']['bookings']],
+            [self.at(0, 9), self.at(0, 14), self.at(0, 15)]
+        )
+        self.assertEqual(dashboard['pending_confirmations'], 2)
+        self.assertEqual(dashboard['cancellations_this_week'], 1)
+        self.assertEqual(
+            [(row['resource_name'], row['upcoming']) for row in dashboard['upcoming_by_resource']],
+            [('Sala', 2), ('Sala 2', 1)]
+        )
+        self.assertEqual(
+            dashboard['revenue'],
+            {'today': '10.00', 'week': '15.50', 'month': '17.75', 'orders_today': 1}
+        )
+
+    def test_cached_and_invalidated_on_writes(self):
+        client = self.client_for(self.owner)
+        first = client.get('/api/dashboard/')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data['pending_confirmations'], 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get('/api/dashboard/').data, first.data)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_booking(status='pending')
+        self.assertEqual(client.get('/api/dashboard/').data['pending_confirmations'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(user=self.customer, company=self.company, total=Decimal('8'))
+        self.assertEqual(client.get('/api/dashboard/').data['revenue']['today'], '8.00')
+
+    def test_company_parameter(self):
+        client = self.client_for(self.owner)
+        self.assertEqual(client.get(f'/api/dashboard/?company={self.company.pk}').status_code, 200)
+        self.assertEqual(client.get('/api/dashboard/?company=abc').status_code, 400)
+        rival = Company.objects.create(
+            user=User.objects.create_user('rival', 'rival@example.com'), name='Otra', description=''
+        )
+        self.assertEqual(client.get(f'/api/dashboard/?company={rival.pk}').status_code, 403)
+        self.assertEqual(self.client_for(self.customer).get('/api/dashboard/').status_code, 403)
+        # Con dos empresas hay que elegir una
+        Company.objects.create(user=self.owner, name='Segunda', description='')
+        client = self.client_for(User.objects.get(pk=self.owner.pk))
+        self.assertEqual(client.get('/api/dashboard/').status_code, 400)
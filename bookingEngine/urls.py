@@ -3,7 +3,9 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     BookingSettingsViewSet, ResourceTypeViewSet,
     AgentViewSet, ResourceViewSet, BookingViewSet,
-    BlockedTimeViewSet
+    BlockedTimeViewSet, RecurringBlockViewSet, AvailableSlotViewSet,
+    UtilizationViewSet, ArchivedBookingViewSet, WaitlistEntryViewSet, DashboardViewSet,
+    calendar_feed
 )
 
 router = DefaultRouter()
@@ -13,7 +15,14 @@ router.register(r'agents', AgentViewSet)
 router.register(r'resources', ResourceViewSet)
 router.register(r'bookings', BookingViewSet)
 router.register(r'blocked-times', BlockedTimeViewSet)
+router.register(r'recurring-blocks', RecurringBlockViewSet)
+router.register(r'slots', AvailableSlotViewSet)
+router.register(r'utilization', UtilizationViewSet, basename='utilization')
+router.register(r'archived-bookings', ArchivedBookingViewSet)
+router.register(r'waitlist', WaitlistEntryViewSet)
+router.register(r'dashboard', DashboardViewSet, basename='dashboard')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('calendar/<str:token>.ics', calendar_feed, name='booking-calendar-feed'),
 ]
\ No newline at end of file
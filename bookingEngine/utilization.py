@@ -0,0 +1,245 @@
+"""
+Resúmenes diarios de ocupación (`UtilizationRollup`).
+
+Cada reserva confirmada o completada suma sus minutos al día de su recurso y
+de su agente. Los cambios de estado, horario o recurso aplican solo la
+diferencia con los valores cargados de la base (`_loaded_values`), así que
+mantener los resúmenes no requiere recorrer el historial. El comando
+`rebuild_utilization` los recalcula para un rango de fechas y, ejecutado a
+diario, crea también los días con horario que no tuvieron reservas.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .availability import date_range, day_bounds, weekly_windows
+from .models import Agent, Booking, Resource, UtilizationRollup
+
+# Estados de reserva que cuentan como tiempo ocupado
+ROLLUP_STATUSES = ('confirmed', 'completed')
+
+# Reservas leídas por lote al reconstruir los resúmenes
+REBUILD_BATCH_SIZE = 2000
+
+
+def _minutes_by_day(start_datetime, end_datetime):
+    """Minutos de [start_datetime, end_datetime) repartidos por día local."""
+    minutes = {}
+    first_day = timezone.localtime(start_datetime).date()
+    last_day = timezone.localtime(end_datetime - timedelta(microseconds=1)).date()
+    for day in date_range(first_day, last_day):
+        day_start, day_end = day_bounds(day)
+        overlap = min(end_datetime, day_end) - max(start_datetime, day_start)
+        minutes[day] = int(overlap.total_seconds() // 60)
+    return minutes
+
+
+def booking_minutes(resource_id, agent_id, status, start_datetime, end_datetime):
+    """Aporte de una reserva: {(campo, id, día): minutos}."""
+    contributions = Counter()
+    if status not in ROLLUP_STATUSES or not start_datetime or not end_datetime:
+        return contributions
+    for day, minutes in _minutes_by_day(start_datetime, end_datetime).items():
+        if resource_id:
+            contributions[('resource', resource_id, day)] += minutes
+        if agent_id:
+            contributions[('agent', agent_id, day)] += minutes
+    return contributions
+
+
+def _booking_values(booking, loaded=False):
+    if loaded:
+        values = getattr(booking, '_loaded_values', None)
+        if values is None:
+            return None
+        # Los campos diferidos no se cargaron: se asume que no cambiaron
+        return tuple(
+            values.get(name, getattr(booking, name))
+            for name in ('resource_id', 'agent_id', 'status', 'start_datetime', 'end_datetime')
+        )
+    return (
+        booking.resource_id, booking.agent_id, booking.status,
+        booking.start_datetime, booking.end_datetime
+    )
+
+
+def _window_minutes(windows):
+    return sum(
+        (end.hour * 60 + end.minute) - (start.hour * 60 + start.minute)
+        for start, end in windows
+    )
+
+
+def scheduled_minutes(field, owner_id, days):
+    """Minutos de horario del recurso o agente en cada uno de los días."""
+    if field == 'resource' and Resource.objects.filter(
+            pk=owner_id, availability_type='always').exists():
+        return {day: 24 * 60 for day in days}
+    weekly = weekly_windows(field, [owner_id]).get(owner_id, {})
+    return {day: _window_minutes(weekly.get(day.weekday(), [])) for day in days}
+
+
+def _owner_company(field, owner_id):
+    model = Resource if field == 'resource' else Agent
+    return model.objects.filter(pk=owner_id).values_list('company_id', flat=True).first()
+
+
+def _apply_day(field, owner_id, day, minutes):
+    rollups = UtilizationRollup.objects.filter(**{field: owner_id}, date=day)
+    if rollups.update(booked_minutes=Greatest(F('booked_minutes') + minutes, 0)) or minutes < 0:
+        return
+    company_id = _owner_company(field, owner_id)
+    if company_id is None:
+        return
+    try:
+        with transaction.atomic():
+            UtilizationRollup.objects.create(
+                company_id=company_id,
+                date=day,
+                booked_minutes=minutes,
+                scheduled_minutes=scheduled_minutes(field, owner_id, [day])[day],
+                **{f'{field}_id': owner_id}
+            )
+    except IntegrityError:
+        # Otra transacción creó el resumen entre la actualización y el alta
+        rollups.update(booked_minutes=Greatest(F('booked_minutes') + minutes, 0))
+
+
+def apply_minutes(deltas):
+    """
+    Suma (o resta) minutos a los resúmenes, con un número fijo de consultas
+    por recurso o agente sin importar cuántos días toque. Solo se crean
+    resúmenes para sumar: restar de uno inexistente no cambia nada, y en un
+    borrado en cascada el resumen ya eliminado apuntaría al recurso o agente
+    que se está borrando.
+    """
+    owners = defaultdict(dict)
+    for (field, owner_id, day), minutes in deltas.items():
+        if minutes:
+            owners[(field, owner_id)][day] = minutes
+
+    for (field, owner_id), days in owners.items():
+        rollups = list(UtilizationRollup.objects.filter(**{field: owner_id}, date__in=list(days)))
+        for rollup in rollups:
+            rollup.booked_minutes = Greatest(F('booked_minutes') + days[rollup.date], 0)
+        UtilizationRollup.objects.bulk_update(rollups, ['booked_minutes'], batch_size=500)
+
+        existing = {rollup.date for rollup in rollups}
+        missing = sorted(day for day, minutes in days.items() if minutes > 0 and day not in existing)
+        if not missing:
+            continue
+        company_id = _owner_company(field, owner_id)
+        if company_id is None:
+            continue
+        scheduled = scheduled_minutes(field, owner_id, missing)
+        try:
+            with transaction.atomic():
+                UtilizationRollup.objects.bulk_create([
+                    UtilizationRollup(
+                        company_id=company_id,
+                        date=day,
+                        booked_minutes=days[day],
+                        scheduled_minutes=scheduled[day],
+                        **{f'{field}_id': owner_id}
+                    )
+                    for day in missing
+                ], batch_size=500)
+        except IntegrityError:
+            # Otra transacción creó alguno de los resúmenes: se aplican de a uno
+            for day in missing:
+                _apply_day(field, owner_id, day, days[day])
+
+
+def record_booking_change(booking, deleted=False):
+    """Aplica la diferencia entre el estado cargado de la reserva y el actual."""
+    deltas = Counter()
+    previous = _booking_values(booking, loaded=True)
+    if previous:
+        deltas.subtract(booking_minutes(*previous))
+    if not deleted:
+        deltas.update(booking_minutes(*_booking_values(booking)))
+    apply_minutes(deltas)
+    # Los siguientes guardados de la misma instancia parten del estado actual
+    booking._loaded_values = {
+        'resource_id': booking.resource_id, 'agent_id': booking.agent_id,
+        'status': booking.status, 'start_datetime': booking.start_datetime,
+        'end_datetime': booking.end_datetime,
+    }
+
+
+def record_new_bookings(bookings):
+    """Aporte de reservas creadas en bloque, que no emiten señales."""
+    deltas = Counter()
+    for booking in bookings:
+        deltas.update(booking_minutes(*_booking_values(booking)))
+    apply_minutes(deltas)
+
+
+def refresh_scheduled_minutes(resource_id, agent_id):
+    """Recalcula los minutos de horario de hoy en adelante tras un cambio de horario."""
+    field, owner_id = ('resource', resource_id) if resource_id else ('agent', agent_id)
+    rollups = list(UtilizationRollup.objects.filter(
+        **{field: owner_id}, date__gte=timezone.localdate()
+    ))
+    minutes = scheduled_minutes(field, owner_id, [rollup.date for rollup in rollups])
+    for rollup in rollups:
+        rollup.scheduled_minutes = minutes[rollup.date]
+    UtilizationRollup.objects.bulk_update(rollups, ['scheduled_minutes'], batch_size=500)
+
+
+def rebuild_utilization(date_from, date_to):
+    """
+    Recalcula desde las reservas y los horarios los resúmenes entre
+    `date_from` y `date_to`, incluidos los días con horario pero sin
+    reservas. Devuelve el número de resúmenes creados.
+    """
+    range_start, range_end = day_bounds(date_from)[0], day_bounds(date_to)[1]
+    bookings = Booking.objects.filter(
+        status__in=ROLLUP_STATUSES,
+        start_datetime__lt=range_end,
+        end_datetime__gt=range_start
+    ).order_by().values_list('resource_id', 'agent_id', 'status', 'start_datetime', 'end_datetime')
+
+    booked = Counter()
+    for values in bookings.iterator(chunk_size=REBUILD_BATCH_SIZE):
+        for key, minutes in booking_minutes(*values).items():
+            if date_from <= key[2] <= date_to:
+                booked[key] += minutes
+
+    owners = {
+        'resource': {
+            pk: (company_id, availability_type == 'always')
+            for pk, company_id, availability_type in Resource.objects.values_list(
+                'pk', 'company_id', 'availability_type')
+        },
+        'agent': {
+            pk: (company_id, False)
+            for pk, company_id in Agent.objects.values_list('pk', 'company_id')
+        },
+    }
+    rollups = []
+    for field, companies in owners.items():
+        weekly = weekly_windows(field, list(companies))
+        for owner_id, (company_id, always) in companies.items():
+            for day in date_range(date_from, date_to):
+                if always:
+                    schedule = 24 * 60
+                else:
+                    schedule = _window_minutes(weekly.get(owner_id, {}).get(day.weekday(), []))
+                minutes = booked[(field, owner_id, day)]
+                if not schedule and not minutes:
+                    continue
+                rollups.append(UtilizationRollup(
+                    company_id=company_id,
+                    date=day,
+                    booked_minutes=minutes,
+                    scheduled_minutes=schedule,
+                    **{f'{field}_id': owner_id}
+                ))
+
+    with transaction.atomic():
+        UtilizationRollup.objects.filter(date__gte=date_from, date__lte=date_to).delete()
+        UtilizationRollup.objects.bulk_create(rollups, batch_size=500)
+    return len(rollups)
@@ -1,22 +1,51 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncWeek
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from marketplace.models import Company
 from datetime import datetime, timedelta
 from .models import (
-    BookingSettings, ResourceType, Agent, Resource, 
-    Schedule, Booking, BlockedTime
+    BookingSettings, ResourceType, Agent, Resource,
+    Booking, BlockedTime, RecurringBlock, AvailableSlot, SlotHold,
+    UtilizationRollup, ArchivedBooking, WaitlistEntry
 )
 from .serializers import (
     BookingSettingsSerializer, ResourceTypeSerializer,
-    AgentSerializer, ResourceSerializer, ScheduleSerializer,
+    AgentSerializer, ResourceSerializer,
     BookingSerializer, BlockedTimeSerializer,
-    ResourceAvailabilitySerializer
+    ResourceAvailabilitySerializer, AgentAvailabilitySerializer,
+    ResourceAvailabilityMatrixSerializer, AvailableSlotSerializer,
+    RecurringBookingSerializer, RecurringBlockSerializer, SlotHoldSerializer,
+    UtilizationSerializer, ArchivedBookingSerializer, WaitlistEntrySerializer
 )
+from .admission import lock_booking_targets, admit_occurrences, hold_slot
+from .cache import (
+    get_booking_settings, get_owned_company_ids, get_idempotent_response,
+    store_idempotent_response, acquire_idempotency_lock, release_idempotency_lock,
+    request_body_hash
+)
+from .availability import (
+    resource_available_slots, resource_agent_slots,
+    any_agent_slots, agent_free_intervals, format_slots,
+    availability_matrix, day_bounds
+)
+from .pagination import StartKeysetPagination
+from .notifications import enqueue_notification, dispatch_pending
+from .tasks import run_in_background
+from .dashboard import company_dashboard
+from .ical import feed_token, read_feed_token, feed_bookings, feed_version, render_feed
+from .waitlist import match_waitlist
 
 class IsCompanyOwnerOrAdmin(permissions.BasePermission):
     """
@@ -31,20 +60,57 @@ class IsCompanyOwnerOrAdmin(permissions.BasePermission):
             return True
             
         # Verificar si el usuario es dueño de alguna empresa
-        return request.user.company_set.exists()
+        return bool(get_owned_company_ids(request.user))
 
     def has_object_permission(self, request, view, obj):
         if request.user.is_staff:
             return True
             
-        # Obtener la empresa relacionada con el objeto
-        company = None
-        if hasattr(obj, 'company'):
-            company = obj.company
-        elif hasattr(obj, 'resource'):
-            company = obj.resource.company
+        # Obtener la empresa relacionada con el objeto; los querysets traen
+        # el recurso y el agente con select_related, así que no hay consultas
+        company_id = None
+        if hasattr(obj, 'company_id'):
+            company_id = obj.company_id
+        elif getattr(obj, 'resource_id', None):
+            company_id = obj.resource.company_id
+        elif getattr(obj, 'agent_id', None):
+            company_id = obj.agent.company_id
             
-        return company and company.user == request.user
+        return company_id in get_owned_company_ids(request.user)
+
+def id_param(params, name):
+    """Id numérico de un parámetro de consulta, o None si no se indicó."""
+    value = params.get(name)
+    if not value:
+        return None
+    if not value.isdigit():
+        raise ValidationError({"error": f"{name} debe ser un id numérico"})
+    return int(value)
+
+def day_param(params, name, default=None):
+    """Fecha AAAA-MM-DD de un parámetro de consulta, o `default` si no se indicó."""
+    value = params.get(name)
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValidationError({"error": f"{name} debe tener el formato AAAA-MM-DD"})
+
+def datetime_param(params, name):
+    """Fecha y hora ISO 8601 de un parámetro de consulta, o None si no se indicó."""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ValidationError({"error": f"{name} debe ser una fecha y hora ISO 8601"})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
 
 class BookingSettingsViewSet(viewsets.ModelViewSet):
     queryset = BookingSettings.objects.all()
@@ -54,7 +120,33 @@ class BookingSettingsViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if self.request.user.is_staff:
             return BookingSettings.objects.all()
-        return BookingSettings.objects.filter(company__user=self.request.user)
+        return BookingSettings.objects.filter(company_id__in=get_owned_company_ids(self.request.user))
+    
+    @action(detail=True, methods=['get'])
+    def calendar_feeds(self, request, pk=None):
+        """
+        URLs de suscripción a los calendarios de la empresa y de cada uno de
+        sus agentes. Requiere la sincronización de calendario activada.
+        """
+        settings = self.get_object()
+        if not settings.google_calendar_enabled:
+            return Response({
+                "error": "La sincronización de calendario no está activada"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        def feed_url(kind, owner_id):
+            return request.build_absolute_uri(
+                reverse('booking-calendar-feed', args=[feed_token(kind, owner_id)])
+            )
+        
+        agents = Agent.objects.filter(company_id=settings.company_id).values_list('pk', 'name')
+        return Response({
+            'company': feed_url('company', settings.company_id),
+            'agents': [
+                {'id': agent_id, 'name': name, 'url': feed_url('agent', agent_id)}
+                for agent_id, name in agents
+            ]
+        })
 
 class ResourceTypeViewSet(viewsets.ModelViewSet):
     queryset = ResourceType.objects.all()
@@ -64,7 +156,7 @@ class ResourceTypeViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if self.request.user.is_staff:
             return ResourceType.objects.all()
-        return ResourceType.objects.filter(company__user=self.request.user)
+        return ResourceType.objects.filter(company_id__in=get_owned_company_ids(self.request.user))
     
     def perform_create(self, serializer):
         company = get_object_or_404(Company, user=self.request.user)
@@ -78,7 +170,7 @@ class AgentViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if self.request.user.is_staff:
             return Agent.objects.all()
-        return Agent.objects.filter(company__user=self.request.user)
+        return Agent.objects.filter(company_id__in=get_owned_company_ids(self.request.user))
     
     def perform_create(self, serializer):
         company = get_object_or_404(Company, user=self.request.user)
@@ -87,31 +179,22 @@ class AgentViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def availability(self, request, pk=None):
         agent = self.get_object()
-        date_param = request.query_params.get('date', datetime.now().date())
+        date_param = day_param(request.query_params, 'date', datetime.now().date())
         
-        if isinstance(date_param, str):
-            date_param = datetime.strptime(date_param, '%Y-%m-%d').date()
-        
-        # Obtener horario del agente para ese día
-        schedule = Schedule.objects.filter(
-            agent=agent,
-            day_of_week=date_param.weekday()
-        ).first()
-        
-        if not schedule:
-            return Response({
-                'date': date_param,
-                'available_slots': []
-            })
-            
-        # Implementar lógica para obtener slots disponibles
-        # basados en el horario y las reservas existentes
-        # ...
+        # Con un recurso se devuelven sus slots atendidos por el agente;
+        # sin él, los intervalos libres del propio horario del agente
+        resource_id = id_param(request.query_params, 'resource')
+        if resource_id:
+            resource = get_object_or_404(agent.resources.all(), pk=resource_id)
+            slots = resource_agent_slots(resource, [agent], date_param)[agent.pk]
+        else:
+            slots = agent_free_intervals(agent, date_param)
         
-        return Response({
+        serializer = AgentAvailabilitySerializer({
             'date': date_param,
-            'available_slots': []  # Implementar lógica de slots
+            'available_slots': format_slots(slots)
         })
+        return Response(serializer.data)
 
 class ResourceViewSet(viewsets.ModelViewSet):
     queryset = Resource.objects.all()
@@ -119,14 +202,21 @@ class ResourceViewSet(viewsets.ModelViewSet):
     permission_classes = [IsCompanyOwnerOrAdmin]
     
     def get_queryset(self):
+        queryset = Resource.objects.select_related('type')
+        # Horarios y agentes anidados del serializer, en dos consultas por página
+        if self.action not in ('availability', 'matrix'):
+            queryset = queryset.prefetch_related('schedule_set', 'agents')
+        
         if self.request.user.is_staff:
-            return Resource.objects.all()
+            return queryset
             
-        company_resources = Resource.objects.filter(company__user=self.request.user)
+        company_resources = queryset.filter(
+            company_id__in=get_owned_company_ids(self.request.user)
+        )
         
         # Filtrar por tipo de recurso si se especifica
-        resource_type = self.request.query_params.get('type')
-        if resource_type:
+        resource_type = id_param(self.request.query_params, 'type')
+        if resource_type is not None:
             company_resources = company_resources.filter(type__id=resource_type)
             
         return company_resources
@@ -138,13 +228,14 @@ class ResourceViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def availability(self, request, pk=None):
         resource = self.get_object()
-        date_param = request.query_params.get('date', datetime.now().date())
-        
-        if isinstance(date_param, str):
-            date_param = datetime.strptime(date_param, '%Y-%m-%d').date()
+        date_param = day_param(request.query_params, 'date', datetime.now().date())
         
         # Obtener configuración de la empresa
-        settings = BookingSettings.objects.get(company=resource.company)
+        settings = get_booking_settings(resource.company_id)
+        if settings is None:
+            return Response({
+                "error": "Esta empresa no tiene habilitado el sistema de reservas"
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         # Verificar si la fecha está dentro del límite de anticipación
         max_future_date = timezone.now().date() + timedelta(days=settings.advance_booking_limit)
@@ -153,33 +244,113 @@ class ResourceViewSet(viewsets.ModelViewSet):
                 "error": f"Solo se pueden ver disponibilidad hasta {settings.advance_booking_limit} días en el futuro"
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Obtener horario del recurso para ese día
-        schedule = Schedule.objects.filter(
-            resource=resource,
-            day_of_week=date_param.weekday()
-        ).first()
+        # Slots libres según horario, duración del servicio, reservas y bloqueos.
+        # Si el tipo de recurso requiere agente, se cruzan con los horarios
+        # de un agente concreto o de cualquier agente calificado.
+        if resource.type.requires_agent:
+            agent_id = id_param(request.query_params, 'agent')
+            if agent_id:
+                agent = get_object_or_404(resource.agents.all(), pk=agent_id)
+                slots = format_slots(resource_agent_slots(resource, [agent], date_param)[agent.pk])
+            else:
+                slots = any_agent_slots(resource, date_param)
+        else:
+            slots = format_slots(resource_available_slots(resource, date_param))
+        
+        serializer = ResourceAvailabilitySerializer({
+            'date': date_param,
+            'available_slots': slots
+        })
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def matrix(self, request):
+        """
+        Disponibilidad de varios recursos para un rango de fechas en una
+        sola llamada. Se filtra por `resources` (ids separados por coma),
+        `company` o `type`, y el rango `date_from`/`date_to` se recorta al
+        límite de anticipación de cada empresa.
+        """
+        try:
+            date_from = datetime.strptime(
+                request.query_params['date_from'], '%Y-%m-%d'
+            ).date() if 'date_from' in request.query_params else timezone.now().date()
+            date_to = datetime.strptime(
+                request.query_params['date_to'], '%Y-%m-%d'
+            ).date() if 'date_to' in request.query_params else date_from + timedelta(days=6)
+        except ValueError:
+            return Response({
+                "error": "Las fechas deben tener el formato AAAA-MM-DD"
+            }, status=status.HTTP_400_BAD_REQUEST)
         
-        if not schedule:
+        today = timezone.now().date()
+        date_from = max(date_from, today)
+        if date_to < date_from:
             return Response({
-                'date': date_param,
-                'available_slots': []
-            })
-            
-        # Implementar lógica para obtener slots disponibles
-        # basados en el horario, duración del servicio y reservas existentes
-        # ...
+                "error": "date_to debe ser posterior a date_from"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        resources = self.get_queryset().filter(is_active=True)
+        resource_ids = request.query_params.get('resources')
+        if resource_ids:
+            try:
+                resources = resources.filter(id__in=[int(pk) for pk in resource_ids.split(',')])
+            except ValueError:
+                return Response({
+                    "error": "resources debe ser una lista de ids separados por coma"
+                }, status=status.HTTP_400_BAD_REQUEST)
+        for name, lookup in (('company', 'company_id'), ('type', 'type_id')):
+            value = id_param(request.query_params, name)
+            if value is not None:
+                resources = resources.filter(**{lookup: value})
+        resources = list(resources)
         
+        # Límite de anticipación de cada empresa
+        limits = {}
+        for resource in resources:
+            settings = get_booking_settings(resource.company_id)
+            limits[resource.pk] = today + timedelta(days=settings.advance_booking_limit if settings else 0)
+        if limits:
+            date_to = min(date_to, max(limits.values()))
+        
+        matrix = availability_matrix(resources, date_from, date_to, limits=limits)
+        serializer = ResourceAvailabilityMatrixSerializer(matrix, many=True)
         return Response({
-            'date': date_param,
-            'available_slots': []  # Implementar lógica de slots
+            'date_from': date_from,
+            'date_to': date_to,
+            'resources': serializer.data
         })
 
+def filter_bookings(queryset, params):
+    """
+    Filtros de los listados de reservas: rango de fechas (`date_from`,
+    `date_to`), `status` (uno o varios separados por coma), `resource`,
+    `agent` y `customer` (id del usuario que reservó).
+    """
+    try:
+        if params.get('date_from'):
+            date_from = datetime.strptime(params['date_from'], '%Y-%m-%d').date()
+            queryset = queryset.filter(start_datetime__gte=day_bounds(date_from)[0])
+        if params.get('date_to'):
+            date_to = datetime.strptime(params['date_to'], '%Y-%m-%d').date()
+            queryset = queryset.filter(start_datetime__lt=day_bounds(date_to)[1])
+    except ValueError:
+        raise ValidationError({"error": "Las fechas deben tener el formato AAAA-MM-DD"})
+    if params.get('status'):
+        queryset = queryset.filter(status__in=params['status'].split(','))
+    for name, lookup in (('resource', 'resource_id'), ('agent', 'agent_id'), ('customer', 'user_id')):
+        value = id_param(params, name)
+        if value is not None:
+            queryset = queryset.filter(**{lookup: value})
+    return queryset
+
 class BookingViewSet(viewsets.ModelViewSet):
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
+    pagination_class = StartKeysetPagination
     
     def get_permissions(self):
-        if self.action in ['create', 'list', 'retrieve']:
+        if self.action in ['create', 'list', 'retrieve', 'recurring', 'hold', 'release_hold']:
             permission_classes = [permissions.IsAuthenticated]
         else:
             permission_classes = [IsCompanyOwnerOrAdmin]
@@ -187,17 +358,73 @@ class BookingViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         user = self.request.user
+        queryset = Booking.objects.select_related('resource', 'agent', 'user')
         
-        if user.is_staff:
-            return Booking.objects.all()
-            
-        # Si el usuario es dueño de una empresa, mostrar todas las reservas de su empresa
-        if user.company_set.exists():
-            company = user.company_set.first()
-            return Booking.objects.filter(resource__company=company)
-            
-        # Si es un usuario normal, mostrar solo sus reservas
-        return Booking.objects.filter(user=user)
+        if not user.is_staff:
+            # Si el usuario es dueño de empresas, mostrar todas las reservas de ellas
+            company_ids = get_owned_company_ids(user)
+            if company_ids:
+                queryset = queryset.filter(resource__company_id__in=company_ids)
+            else:
+                # Si es un usuario normal, mostrar solo sus reservas
+                queryset = queryset.filter(user=user)
+        
+        if self.action == 'list':
+            queryset = filter_bookings(queryset, self.request.query_params)
+        return queryset
+    
+    def _idempotent(self, request, handler):
+        """
+        Atiende la solicitud una sola vez por cabecera `Idempotency-Key`: los
+        reintentos con la misma clave reciben la primera respuesta exitosa
+        desde la caché, sin validar de nuevo ni consultar las reservas. Si la
+        clave se usó con otra ruta u otro cuerpo, responde 422. Requiere una
+        caché compartida entre procesos (ver `checks.check_shared_cache`).
+        """
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return handler()
+        if len(key) > 255:
+            return Response({
+                "error": "Idempotency-Key no puede superar los 255 caracteres"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        body_hash = request_body_hash(request.data)
+        stored = get_idempotent_response(request.user.pk, key)
+        if stored:
+            return self._replay(request, stored, body_hash)
+        if not acquire_idempotency_lock(request.user.pk, key):
+            return Response({
+                "error": "Ya hay una solicitud en curso con esta Idempotency-Key"
+            }, status=status.HTTP_409_CONFLICT)
+        try:
+            # Otra solicitud con la misma clave pudo terminar entre la lectura
+            # y el bloqueo
+            stored = get_idempotent_response(request.user.pk, key)
+            if stored:
+                return self._replay(request, stored, body_hash)
+            response = handler()
+            # Solo se guardan las respuestas exitosas; un error puede reintentarse
+            if status.is_success(response.status_code):
+                store_idempotent_response(
+                    request.user.pk, key, request.path, body_hash,
+                    response.status_code, response.data
+                )
+            return response
+        finally:
+            release_idempotency_lock(request.user.pk, key)
+    
+    def _replay(self, request, stored, body_hash):
+        """Repite la respuesta guardada si la clave se usó con la misma solicitud."""
+        path, stored_hash, stored_status, data = stored
+        if path != request.path or stored_hash != body_hash:
+            return Response({
+                "error": "Esta Idempotency-Key ya se usó con otra solicitud"
+            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(data, status=stored_status, headers={'Idempotent-Replayed': 'true'})
+    
+    def create(self, request, *args, **kwargs):
+        return self._idempotent(request, lambda: super(BookingViewSet, self).create(request, *args, **kwargs))
     
     def perform_create(self, serializer):
         # Verificar disponibilidad antes de crear la reserva
@@ -207,11 +434,10 @@ class BookingViewSet(viewsets.ModelViewSet):
         agent = serializer.validated_data.get('agent')
         
         # Verificar si el recurso pertenece a una empresa con reservas habilitadas
-        if not hasattr(resource.company, 'bookingsettings'):
+        settings = get_booking_settings(resource.company_id)
+        if settings is None:
             raise PermissionDenied("Esta empresa no tiene habilitado el sistema de reservas")
         
-        settings = resource.company.bookingsettings
-        
         # Verificar si la reserva se realiza con la anticipación permitida
         max_future_date = timezone.now() + timedelta(days=settings.advance_booking_limit)
         if start_datetime.date() > max_future_date.date():
@@ -225,10 +451,96 @@ class BookingViewSet(viewsets.ModelViewSet):
             status='confirmed' if settings.automatic_confirmation else 'pending'
         )
     
+    @action(detail=False, methods=['post'])
+    def recurring(self, request):
+        """
+        Crea varias reservas a partir de una regla de recurrencia o de una
+        lista de ocurrencias. Todas se validan contra las reservas existentes
+        con una consulta por conjunto y las aceptadas se insertan en bloque;
+        la respuesta indica el resultado de cada ocurrencia.
+        """
+        return self._idempotent(request, lambda: self._create_recurring(request))
+    
+    def _create_recurring(self, request):
+        serializer = RecurringBookingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        resource = serializer.validated_data['resource']
+        agent = serializer.validated_data.get('agent')
+        occurrences = serializer.validated_data['occurrences']
+        
+        settings = get_booking_settings(resource.company_id)
+        if settings is None:
+            raise PermissionDenied("Esta empresa no tiene habilitado el sistema de reservas")
+        
+        # Reglas que no dependen de otras reservas
+        now = timezone.now()
+        max_future_date = now + timedelta(days=settings.advance_booking_limit)
+        results = [None] * len(occurrences)
+        pending = []
+        for index, (start, end) in enumerate(occurrences):
+            if start < now:
+                error = "No se pueden hacer reservas en fechas pasadas"
+            elif start > max_future_date:
+                error = f"Solo se pueden hacer reservas con {settings.advance_booking_limit} días de anticipación"
+            else:
+                pending.append(index)
+                continue
+            results[index] = {'start_datetime': start, 'end_datetime': end, 'status': 'rejected', 'error': error}
+        
+        with transaction.atomic():
+            lock_booking_targets(resource.pk, [agent.pk if agent else None])
+            admitted = admit_occurrences(
+                resource, agent, [occurrences[index] for index in pending],
+                user=request.user,
+                notes=serializer.validated_data['notes'],
+                status='confirmed' if settings.automatic_confirmation else 'pending'
+            )
+        for index, result in zip(pending, admitted):
+            results[index] = result
+        
+        accepted = sum(1 for result in results if result['status'] == 'accepted')
+        return Response({
+            'accepted': accepted,
+            'rejected': len(results) - accepted,
+            'results': results
+        }, status=status.HTTP_201_CREATED if accepted else status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['post'])
+    def hold(self, request):
+        """
+        Retiene un horario durante unos minutos mientras el usuario completa
+        la reserva. Para los demás usuarios cuenta como ocupado hasta que
+        vence, se libera o se convierte en reserva.
+        """
+        serializer = SlotHoldSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        resource = serializer.validated_data['resource']
+        agent = serializer.validated_data.get('agent')
+        
+        with transaction.atomic():
+            lock_booking_targets(resource.pk, [agent.pk if agent else None])
+            hold, conflict = hold_slot(
+                resource, agent, request.user,
+                serializer.validated_data['start_datetime'],
+                serializer.validated_data['end_datetime']
+            )
+        if conflict:
+            return Response({"error": conflict}, status=status.HTTP_409_CONFLICT)
+        return Response(SlotHoldSerializer(hold).data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['post'], url_path=r'holds/(?P<hold_id>[^/.]+)/release')
+    def release_hold(self, request, hold_id=None):
+        """Libera una retención del usuario antes de que venza."""
+        hold = get_object_or_404(SlotHold, pk=hold_id, user=request.user)
+        hold.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         booking = self.get_object()
-        settings = booking.resource.company.bookingsettings
+        settings = get_booking_settings(booking.resource.company_id)
+        if settings is None:
+            raise PermissionDenied("Esta empresa no tiene habilitado el sistema de reservas")
         
         # Verificar si está dentro del límite de cancelación
         if (booking.start_datetime - timezone.now()) < timedelta(hours=settings.cancellation_limit_hours):
@@ -239,8 +551,11 @@ class BookingViewSet(viewsets.ModelViewSet):
         booking.status = 'cancelled'
         booking.save()
         
-        # Enviar notificaciones
-        # ...
+        # Enviar notificaciones y ofrecer el horario a la lista de espera
+        # fuera del hilo de la petición
+        enqueue_notification(booking, 'cancellation')
+        run_in_background(dispatch_pending)
+        run_in_background(match_waitlist, booking.pk)
         
         return Response({'status': 'Reserva cancelada correctamente'})
 
@@ -251,8 +566,299 @@ class BlockedTimeViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return BlockedTime.objects.all()
-        return BlockedTime.objects.filter(
-            Q(resource__company__user=self.request.user) |
-            Q(agent__company__user=self.request.user)
-        )
\ No newline at end of file
+            return BlockedTime.objects.select_related('resource', 'agent')
+        company_ids = get_owned_company_ids(self.request.user)
+        return BlockedTime.objects.select_related('resource', 'agent').filter(
+            Q(resource__company_id__in=company_ids) |
+            Q(agent__company_id__in=company_ids)
+        )
+
+class RecurringBlockViewSet(viewsets.ModelViewSet):
+    queryset = RecurringBlock.objects.all()
+    serializer_class = RecurringBlockSerializer
+    permission_classes = [IsCompanyOwnerOrAdmin]
+    
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return RecurringBlock.objects.select_related('resource', 'agent')
+        company_ids = get_owned_company_ids(self.request.user)
+        return RecurringBlock.objects.select_related('resource', 'agent').filter(
+            Q(resource__company_id__in=company_ids) |
+            Q(agent__company_id__in=company_ids)
+        )
+
+class AvailableSlotPagination(LimitOffsetPagination):
+    default_limit = 100
+    max_limit = 500
+
+class AvailableSlotViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Consulta del inventario precalculado de slots libres de todo el
+    marketplace (ej: quién está libre mañana a las 19:00). Las lecturas son
+    un recorrido por rango sobre el índice de inicio del slot.
+    """
+    queryset = AvailableSlot.objects.all()
+    serializer_class = AvailableSlotSerializer
+    pagination_class = AvailableSlotPagination
+    
+    # Resultados de la búsqueda de los slots más próximos
+    SEARCH_DEFAULT_K = 10
+    SEARCH_MAX_K = 50
+    
+    def get_queryset(self):
+        queryset = AvailableSlot.objects.filter(
+            start_datetime__gte=timezone.now(),
+            resource__is_active=True
+        ).select_related('resource')
+        
+        params = self.request.query_params
+        # Slots que contienen un instante concreto
+        at = datetime_param(params, 'at')
+        if at:
+            queryset = queryset.filter(start_datetime__lte=at, end_datetime__gt=at)
+        start_from = datetime_param(params, 'start_from')
+        if start_from:
+            queryset = queryset.filter(start_datetime__gte=start_from)
+        start_to = datetime_param(params, 'start_to')
+        if start_to:
+            queryset = queryset.filter(start_datetime__lt=start_to)
+        for name, lookup in (('resource', 'resource_id'), ('company', 'resource__company_id'),
+                             ('type', 'resource__type_id')):
+            value = id_param(params, name)
+            if value is not None:
+                queryset = queryset.filter(**{lookup: value})
+        
+        return queryset
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Los `k` slots libres más próximos de todo el marketplace (ej: una
+        barbería libre el sábado después de las 18:00 en mi país). Se filtra
+        por nombre o id del tipo de recurso, categoría y país de la empresa,
+        fecha y franja horaria. El recorrido sigue el índice de inicio del slot
+        y termina en cuanto se reúnen `k` resultados, sin calcular la
+        disponibilidad completa de cada recurso.
+        """
+        params = request.query_params
+        try:
+            k = min(int(params.get('k', self.SEARCH_DEFAULT_K)), self.SEARCH_MAX_K)
+            day = datetime.strptime(
+                params['date'], '%Y-%m-%d'
+            ).date() if 'date' in params else None
+            after = datetime.strptime(
+                params['after'], '%H:%M'
+            ).time() if 'after' in params else None
+            before = datetime.strptime(
+                params['before'], '%H:%M'
+            ).time() if 'before' in params else None
+        except ValueError:
+            return Response({
+                "error": "k debe ser un número, date tener el formato AAAA-MM-DD y after/before el formato HH:MM"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if k < 1:
+            return Response({
+                "error": "k debe ser mayor que cero"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        queryset = AvailableSlot.objects.filter(
+            start_datetime__gte=timezone.now(),
+            resource__is_active=True
+        )
+        if day:
+            queryset = queryset.filter(date=day)
+        if after:
+            queryset = queryset.filter(start_datetime__time__gte=after)
+        if before:
+            queryset = queryset.filter(end_datetime__time__lte=before)
+        
+        resource_type = params.get('type')
+        if resource_type:
+            if resource_type.isdigit():
+                queryset = queryset.filter(resource__type_id=resource_type)
+            else:
+                queryset = queryset.filter(resource__type__name__icontains=resource_type)
+        for name in ('category', 'country'):
+            value = id_param(params, name)
+            if value is not None:
+                queryset = queryset.filter(**{f'resource__company__{name}_id': value})
+        
+        slots = queryset.select_related('resource').order_by('start_datetime', 'id')[:k]
+        serializer = self.get_serializer(slots, many=True)
+        return Response(serializer.data)
+
+class ArchivedBookingViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Reservas históricas para reportes. Los dueños ven las de sus empresas y
+    los demás usuarios solo las propias; admite los mismos filtros que el
+    listado de reservas.
+    """
+    queryset = ArchivedBooking.objects.all()
+    serializer_class = ArchivedBookingSerializer
+    pagination_class = StartKeysetPagination
+    
+    def get_queryset(self):
+        user = self.request.user
+        queryset = ArchivedBooking.objects.select_related('resource', 'agent', 'user')
+        
+        if not user.is_staff:
+            company_ids = get_owned_company_ids(user)
+            if company_ids:
+                queryset = queryset.filter(company_id__in=company_ids)
+            else:
+                queryset = queryset.filter(user=user)
+        
+        if self.action == 'list':
+            queryset = filter_bookings(queryset, self.request.query_params)
+        return queryset
+
+class WaitlistEntryViewSet(viewsets.ModelViewSet):
+    """
+    Lista de espera. Los usuarios se anotan para un recurso y una ventana de
+    tiempo y reciben el horario cuando se cancela una reserva compatible;
+    los dueños ven las solicitudes de los recursos de sus empresas.
+    """
+    queryset = WaitlistEntry.objects.all()
+    serializer_class = WaitlistEntrySerializer
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+    
+    def get_queryset(self):
+        user = self.request.user
+        queryset = WaitlistEntry.objects.select_related('resource', 'agent', 'user')
+        
+        if not user.is_staff:
+            company_ids = get_owned_company_ids(user)
+            if company_ids:
+                queryset = queryset.filter(resource__company_id__in=company_ids)
+            else:
+                queryset = queryset.filter(user=user)
+        
+        entry_status = self.request.query_params.get('status')
+        if entry_status:
+            queryset = queryset.filter(status=entry_status)
+        return queryset
+    
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+class UtilizationViewSet(viewsets.ViewSet):
+    """
+    Ocupación de recursos y agentes por día o por semana (`period=week`)
+    entre `date_from` y `date_to`, leída solo de los resúmenes diarios.
+    Se puede filtrar por `resource`, `agent` o `kind` (resource/agent).
+    """
+    permission_classes = [IsCompanyOwnerOrAdmin]
+    
+    def list(self, request):
+        params = request.query_params
+        today = timezone.now().date()
+        try:
+            date_to = datetime.strptime(
+                params['date_to'], '%Y-%m-%d'
+            ).date() if 'date_to' in params else today
+            date_from = datetime.strptime(
+                params['date_from'], '%Y-%m-%d'
+            ).date() if 'date_from' in params else date_to - timedelta(days=6)
+        except ValueError:
+            return Response({
+                "error": "Las fechas deben tener el formato AAAA-MM-DD"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        period = params.get('period', 'day')
+        if period not in ('day', 'week'):
+            return Response({
+                "error": "period debe ser day o week"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        rollups = UtilizationRollup.objects.filter(date__gte=date_from, date__lte=date_to)
+        if not request.user.is_staff:
+            rollups = rollups.filter(company_id__in=get_owned_company_ids(request.user))
+        for name in ('company', 'resource', 'agent'):
+            value = id_param(params, name)
+            if value is not None:
+                rollups = rollups.filter(**{f'{name}_id': value})
+        if params.get('kind') == 'resource':
+            rollups = rollups.filter(resource__isnull=False)
+        elif params.get('kind') == 'agent':
+            rollups = rollups.filter(agent__isnull=False)
+        
+        rows = rollups.annotate(
+            period=F('date') if period == 'day' else TruncWeek('date')
+        ).values('resource', 'agent', 'period').annotate(
+            booked=Sum('booked_minutes'),
+            scheduled=Sum('scheduled_minutes')
+        ).order_by('period', 'resource', 'agent')
+        
+        serializer = UtilizationSerializer(rows, many=True)
+        return Response({
+            'date_from': date_from,
+            'date_to': date_to,
+            'period': period,
+            'results': serializer.data
+        })
+
+class DashboardViewSet(viewsets.ViewSet):
+    """
+    Tablero de una empresa: reservas de hoy, próximas por recurso,
+    confirmaciones pendientes, cancelaciones de la semana e ingresos por
+    pedidos. La empresa se indica con `company`; los dueños de una sola
+    empresa pueden omitirlo.
+    """
+    permission_classes = [IsCompanyOwnerOrAdmin]
+    
+    def list(self, request):
+        company_id = request.query_params.get('company')
+        if company_id is None:
+            company_ids = get_owned_company_ids(request.user)
+            if len(company_ids) != 1:
+                return Response({
+                    "error": "Debe indicar la empresa con el parámetro company"
+                }, status=status.HTTP_400_BAD_REQUEST)
+            company_id = next(iter(company_ids))
+        else:
+            try:
+                company_id = int(company_id)
+            except ValueError:
+                return Response({
+                    "error": "company debe ser un id de empresa"
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if not request.user.is_staff and company_id not in get_owned_company_ids(request.user):
+                raise PermissionDenied("No es dueño de esta empresa")
+        
+        return Response(company_dashboard(company_id))
+
+def calendar_feed(request, token):
+    """
+    Calendario iCalendar de una empresa o de un agente, identificado por un
+    token firmado (ver `ical`). Solo se publica si la empresa tiene activada
+    la sincronización de calendario. Responde 304 si el calendario no cambió
+    desde la versión que tiene el cliente.
+    """
+    feed = read_feed_token(token)
+    if feed is None:
+        raise Http404
+    kind, pk = feed
+    if kind == 'company':
+        company = get_object_or_404(Company, pk=pk)
+        company_id, name = company.pk, company.name
+    else:
+        agent = get_object_or_404(Agent.objects.select_related('company'), pk=pk)
+        company_id, name = agent.company_id, f"{agent.name} - {agent.company.name}"
+    
+    settings = get_booking_settings(company_id)
+    if settings is None or not settings.google_calendar_enabled:
+        raise Http404
+    
+    bookings = feed_bookings(kind, pk)
+    etag, last_modified = feed_version(bookings)
+    etag = quote_etag(etag)
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = StreamingHttpResponse(
+            render_feed(bookings, name, request.get_host()),
+            content_type='text/calendar; charset=utf-8'
+        )
+    response['ETag'] = etag
+    if timestamp:
+        response['Last-Modified'] = http_date(timestamp)
+    return response
@@ -0,0 +1,89 @@
+"""
+Lista de espera de horarios ocupados.
+
+Al cancelarse una reserva, `match_waitlist` busca con una consulta sobre el
+índice (recurso, estado, ventana) la solicitud más antigua cuya ventana
+contiene el horario liberado y se lo entrega: lo reserva si la solicitud lo
+pide, o se lo retiene durante WAITLIST_OFFER_MINUTES para que complete la
+reserva. Se ejecuta fuera del hilo de la petición (ver `tasks`), por lo que
+la cancelación no espera por él.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .admission import find_conflict, hold_slot, lock_booking_targets, release_holds
+from .cache import get_booking_settings
+from .models import Booking, WaitlistEntry
+from .notifications import dispatch_pending, enqueue_notification
+
+# Minutos que se retiene el horario ofrecido a una solicitud
+WAITLIST_OFFER_MINUTES = 30
+
+
+def matching_entries(booking):
+    """Solicitudes en espera cuya ventana contiene el horario de la reserva."""
+    agent_match = Q(agent__isnull=True)
+    if booking.agent_id:
+        agent_match |= Q(agent_id=booking.agent_id)
+    return WaitlistEntry.objects.filter(
+        agent_match,
+        resource_id=booking.resource_id,
+        status='waiting',
+        window_start__lte=booking.start_datetime,
+        window_end__gte=booking.end_datetime
+    ).exclude(user_id=booking.user_id).select_related('user').order_by('created_at', 'pk')
+
+
+def match_waitlist(booking_id):
+    """
+    Entrega el horario de una reserva cancelada a la primera solicitud
+    compatible. Devuelve la solicitud atendida o None.
+    """
+    booking = Booking.objects.select_related('resource', 'agent').filter(
+        pk=booking_id, status='cancelled', start_datetime__gt=timezone.now()
+    ).first()
+    if booking is None:
+        return None
+    resource = booking.resource
+    company_settings = get_booking_settings(resource.company_id)
+    if company_settings is None:
+        return None
+
+    with transaction.atomic():
+        lock_booking_targets(resource.pk, [booking.agent_id])
+        entry = matching_entries(booking).select_for_update(of=('self',)).first()
+        if entry is None:
+            return None
+        # Otra solicitud pudo ocupar el horario antes de llegar aquí
+        if find_conflict(resource, booking.agent, booking.start_datetime,
+                         booking.end_datetime, user=entry.user):
+            return None
+
+        if entry.auto_book:
+            entry.booking = Booking.objects.create(
+                user=entry.user,
+                resource=resource,
+                agent=booking.agent,
+                start_datetime=booking.start_datetime,
+                end_datetime=booking.end_datetime,
+                status='confirmed' if company_settings.automatic_confirmation else 'pending',
+                notes="Reserva desde la lista de espera"
+            )
+            release_holds(entry.user, resource, [entry.booking])
+            entry.status = 'booked'
+            enqueue_notification(entry.booking, 'waitlist_booked', waitlist_entry=entry)
+        else:
+            hold, conflict = hold_slot(
+                resource, booking.agent, entry.user,
+                booking.start_datetime, booking.end_datetime,
+                minutes=WAITLIST_OFFER_MINUTES
+            )
+            if conflict:
+                return None
+            entry.status = 'offered'
+            entry.offer_expires_at = hold.expires_at
+            enqueue_notification(booking, 'waitlist_offer', waitlist_entry=entry)
+        entry.save(update_fields=['status', 'booking', 'offer_expires_at'])
+
+    dispatch_pending()
+    return entry